@@ -0,0 +1,129 @@
+"""接口准入控制：按接口类别限制并发，超出时快速拒绝
+
+每个类别有并发上限和有界等待队列：
+- 有空闲名额时直接执行；
+- 名额已满但等待队列未满时排队，最多等待queue_timeout秒，超时返回503；
+- 等待队列也已满时立即返回429。
+拒绝的响应都带有Retry-After。每个类别还有自己的数据库语句超时，
+在请求线程中通过db_utils.set_statement_timeout生效，轻量接口不会被慢查询长时间占住连接。
+"""
+import threading
+import time
+
+import db_utils
+
+
+class EndpointClass:
+    """一类接口的并发上限、等待队列和语句超时"""
+
+    def __init__(self, name, max_concurrent, max_queue, queue_timeout, statement_timeout_ms, retry_after):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.statement_timeout_ms = statement_timeout_ms
+        self.retry_after = retry_after
+        self._condition = threading.Condition()
+        self._active = 0
+        self._waiting = 0
+        self._admitted = 0
+        self._rejected_queue_full = 0
+        self._rejected_timeout = 0
+        self._max_wait_seconds = 0.0
+
+    def acquire(self):
+        """申请执行名额
+
+        返回:
+        int: 200表示获得名额；429表示等待队列已满；503表示排队超时
+        """
+        with self._condition:
+            if self._active < self.max_concurrent:
+                self._active += 1
+                self._admitted += 1
+                return 200
+            if self._waiting >= self.max_queue:
+                self._rejected_queue_full += 1
+                return 429
+
+            self._waiting += 1
+            started = time.monotonic()
+            deadline = started + self.queue_timeout
+            try:
+                while self._active >= self.max_concurrent:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._rejected_timeout += 1
+                        return 503
+                    self._condition.wait(remaining)
+            finally:
+                self._waiting -= 1
+            self._max_wait_seconds = max(self._max_wait_seconds, time.monotonic() - started)
+            self._active += 1
+            self._admitted += 1
+            return 200
+
+    def release(self):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify()
+
+    def stats(self):
+        with self._condition:
+            return {
+                "class": self.name,
+                "active": self._active,
+                "waiting": self._waiting,
+                "max_concurrent": self.max_concurrent,
+                "max_queue": self.max_queue,
+                "statement_timeout_ms": self.statement_timeout_ms,
+                "admitted": self._admitted,
+                "rejected_queue_full": self._rejected_queue_full,
+                "rejected_timeout": self._rejected_timeout,
+                "max_wait_seconds": round(self._max_wait_seconds, 3)
+            }
+
+
+# 接口类别：
+# light - 快照或缓存即可返回的单只股票、收益率等查询
+# heavy - 需要查询数据库的批量和非默认窗口查询、实时写入
+# maintenance - 刷新和建索引，同一时间只允许一个，不排队
+ENDPOINT_CLASSES = {
+    "light": EndpointClass("light", max_concurrent=32, max_queue=64, queue_timeout=2.0, statement_timeout_ms=2000, retry_after=1),
+    "heavy": EndpointClass("heavy", max_concurrent=4, max_queue=8, queue_timeout=10.0, statement_timeout_ms=30000, retry_after=5),
+    "maintenance": EndpointClass("maintenance", max_concurrent=1, max_queue=0, queue_timeout=0.0, statement_timeout_ms=0, retry_after=30)
+}
+
+
+class Admission:
+    """一次请求持有的名额，with语句退出时释放并恢复语句超时"""
+
+    def __init__(self, endpoint_class):
+        self.endpoint_class = endpoint_class
+        self.status = None
+        self._previous_timeout = None
+
+    def __enter__(self):
+        self.status = self.endpoint_class.acquire()
+        if self.status == 200:
+            self._previous_timeout = db_utils.get_statement_timeout()
+            db_utils.set_statement_timeout(self.endpoint_class.statement_timeout_ms)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.status == 200:
+            db_utils.set_statement_timeout(self._previous_timeout)
+            self.endpoint_class.release()
+        return False
+
+    @property
+    def admitted(self):
+        return self.status == 200
+
+
+def admit(class_name):
+    """申请指定类别的执行名额，用法: with admission.admit("light") as ticket: ..."""
+    return Admission(ENDPOINT_CLASSES[class_name])
+
+def get_stats():
+    return {name: endpoint_class.stats() for name, endpoint_class in ENDPOINT_CLASSES.items()}
@@ -1,8 +1,21 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 import json
+import os
+from functools import wraps
 from decimal import Decimal
+import admission
 import db_utils
 import data_processor
+import ingest
+import refresh_pipeline
+import refresh_scheduler
+import shadow_compare
+import signal_feed
+import snapshot_store
+import startup
+import strategies
+import stock_cache
+import storage
 
 app = Flask(__name__)
 
@@ -21,6 +34,8 @@ def index():
     <p>可用的API端点:</p>
     <ul>
         <li><a href="/api/stocks">/api/stocks</a> - 获取有买卖点信号的股票数据（最近20个交易日内）</li>
+        <li><code>since=数据版本</code> - /api/stocks只返回该版本之后新增、变化和移除的股票（响应中的<code>data_version</code>作为下次的since），例如: <a href="/api/stocks?since=1">/api/stocks?since=1</a></li>
+        <li><code>days=20|60|120</code> - /api/stocks、/api/stocks/股票代码 和 /api/returns 的可选回看交易日数，例如: <a href="/api/returns?days=60">/api/returns?days=60</a></li>
         <li>/api/stocks/股票代码 - 获取单只股票数据 (例如: <a href="/api/stocks/000001.SZ">/api/stocks/000001.SZ</a>)</li>
         <li><a href="/api/refresh">/api/refresh</a> - 强制刷新计算结果
             <ul>
@@ -28,15 +43,38 @@ def index():
                     <ul>
                         <li><code>optimized=true|false</code> - 是否使用优化计算（默认为true）</li>
                         <li><code>batch_size=整数</code> - 批处理大小（默认为100）</li>
+                        <li><code>pipelined=true|false</code> - 是否使用读取/计算/写入重叠的流水线计算（默认为false）</li>
+                        <li><code>queue_depth=整数</code> - 流水线阶段之间的队列深度（默认为2）</li>
+                        <li><code>force=true|false</code> - 数据指纹（窗口内最大交易日、行数、最大id）与上次刷新相同时默认跳过，force=true强制重新计算（默认为false）</li>
+                        <li><code>panel=true|false</code> - 是否使用截面计算：一次读取全市场窗口，用(股票×交易日)矩阵整体计算信号（默认为false）</li>
+                        <li><code>distributed=true|false</code> - 是否使用分布式计算：分片写入工作队列表，由多个工作进程并行领取（默认为false）</li>
+                        <li><code>workers=整数</code> - 分布式计算时本机启动的工作进程数（默认为2）</li>
                     </ul>
                 </li>
                 <li>例如: <a href="/api/refresh?batch_size=50">/api/refresh?batch_size=50</a> - 使用批大小为50的优化计算</li>
                 <li>例如: <a href="/api/refresh?optimized=false">/api/refresh?optimized=false</a> - 使用常规计算</li>
+                <li>例如: <a href="/api/refresh?pipelined=true&queue_depth=4">/api/refresh?pipelined=true&amp;queue_depth=4</a> - 使用流水线计算</li>
             </ul>
         </li>
+        <li>POST /api/stocks/batch - 批量获取多只股票数据，请求体: <code>{"ts_codes": ["000001.SZ", ...], "columns": ["trade_date", "close"]}</code>（columns可选）</li>
+        <li>POST /api/ingest - 写入新K线并立即计算信号，请求体: <code>{"bars": [{"ts_code": "000001.SZ", "trade_date": "2023-02-20", "close": 11.71, "vol": 1177748.95}, ...]}</code></li>
+        <li><a href="/api/signals/stream">/api/signals/stream</a> - 以Server-Sent Events推送新增或变化的买卖点信号，可选<code>ts_codes=000001.SZ,600000.SH</code>只订阅指定股票，断线重连时通过<code>Last-Event-ID</code>续传</li>
+        <li><a href="/api/signals/stream-stats">/api/signals/stream-stats</a> - 信号推送的订阅者和事件统计</li>
         <li><a href="/api/returns">/api/returns</a> - 获取所有股票的收益率统计</li>
+        <li><a href="/api/strategies">/api/strategies</a> - 已注册的插件策略（需要的列和回看行数）</li>
+        <li>/api/strategies/策略id/signals - 窗口内某个插件策略的信号，可选<code>ts_code</code>、<code>days</code>，例如: <a href="/api/strategies/ma120_breakout/signals">/api/strategies/ma120_breakout/signals</a></li>
+        <li><a href="/api/market-breadth">/api/market-breadth</a> - 全市场每日的买点数、卖点数、平均收益率和有交易的股票数，可选<code>start=2023-01-01&amp;end=2023-03-31</code>（YYYY-MM-DD或YYYYMMDD）</li>
+        <li><a href="/api/leaderboard">/api/leaderboard</a> - 排行榜，只返回前<code>top</code>只股票（默认50，最多500），<code>order_by=return_rate|signal_count|latest_signal_date</code>，<code>signal_type=any|buy|sell</code>，支持<code>days</code></li>
         <li><a href="/api/all-stocks">/api/all-stocks</a> - 获取数据库中所有股票的完整列表（不只限于有信号的股票）</li>
-        <li><a href="/api/index">/api/index</a> - 创建或更新数据库索引以提升查询性能</li>
+        <li><a href="/api/refresh/status">/api/refresh/status</a> - 刷新调度器状态（定时表达式、下次定时刷新时间、最近的数据指纹）和最近一次刷新记录</li>
+        <li><a href="/api/index">/api/index</a> - 创建或更新数据库索引以提升查询性能（不阻塞写入），并报告热点查询是否使用了预期索引（<code>advise=false</code>跳过检查）</li>
+        <li><a href="/api/shadow-compare">/api/shadow-compare</a> - 影子比对：在相同数据上运行逐行计算和候选引擎（<code>engine=panel|ingest</code>，可选<code>limit</code>、<code>ts_codes</code>），返回不一致报告和加速比，不写入数据库</li>
+        <li><a href="/api/admission-stats">/api/admission-stats</a> - 各接口类别（light/heavy/maintenance）的并发、排队和拒绝统计</li>
+        <li><a href="/api/replica-status">/api/replica-status</a> - 只读副本的健康状态、回放位置和读取次数</li>
+        <li><a href="/api/cache-stats">/api/cache-stats</a> - 单只股票缓存的命中率统计</li>
+        <li><a href="/api/partitions">/api/partitions</a> - high_level_inflows的月份分区、估计行数和保留策略</li>
+        <li><a href="/healthz">/healthz</a> - 存活检查</li>
+        <li><a href="/readyz">/readyz</a> - 就绪检查（快照加载完成后返回200）</li>
     </ul>
     
     <h2>性能优化说明</h2>
@@ -49,28 +87,310 @@ def index():
     <p>使用<a href="/api/index">/api/index</a>端点可以创建或更新数据库索引，在大量数据的情况下这会显著提升查询速度。</p>
     '''
 
+def parse_days():
+    """解析days参数，返回(days, 错误响应)；未提供时days为None"""
+    days = request.args.get('days', default=None, type=int)
+    if days is not None and days not in db_utils.STANDARD_WINDOWS:
+        return None, (json.dumps({"error": f"days只支持 {list(db_utils.STANDARD_WINDOWS)}"}, ensure_ascii=False), 400, {'Content-Type': 'application/json; charset=utf-8'})
+    return days, None
+
+def warming_up_response():
+    """快照预热尚未完成时的响应"""
+    return json.dumps({"error": "服务正在预热，请稍后重试"}, ensure_ascii=False), 503, {'Content-Type': 'application/json; charset=utf-8', 'Retry-After': '5'}
+
+def snapshot_pending(days=None):
+    """默认窗口的结果来自内存快照；快照未加载（预热中，或预热失败等待刷新）时返回503，
+    读请求不在请求中从数据库加载或重新计算快照"""
+    return days in (None, db_utils.TRADING_DAYS_LIMIT) and not startup.is_ready()
+
+def limited(endpoint_class):
+    """按接口类别做准入控制；endpoint_class可以是类别名，或根据请求返回类别名的函数"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            class_name = endpoint_class() if callable(endpoint_class) else endpoint_class
+            with admission.admit(class_name) as ticket:
+                if not ticket.admitted:
+                    reason = "请求排队已满" if ticket.status == 429 else "排队等待超时"
+                    body = {"error": f"服务繁忙（{reason}），请稍后重试", "endpoint_class": class_name}
+                    return json.dumps(body, ensure_ascii=False), ticket.status, {'Content-Type': 'application/json; charset=utf-8', 'Retry-After': str(ticket.endpoint_class.retry_after)}
+                return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def local_unsupported_response():
+    """本地SQLite存储模式下不支持的接口的响应"""
+    return json.dumps({"error": "本地存储模式（SQLite）不支持此接口，需要PostgreSQL", "storage_backend": storage.get_repository().name}, ensure_ascii=False), 501, {'Content-Type': 'application/json; charset=utf-8'}
+
+def postgres_only(view):
+    """只支持PostgreSQL的接口，本地存储模式下返回501"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if storage.is_local():
+            return local_unsupported_response()
+        return view(*args, **kwargs)
+    return wrapper
+
+def days_class():
+    """默认窗口从快照返回，非默认窗口需要查询数据库"""
+    days = request.args.get('days', default=None, type=int)
+    return "light" if days in (None, db_utils.TRADING_DAYS_LIMIT) else "heavy"
+
+@app.route('/healthz')
+def healthz():
+    """存活检查：进程能响应即返回200"""
+    return json.dumps({"status": "ok", "uptime_seconds": startup.get_status()["uptime_seconds"]}), 200, {'Content-Type': 'application/json; charset=utf-8'}
+
+@app.route('/readyz')
+def readyz():
+    """就绪检查：内存快照加载完成后返回200，否则返回503"""
+    status = startup.get_status()
+    return json.dumps(status, ensure_ascii=False), 200 if status["ready"] else 503, {'Content-Type': 'application/json; charset=utf-8'}
+
 @app.route('/api/stocks')
+@limited(days_class)
 def all_stocks():
-    """返回所有股票数据"""
-    result = data_processor.get_all_stocks_data()
+    """返回所有股票数据，可选days参数指定回看交易日数，since参数只返回该数据版本之后的变化"""
+    days, error = parse_days()
+    if error:
+        return error
+    since = request.args.get('since', default=None, type=int)
+    if since is not None and days not in (None, db_utils.TRADING_DAYS_LIMIT):
+        return json.dumps({"error": "since只支持默认回看窗口"}, ensure_ascii=False), 400, {'Content-Type': 'application/json; charset=utf-8'}
+    if snapshot_pending(days):
+        return warming_up_response()
+    if since is not None:
+        result = data_processor.get_stocks_delta(since)
+        if isinstance(result, snapshot_store.SnapshotReader):
+            # 变更记录不可用，回退为全量
+            return Response(result.iter_json({"delta": False}), 200, {'Content-Type': 'application/json; charset=utf-8'})
+    else:
+        result = data_processor.get_all_stocks_data(days)
+        if isinstance(result, snapshot_store.SnapshotReader):
+            # 默认窗口直接输出快照文件中编码好的JSON
+            return Response(result.iter_json(), 200, {'Content-Type': 'application/json; charset=utf-8'})
     return json.dumps(result, ensure_ascii=False, cls=CustomJSONEncoder), 200, {'Content-Type': 'application/json; charset=utf-8'}
 
 @app.route('/api/stocks/<string:ts_code>')
+@limited(days_class)
 def single_stock(ts_code):
-    """返回单只股票数据"""
-    result = db_utils.get_single_stock_data(ts_code)
+    """返回单只股票数据，可选days参数指定回看交易日数"""
+    days, error = parse_days()
+    if error:
+        return error
+    result = data_processor.get_single_stock_data(ts_code, days)
     return json.dumps(result, ensure_ascii=False, cls=CustomJSONEncoder), 200, {'Content-Type': 'application/json; charset=utf-8'}
 
+# 批量查询最多支持的股票数
+MAX_BATCH_TS_CODES = 500
+
+@app.route('/api/stocks/batch', methods=['POST'])
+@limited("heavy")
+def batch_stocks():
+    """批量返回多只股票数据，请求体: {"ts_codes": [...], "columns": [...](可选)}"""
+    payload = request.get_json(silent=True) or {}
+    ts_codes = payload.get("ts_codes")
+    columns = payload.get("columns")
+    
+    if not isinstance(ts_codes, list) or not ts_codes or not all(isinstance(ts_code, str) for ts_code in ts_codes):
+        return json.dumps({"error": "请求体需要包含非空的ts_codes字符串列表"}, ensure_ascii=False), 400, {'Content-Type': 'application/json; charset=utf-8'}
+    if len(ts_codes) > MAX_BATCH_TS_CODES:
+        return json.dumps({"error": f"一次最多查询 {MAX_BATCH_TS_CODES} 只股票"}, ensure_ascii=False), 400, {'Content-Type': 'application/json; charset=utf-8'}
+    if columns is not None:
+        unknown = [column for column in columns if column not in db_utils.STOCK_COLUMN_NAMES] if isinstance(columns, list) else columns
+        if unknown:
+            return json.dumps({"error": f"未知的列: {unknown}", "column_names": db_utils.STOCK_COLUMN_NAMES}, ensure_ascii=False), 400, {'Content-Type': 'application/json; charset=utf-8'}
+    
+    results = data_processor.get_multiple_stocks_data(ts_codes, columns)
+    if isinstance(results.get("error"), str):
+        return json.dumps(results, ensure_ascii=False), 500, {'Content-Type': 'application/json; charset=utf-8'}
+    
+    return json.dumps({"results": results, "count": len(results)}, ensure_ascii=False, cls=CustomJSONEncoder), 200, {'Content-Type': 'application/json; charset=utf-8'}
+
+# 一次写入最多支持的K线数
+MAX_INGEST_BARS = 5000
+
+@app.route('/api/ingest', methods=['POST'])
+@postgres_only
+@limited("heavy")
+def ingest_bars():
+    """写入新K线并立即计算信号，请求体: {"bars": [...]} 或单根K线，整批在一个事务中写入"""
+    payload = request.get_json(silent=True)
+    bars = payload.get("bars", [payload]) if isinstance(payload, dict) else None
+    
+    if not isinstance(bars, list) or not bars or not all(isinstance(bar, dict) for bar in bars):
+        return json.dumps({"error": "请求体需要包含K线对象或非空的bars列表"}, ensure_ascii=False), 400, {'Content-Type': 'application/json; charset=utf-8'}
+    if len(bars) > MAX_INGEST_BARS:
+        return json.dumps({"error": f"一次最多写入 {MAX_INGEST_BARS} 根K线"}, ensure_ascii=False), 400, {'Content-Type': 'application/json; charset=utf-8'}
+    
+    # 多进程服务中K线缓冲区只保留在负责实时写入的工作进程中，其他工作进程转发请求
+    if ingest.owner_address is not None:
+        try:
+            status, body, headers = ingest.forward_ingest(request.get_data())
+        except OSError as e:
+            print(f"⚠️ 转发实时写入请求出错: {str(e)}")
+            return json.dumps({"error": "负责实时写入的工作进程暂不可用，请稍后重试"}, ensure_ascii=False), 503, {'Content-Type': 'application/json; charset=utf-8', 'Retry-After': '1'}
+        return body, status, headers
+    
+    try:
+        results = ingest.ingest_bars(bars)
+    except ValueError as e:
+        return json.dumps({"error": str(e)}, ensure_ascii=False), 400, {'Content-Type': 'application/json; charset=utf-8'}
+    except Exception as e:
+        return json.dumps({"error": str(e)}, ensure_ascii=False), 500, {'Content-Type': 'application/json; charset=utf-8'}
+    
+    return json.dumps({"results": results, "count": len(results)}, ensure_ascii=False, cls=CustomJSONEncoder), 200, {'Content-Type': 'application/json; charset=utf-8'}
+
+@app.route('/api/signals/stream')
+def signals_stream():
+    """以SSE推送新增或变化的买卖点信号，可选ts_codes参数（逗号分隔）只订阅指定股票"""
+    ts_codes = [ts_code.strip() for ts_code in request.args.get('ts_codes', '').split(',') if ts_code.strip()]
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    subscriber, resumed = signal_feed.feed.subscribe(ts_codes, last_event_id)
+    return Response(
+        stream_with_context(signal_feed.feed.stream(subscriber, resumed)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/signals/stream-stats')
+def signals_stream_stats():
+    """返回信号推送的订阅者数和事件统计"""
+    return json.dumps(signal_feed.feed.stats(), ensure_ascii=False), 200, {'Content-Type': 'application/json; charset=utf-8'}
+
+@app.route('/api/admission-stats')
+def admission_stats():
+    """返回各接口类别的并发、排队和拒绝统计"""
+    return json.dumps(admission.get_stats(), ensure_ascii=False), 200, {'Content-Type': 'application/json; charset=utf-8'}
+
+@app.route('/api/shadow-compare')
+@limited("maintenance")
+def shadow_compare_engines():
+    """影子比对：逐行计算与候选引擎在相同数据上的结果和耗时对比，不写入数据库"""
+    try:
+        candidate = request.args.get('engine', default='panel', type=str)
+        limit = request.args.get('limit', default=None, type=int)
+        ts_codes = request.args.get('ts_codes', default=None, type=str)
+        if candidate not in shadow_compare.CANDIDATE_ENGINES:
+            return json.dumps({"error": f"未知的候选引擎: {candidate}", "engines": list(shadow_compare.CANDIDATE_ENGINES)}, ensure_ascii=False), 400, {'Content-Type': 'application/json; charset=utf-8'}
+        ts_codes = [code.strip() for code in ts_codes.split(',') if code.strip()] if ts_codes else None
+        report = shadow_compare.compare_engines(candidate, ts_codes=ts_codes, limit=limit)
+        return json.dumps(report, ensure_ascii=False, cls=CustomJSONEncoder), 200, {'Content-Type': 'application/json; charset=utf-8'}
+    except Exception as e:
+        print(f"❌ 影子比对出错: {str(e)}")
+        return json.dumps({"error": str(e)}, ensure_ascii=False), 500, {'Content-Type': 'application/json; charset=utf-8'}
+
+@app.route('/api/replica-status')
+def replica_status():
+    """返回只读副本的健康状态和读取次数"""
+    return json.dumps(db_utils.get_replica_status(), ensure_ascii=False), 200, {'Content-Type': 'application/json; charset=utf-8'}
+
+@app.route('/api/partitions')
+@postgres_only
+def signal_partitions():
+    """返回high_level_inflows的月份分区和保留策略"""
+    result = db_utils.get_signal_partitions()
+    status = 500 if "error" in result else 200
+    return json.dumps(result, ensure_ascii=False), status, {'Content-Type': 'application/json; charset=utf-8'}
+
+@app.route('/api/cache-stats')
+def cache_stats():
+    """返回单只股票缓存的命中率统计"""
+    return json.dumps(stock_cache.single_stock_cache.stats(), ensure_ascii=False), 200, {'Content-Type': 'application/json; charset=utf-8'}
+
 @app.route('/api/returns')
+@limited(days_class)
 def stock_returns():
-    """返回所有股票的收益率统计"""
-    result = data_processor.get_all_stocks_data()
+    """返回所有股票的收益率统计，可选days参数指定回看交易日数"""
+    days, error = parse_days()
+    if error:
+        return error
+    if snapshot_pending(days):
+        return warming_up_response()
+    result = data_processor.get_stock_returns(days)
+    if isinstance(result, snapshot_store.SnapshotReader):
+        return Response(result.iter_returns_json(), 200, {'Content-Type': 'application/json; charset=utf-8'})
     if "stock_returns" in result:
         return json.dumps({"stock_returns": result["stock_returns"]}, ensure_ascii=False, cls=CustomJSONEncoder), 200, {'Content-Type': 'application/json; charset=utf-8'}
     else:
         return json.dumps({"error": "没有找到收益率数据"}, ensure_ascii=False), 200, {'Content-Type': 'application/json; charset=utf-8'}
 
+@app.route('/api/market-breadth')
+@limited("light")
+def market_breadth():
+    """返回交易日范围内全市场每日的买卖点信号数、平均收益率和有交易的股票数"""
+    repository = storage.get_repository()
+    # 参数按trade_date列已有取值的格式绑定（date列或YYYY-MM-DD、YYYYMMDD文本列）
+    latest_dates = repository.latest_trading_dates(1)
+    sample = latest_dates[0] if latest_dates else None
+    try:
+        start_date = request.args.get('start', default=None, type=str)
+        end_date = request.args.get('end', default=None, type=str)
+        start_date = ingest.parse_trade_date(start_date, sample) if start_date else None
+        end_date = ingest.parse_trade_date(end_date, sample) if end_date else None
+    except ValueError as e:
+        return json.dumps({"error": str(e)}, ensure_ascii=False), 400, {'Content-Type': 'application/json; charset=utf-8'}
+    if start_date and end_date and start_date > end_date:
+        return json.dumps({"error": "start不能晚于end"}, ensure_ascii=False), 400, {'Content-Type': 'application/json; charset=utf-8'}
+    result = repository.market_breadth(start_date, end_date)
+    if "error" in result:
+        return json.dumps({"error": result["error"]}, ensure_ascii=False), 200, {'Content-Type': 'application/json; charset=utf-8'}
+    return json.dumps(result, ensure_ascii=False, cls=CustomJSONEncoder), 200, {'Content-Type': 'application/json; charset=utf-8'}
+
+@app.route('/api/strategies')
+def list_strategies():
+    """返回已注册的插件策略及其需要的列和回看行数"""
+    return json.dumps({"strategies": [strategy.to_dict() for strategy in strategies.STRATEGIES.values()]}, ensure_ascii=False), 200, {'Content-Type': 'application/json; charset=utf-8'}
+
+@app.route('/api/strategies/<strategy_id>/signals')
+@postgres_only
+@limited(days_class)
+def strategy_signals(strategy_id):
+    """返回窗口内某个插件策略的信号，可选ts_code只看一只股票"""
+    if strategy_id not in strategies.STRATEGIES:
+        return json.dumps({"error": f"未知的策略: {strategy_id}", "strategies": list(strategies.STRATEGIES)}, ensure_ascii=False), 404, {'Content-Type': 'application/json; charset=utf-8'}
+    days, error = parse_days()
+    if error:
+        return error
+    ts_code = request.args.get('ts_code', default=None, type=str)
+    result = db_utils.get_strategy_signals(strategy_id, ts_code, days or db_utils.TRADING_DAYS_LIMIT)
+    if "error" in result:
+        return json.dumps({"error": result["error"]}, ensure_ascii=False), 200, {'Content-Type': 'application/json; charset=utf-8'}
+    result["strategy"] = strategies.STRATEGIES[strategy_id].to_dict()
+    return json.dumps(result, ensure_ascii=False, cls=CustomJSONEncoder), 200, {'Content-Type': 'application/json; charset=utf-8'}
+
+# 排行榜默认和最多返回的股票数
+DEFAULT_LEADERBOARD_TOP = 50
+MAX_LEADERBOARD_TOP = 500
+
+@app.route('/api/leaderboard')
+@limited(days_class)
+def leaderboard():
+    """返回按收益率、信号数或最近信号日期排名的前top只股票"""
+    days, error = parse_days()
+    if error:
+        return error
+    top = request.args.get('top', default=DEFAULT_LEADERBOARD_TOP, type=int)
+    order_by = request.args.get('order_by', default='return_rate', type=str)
+    signal_type = request.args.get('signal_type', default='any', type=str)
+    if top is None or not 1 <= top <= MAX_LEADERBOARD_TOP:
+        return json.dumps({"error": f"top必须在1到{MAX_LEADERBOARD_TOP}之间"}, ensure_ascii=False), 400, {'Content-Type': 'application/json; charset=utf-8'}
+    if order_by not in db_utils.LEADERBOARD_ORDER_BY:
+        return json.dumps({"error": f"order_by必须是: {', '.join(db_utils.LEADERBOARD_ORDER_BY)}"}, ensure_ascii=False), 400, {'Content-Type': 'application/json; charset=utf-8'}
+    if signal_type not in db_utils.LEADERBOARD_SIGNAL_FILTERS:
+        return json.dumps({"error": f"signal_type必须是: {', '.join(db_utils.LEADERBOARD_SIGNAL_FILTERS)}"}, ensure_ascii=False), 400, {'Content-Type': 'application/json; charset=utf-8'}
+    if snapshot_pending(days):
+        return warming_up_response()
+    if days not in (None, db_utils.TRADING_DAYS_LIMIT) and storage.is_local():
+        return local_unsupported_response()
+    result = data_processor.get_leaderboard(top, order_by, signal_type, days)
+    if "error" in result:
+        return json.dumps({"error": result["error"]}, ensure_ascii=False), 500, {'Content-Type': 'application/json; charset=utf-8'}
+    result.update({"top": top, "order_by": order_by, "signal_type": signal_type})
+    return json.dumps(result, ensure_ascii=False, cls=CustomJSONEncoder), 200, {'Content-Type': 'application/json; charset=utf-8'}
+
 @app.route('/api/all-stocks')
+@limited("heavy")
 def get_all_stocks_list():
     """获取数据库中所有股票的列表，不仅仅是有信号的股票"""
     try:
@@ -82,11 +402,15 @@ def get_all_stocks_list():
     except Exception as e:
         return json.dumps({"error": str(e)}, ensure_ascii=False), 500, {'Content-Type': 'application/json; charset=utf-8'}
 
+# 计算方式的显示名称
+REFRESH_METHOD_NAMES = {"legacy": "常规", "optimized": "优化", "pipelined": "流水线", "panel": "截面", "distributed": "分布式"}
+
 @app.route('/api/refresh')
+@limited("maintenance")
 def refresh_data():
-    """强制刷新数据"""
+    """刷新数据；数据指纹与上次刷新相同时跳过，force=true时强制重新计算"""
     try:
-        print("\n===== 强制刷新数据开始 =====")
+        print("\n===== 刷新数据开始 =====")
         
         # 获取批处理大小参数
         batch_size = request.args.get('batch_size', default=100, type=int)
@@ -94,32 +418,77 @@ def refresh_data():
         # 获取是否使用优化计算的参数
         use_optimized = request.args.get('optimized', default='true', type=str).lower() == 'true'
         
-        # 根据参数选择使用哪个计算函数
-        if use_optimized:
-            print(f"使用优化计算函数，批处理大小: {batch_size}")
-            result = data_processor.compute_stocks_data_optimized(force_recompute=True, batch_size=batch_size)
+        # 获取是否使用流水线计算的参数
+        use_pipelined = request.args.get('pipelined', default='false', type=str).lower() == 'true'
+        queue_depth = request.args.get('queue_depth', default=refresh_pipeline.DEFAULT_QUEUE_DEPTH, type=int)
+        
+        # 获取是否使用分布式计算的参数
+        use_distributed = request.args.get('distributed', default='false', type=str).lower() == 'true'
+        workers = request.args.get('workers', default=2, type=int)
+        
+        # 获取是否使用截面（整矩阵）计算的参数
+        use_panel = request.args.get('panel', default='false', type=str).lower() == 'true'
+        
+        # 获取是否忽略数据指纹强制刷新的参数
+        force = request.args.get('force', default='false', type=str).lower() == 'true'
+        
+        # 根据参数选择计算方式
+        if use_panel:
+            method = "panel"
+        elif use_distributed:
+            method = "distributed"
+        elif use_pipelined:
+            method = "pipelined"
+        elif use_optimized:
+            method = "optimized"
         else:
-            print("使用常规计算函数")
-            result = data_processor.compute_all_stocks_data(force_recompute=True)
+            method = "legacy"
+        print(f"使用{REFRESH_METHOD_NAMES[method]}计算函数，批处理大小: {batch_size}")
+        
+        result = refresh_scheduler.run_refresh(method, force=force, trigger="manual",
+                                               batch_size=batch_size, queue_depth=queue_depth, workers=workers)
         
-        print("===== 强制刷新数据完成 =====\n")
+        print("===== 刷新数据完成 =====\n")
+        
+        if result.get("skipped"):
+            if result["reason"] == "running":
+                return json.dumps({"error": result["message"]}, ensure_ascii=False), 429, {'Content-Type': 'application/json; charset=utf-8', 'Retry-After': '30'}
+            return json.dumps({"success": True, "skipped": True, "message": result["message"],
+                               "fingerprint": result["fingerprint"], "last_run": result["last_run"]},
+                              ensure_ascii=False, cls=CustomJSONEncoder), 200, {'Content-Type': 'application/json; charset=utf-8'}
+        if "error" in result:
+            return json.dumps({"error": result["error"]}, ensure_ascii=False), 500, {'Content-Type': 'application/json; charset=utf-8'}
         
-        return json.dumps({
+        response = {
             "success": True, 
-            "message": f"数据已刷新 (使用{'优化' if use_optimized else '常规'}方法)",
+            "message": f"数据已刷新 (使用{REFRESH_METHOD_NAMES[method]}方法)",
             "stock_count": result.get("stock_count", 0),
             "total_stocks": result.get("total_stocks", 0),
-            "batch_size": batch_size if use_optimized else "N/A"
-        }, ensure_ascii=False, cls=CustomJSONEncoder), 200, {'Content-Type': 'application/json; charset=utf-8'}
+            "batch_size": batch_size if method in ("optimized", "pipelined", "distributed") else "N/A",
+            "fingerprint": result.get("fingerprint")
+        }
+        for stats_key in ("pipeline_stats", "distributed_stats", "panel_stats"):
+            if stats_key in result:
+                response[stats_key] = result[stats_key]
+        
+        return json.dumps(response, ensure_ascii=False, cls=CustomJSONEncoder), 200, {'Content-Type': 'application/json; charset=utf-8'}
     except Exception as e:
         print(f"❌ 刷新数据时出错: {str(e)}")
         return json.dumps({"error": str(e)}, ensure_ascii=False), 500, {'Content-Type': 'application/json; charset=utf-8'}
 
+@app.route('/api/refresh/status')
+def refresh_status():
+    """返回刷新调度器状态和最近一次刷新记录"""
+    return json.dumps(refresh_scheduler.get_status(), ensure_ascii=False, cls=CustomJSONEncoder), 200, {'Content-Type': 'application/json; charset=utf-8'}
+
 @app.route('/api/index')
+@postgres_only
+@limited("maintenance")
 def create_index():
     """创建数据库索引以提升查询性能"""
     print("\n===== 开始创建数据库索引 =====")
-    result = db_utils.create_database_indexes()
+    advise = request.args.get('advise', default='true', type=str).lower() == 'true'
+    result = db_utils.create_database_indexes(advise=advise)
     print("===== 索引创建完成 =====\n")
     return json.dumps(result, ensure_ascii=False, cls=CustomJSONEncoder), 200, {'Content-Type': 'application/json; charset=utf-8'}
 
@@ -148,30 +517,14 @@ def page_not_found(e):
     </ul>
     ''', 404
 
-if __name__ == '__main__':
-    # 启动时尝试确保计算一次
-    try:
-        print("\n===== 服务启动，正在预加载数据... =====")
+def main(host='0.0.0.0', port=5000, debug=True):
+    """统一启动入口：立即绑定端口，索引检查和快照预热在后台执行，并启动刷新调度器"""
+    # debug模式下Werkzeug重载器会启动监控进程和服务子进程，只在服务子进程中预热和调度
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        startup.start_background_warmup()
+        refresh_scheduler.start_scheduler()
+    print(f"API服务启动，可通过浏览器访问 http://{host}:{port}/ (就绪状态见 /readyz)")
+    app.run(host=host, port=port, debug=debug)
 
-        # 先创建数据库索引，提升后续查询速度
-        print("\n===== 正在创建/检查数据库索引... =====")
-        db_utils.create_database_indexes()
-        
-        # 检查是否已有数据
-        print("正在检查数据库中是否已有数据...")
-        result = db_utils.get_stocks_with_signals_from_db()
-        if "error" in result:
-            # 如果没有数据，则使用优化方式重新计算
-            print("⚠️ 数据库中没有找到数据，开始首次计算...")
-            batch_size = 100  # 默认批处理大小
-            print(f"使用优化计算函数，批处理大小: {batch_size}")
-            data_processor.compute_stocks_data_optimized(force_recompute=True, batch_size=batch_size)
-        else:
-            print(f"✅ 已找到 {result.get('stock_count', 0)} 只股票的数据，无需重新计算")
-        
-        print("\n===== 数据预加载完成，服务准备就绪 =====")
-        print("API服务启动，可通过浏览器访问 http://0.0.0.0:5000/")
-    except Exception as e:
-        print(f"❌ 预加载数据时出错: {str(e)}")
-    
-    app.run(host='0.0.0.0', port=5000, debug=True) 
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,195 @@
-from decimal import Decimal
+import heapq
+
 import db_utils
 import signal_calculator
+import snapshot_store
+import storage
+import stock_cache
+import signal_feed
+import strategies
+
+# 写快照文件失败时只属于本进程的内存快照，快照文件出现更新的版本后不再使用
+_local_snapshot = None
+
+# 非默认回看窗口的结果 {days: (快照版本, 结果)}，快照版本变化后重新加载
+_window_results = {}
+
+# 快照中每只信号股票的排行榜条目 (快照版本, 条目列表)，快照版本变化后重建
+_leaderboard_entries = (None, [])
+
+def get_snapshot():
+    """返回当前快照的读取器
+
+    快照不物化为本进程的Python对象：读请求直接从mmap的快照文件切片或按需解码，
+    所有工作进程共享同一份页缓存。
+
+    返回:
+    SnapshotReader: 快照读取器，未加载时返回None
+    """
+    reader = snapshot_store.get_reader()
+    if _local_snapshot is not None and (reader is None or reader.version < _local_snapshot.version):
+        return _local_snapshot
+    return reader
+
+def snapshot_version():
+    """当前快照的版本号，未加载时返回None"""
+    reader = get_snapshot()
+    return reader.version if reader is not None else None
+
+@db_utils.primary_reads
+def load_snapshot():
+    """从数据库加载信号股票数据，写出新版本快照文件
+
+    返回:
+    dict: 加载结果，出错时包含error字段（此时不替换快照）
+    """
+    # 刷新写入已提交：记录主库写入位置，之后的读请求只路由到已回放到这里的副本
+    db_utils.record_primary_write()
+    with snapshot_store.write_lock():
+        return _write_loaded_snapshot(storage.get_repository().stocks_with_signals())
+
+def _write_loaded_snapshot(result, ts_codes=None):
+    """把加载结果写成新版本快照文件（调用方持有snapshot_store.write_lock()）"""
+    global _local_snapshot
+    if "error" not in result:
+        try:
+            result["data_version"] = snapshot_store.write_snapshot(result, ts_codes=ts_codes)
+            print(f"✓ 已写出快照文件版本 {result['data_version']}")
+            _local_snapshot = None
+            # 本进程立即切换到新版本，不等文件检查间隔
+            snapshot_store.get_reader(force=True)
+        except Exception as e:
+            # 写文件失败时只更新本进程的快照
+            print(f"⚠️ 写出快照文件时出错: {str(e)}")
+            result["data_version"] = max(snapshot_store.read_version(), snapshot_version() or 0) + 1
+            _local_snapshot = snapshot_store.memory_snapshot(result, result["data_version"])
+    return result
+
+@db_utils.primary_reads
+def update_snapshot(ts_codes):
+    """实时写入后只从数据库重新读取这些股票，与当前快照中的其余股票合并，写出新版本快照文件
+
+    交易日窗口移动、快照不存在或本进程只有内存快照时改为全量加载。
+    合并结果与全量加载得到的结果相同（同样的统计来源、排序和行格式）。
+
+    参数:
+    ts_codes: 实时写入过的股票代码
+
+    返回:
+    dict: 加载结果，出错时包含error字段（此时不替换快照）
+    """
+    db_utils.record_primary_write()
+    with snapshot_store.write_lock():
+        reader = snapshot_store.get_reader(force=True)
+        latest_dates = db_utils.get_latest_trading_dates()
+        if not latest_dates:
+            return {"error": "无法获取最近交易日期"}
+        date_range = {"start": latest_dates[-1], "end": latest_dates[0], "days": len(latest_dates)}
+        if storage.is_local() or reader is None or _local_snapshot is not None or reader.meta["date_range"] != date_range:
+            return _write_loaded_snapshot(storage.get_repository().stocks_with_signals())
+
+        start_date = latest_dates[-1]
+        ts_codes = set(ts_codes)
+        with db_utils.get_read_connection() as conn:
+            cursor = conn.cursor()
+            signal_stats = db_utils.get_window_signal_stats(cursor, db_utils.TRADING_DAYS_LIMIT, start_date, ts_codes)
+            rows_by_code = {}
+            if signal_stats:
+                cursor.execute(db_utils.BATCH_STOCK_WINDOW_SQL, (start_date, sorted(signal_stats), start_date))
+                for row in cursor.fetchall():
+                    rows_by_code.setdefault(row[0], []).append(row)
+            cursor.close()
+
+        # 其余股票原样取自当前快照
+        for ts_code in reader.ts_codes():
+            if ts_code not in ts_codes:
+                info = reader.get_return_info(ts_code)
+                signal_stats[ts_code] = (info["signal_count"], info["return_rate"])
+                rows_by_code[ts_code] = reader.get_stock_rows(ts_code)
+        result = db_utils.build_signal_stocks_result(latest_dates, db_utils.get_all_stocks_count(), signal_stats, rows_by_code)
+        return _write_loaded_snapshot(result, ts_codes)
+
+def get_single_stock_data(ts_code, days=None):
+    """获取单只股票数据，优先使用按数据版本失效的缓存，快照中存在的股票直接从快照文件读取
+    
+    参数:
+    ts_code: 股票代码
+    days: 回看的交易日数，None表示默认窗口；非默认窗口直接查询数据库（收益率来自预计算统计）
+    """
+    if days is not None and days != db_utils.TRADING_DAYS_LIMIT:
+        return storage.get_repository().single_stock(ts_code, days)
+    
+    reader = get_snapshot()
+    version = reader.version if reader is not None else 0
+    
+    result = stock_cache.single_stock_cache.get(ts_code, version, reader)
+    if result is not None:
+        return result
+    
+    result = reader.get_single_stock_result(ts_code) if reader is not None else None
+    if result is None:
+        result = storage.get_repository().single_stock(ts_code)
+        if "error" in result:
+            return result
+        result["data_version"] = version
+    
+    stock_cache.single_stock_cache.put(ts_code, version, result)
+    return result
 
+def get_multiple_stocks_data(ts_codes, columns=None):
+    """批量获取多只股票数据
+    
+    缓存和快照中能找到的股票直接返回，其余股票用一次批量查询从数据库获取。
+    
+    参数:
+    ts_codes: 股票代码列表（重复的代码只返回一次）
+    columns: 可选的列名子集
+    
+    返回:
+    dict: {ts_code: 单只股票结果}，按请求顺序；整体出错时返回{"error": ...}
+    """
+    reader = get_snapshot()
+    version = reader.version if reader is not None else 0
+    ts_codes = list(dict.fromkeys(ts_codes))
+    
+    results = {}
+    missing = []
+    for ts_code in ts_codes:
+        result = stock_cache.single_stock_cache.get(ts_code, version, reader)
+        if result is None and reader is not None:
+            result = reader.get_single_stock_result(ts_code)
+            if result is not None:
+                stock_cache.single_stock_cache.put(ts_code, version, result)
+        if result is None:
+            missing.append(ts_code)
+        results[ts_code] = result
+    
+    if missing:
+        db_results = storage.get_repository().multiple_stocks(missing)
+        if isinstance(db_results.get("error"), str):
+            return db_results
+        for ts_code, result in db_results.items():
+            if "error" not in result:
+                result["data_version"] = version
+                stock_cache.single_stock_cache.put(ts_code, version, result)
+            results[ts_code] = result
+    
+    if columns:
+        results = {ts_code: select_columns(result, columns) for ts_code, result in results.items()}
+    return results
+
+def select_columns(result, columns):
+    """返回只包含指定列的结果副本（不修改缓存中的原结果）"""
+    if "error" in result:
+        return result
+    indexes = [result["column_names"].index(column) for column in columns]
+    return dict(
+        result,
+        column_names=list(columns),
+        data=[[tuple(row[i] for i in indexes) for row in stock_rows] for stock_rows in result["data"]]
+    )
+
+@db_utils.primary_reads
 def compute_all_stocks_data(force_recompute=False):
     """计算所有股票数据并保存到数据库
     
@@ -20,151 +208,76 @@ def compute_all_stocks_data(force_recompute=False):
         
         print(f"✓ 获取到最近{len(latest_dates)}个交易日，从 {latest_dates[0]} 到 {latest_dates[-1]}")
         
+        # 同步股票目录，纳入新加载的交易日
+        print("正在同步股票目录...")
+        db_utils.sync_stock_catalog()
+        
+        # 准备窗口统计表
+        window_dates = db_utils.prepare_window_stats()
+        
         # 连接数据库
         print("正在连接数据库...")
-        conn = db_utils.get_db_connection()
-        cursor = conn.cursor()
-        print("✓ 数据库连接成功")
+        with db_utils.get_float_connection() as conn:
+            cursor = conn.cursor()
+            print("✓ 数据库连接成功")
         
-        # 获取所有不同的股票代码
-        print("正在获取所有股票代码...")
-        cursor.execute("SELECT DISTINCT ts_code FROM all_stocks_days")
-        all_stocks = [row[0] for row in cursor.fetchall()]
-        total_stocks = len(all_stocks)
-        print(f"✓ 共找到 {total_stocks} 只股票需要处理")
+            # 获取所有股票代码（来自股票目录）
+            print("正在获取所有股票代码...")
+            all_stocks = list(db_utils.get_stock_catalog())
+            total_stocks = len(all_stocks)
+            print(f"✓ 共找到 {total_stocks} 只股票需要处理")
         
-        # 计数器
-        signals_count = 0
-        processed_count = 0
+            # 计数器
+            signals_count = 0
+            processed_count = 0
         
-        # 每个股票处理
-        print("\n===== 开始处理股票数据 =====")
-        for idx, ts_code in enumerate(all_stocks):  # 处理全部股票
-            # 显示处理进度
-            processed_count += 1
-            percentage = processed_count / total_stocks * 100
-            # 每处理一只股票都输出一次
-            print(f"处理进度: {processed_count}/{total_stocks} ({percentage:.1f}%) - 当前: {ts_code}")
-            
-            # 只获取最近几个交易日的数据
-            cursor.execute("""
-                SELECT ts_code, trade_date, open, high, low, close, pre_close, pct_chg, vol, bay, ma120, ma250, name, id
-                FROM all_stocks_days
-                WHERE ts_code = %s AND trade_date >= %s
-                ORDER BY trade_date
-            """, (ts_code, latest_dates[-1]))
+            # 每个股票处理
+            print("\n===== 开始处理股票数据 =====")
+            for ts_code in all_stocks:  # 处理全部股票
+                # 显示处理进度
+                processed_count += 1
+                percentage = processed_count / total_stocks * 100
+                # 每处理一只股票都输出一次
+                print(f"处理进度: {processed_count}/{total_stocks} ({percentage:.1f}%) - 当前: {ts_code}")
             
-            stock_data = cursor.fetchall()
-            if not stock_data:
-                print(f"    ⚠️ 股票 {ts_code} 没有最近交易日数据，跳过")
-                continue
+                # 只获取最近几个交易日的数据
+                stocks_data = db_utils.fetch_stocks_window(cursor, [ts_code], latest_dates[-1])
+                if not stocks_data:
+                    print(f"    ⚠️ 股票 {ts_code} 没有最近交易日数据，跳过")
+                    continue
                 
-            # 计算买卖点信号
-            stock_rows = []
-            has_signal = False  # 标记是否有买卖点信号
+                # 计算买卖点信号，一次批量写入
+                signals, keys, signal_stocks = compute_batch_signals(stocks_data)
+                changed = []
+                db_utils.upsert_signals(cursor, signals, changed)
+                # 新增或取值变化的信号随同一事务记录为推送事件
+                signal_feed.record_signals(cursor, changed, keys)
             
-            # 将数据转换为没有ID的格式进行计算
-            stock_data_for_calc = [row[:-1] for row in stock_data]
+                # 插件策略在同一份窗口数据上计算
+                db_utils.upsert_strategy_signals(cursor, strategies.evaluate_strategies(stocks_data))
             
-            for i in range(0, len(stock_data_for_calc)):
-                current_row = stock_data_for_calc[i]
-                id_value = stock_data[i][-1]  # 获取ID值
-                
-                # 转换数据类型，处理Decimal
-                stock_row = []
-                for j, item in enumerate(current_row):
-                    if isinstance(item, Decimal):
-                        stock_row.append(float(item))
-                    else:
-                        stock_row.append(item)
-                
-                # 计算买入信号和卖出信号
-                buy_signal = 0.0
-                sell_signal = 0.0
-                
-                if signal_calculator.calculate_buy_signal(stock_data_for_calc, i):
-                    buy_signal = float(stock_row[5])  # 使用当天收盘价作为买点价格
-                    has_signal = True  # 有信号
-                
-                if signal_calculator.calculate_high_fund_outflow(stock_data_for_calc, i):
-                    sell_signal = float(stock_row[5])  # 使用当天收盘价作为卖点价格
-                    has_signal = True  # 有信号
-                
-                # 如果有买入或卖出信号，保存到数据库
-                if buy_signal > 0 or sell_signal > 0:
-                    # 获取all_stocks_days的ID
-                    all_stocks_days_id = id_value
-                    
-                    # 检查是否已经存在记录
-                    cursor.execute("""
-                        SELECT id FROM high_level_inflows 
-                        WHERE all_stocks_days_id = %s
-                    """, (all_stocks_days_id,))
-                    
-                    existing = cursor.fetchone()
-                    
-                    # 计算收益率
-                    earnings_rate = 0.0
-                    if sell_signal > 0:
-                        # 对于卖出信号，找出后续的最低价计算收益率
-                        if i < len(stock_data_for_calc) - 1:
-                            current_price = float(stock_data_for_calc[i][5]) if isinstance(stock_data_for_calc[i][5], Decimal) else stock_data_for_calc[i][5]
-                            min_price = current_price
-                            
-                            for j in range(i+1, len(stock_data_for_calc)):
-                                price = float(stock_data_for_calc[j][5]) if isinstance(stock_data_for_calc[j][5], Decimal) else stock_data_for_calc[j][5]
-                                if price < min_price:
-                                    min_price = price
-                            
-                            if min_price < current_price:
-                                earnings_rate = (current_price - min_price) / current_price * 100
-                    
-                    # 插入或更新记录
-                    if existing:
-                        # 更新现有记录
-                        cursor.execute("""
-                            UPDATE high_level_inflows 
-                            SET buy = %s, sell = %s, earnings_rate = %s
-                            WHERE all_stocks_days_id = %s
-                        """, (buy_signal, sell_signal, earnings_rate, all_stocks_days_id))
-                    else:
-                        # 获取下一个可用的ID
-                        cursor.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM high_level_inflows")
-                        next_id = cursor.fetchone()[0]
-                        
-                        # 插入新记录
-                        cursor.execute("""
-                            INSERT INTO high_level_inflows (id, all_stocks_days_id, buy, sell, earnings_rate)
-                            VALUES (%s, %s, %s, %s, %s)
-                        """, (next_id, all_stocks_days_id, buy_signal, sell_signal, earnings_rate))
-                
-                # 构建返回的数据行，保持原始格式，但用我们计算的买卖点替换bay字段
-                # ts_code, trade_date, open, high, low, close, pre_close, pct_chg, vol, buy, ma120, ma250, name, sell
-                result_row = stock_row[:9]  # 保留前9个字段
-                result_row.append(buy_signal)  # 添加计算得到的买点 (替换bay字段)
-                result_row.extend(stock_row[10:13])  # 添加ma120, ma250, name
-                result_row.append(sell_signal)  # 添加计算得到的卖点
-                
-                stock_rows.append(result_row)
-            
-            # 如果有信号，记录该股票
-            if has_signal:
+                # 即使没有信号也提交，确保更新了数据库
                 conn.commit()
-                signals_count += 1
-                print(f"    ✓ 股票 {ts_code} 有买卖点信号，已保存到数据库")
-            else:
-                conn.commit()  # 即使没有信号也提交，确保更新了数据库
-                print(f"    - 股票 {ts_code} 没有买卖点信号")
+                if signal_stocks:
+                    signals_count += 1
+                    print(f"    ✓ 股票 {ts_code} 有买卖点信号，已保存到数据库")
+                else:
+                    print(f"    - 股票 {ts_code} 没有买卖点信号")
+        
+            # 更新所有股票的窗口统计和全市场每日统计
+            print("正在更新窗口统计...")
+            db_utils.refresh_window_stats(cursor, all_stocks, window_dates)
+            db_utils.refresh_market_breadth(cursor, latest_dates[-1])
+            conn.commit()
         
-        # 关闭数据库连接
-        cursor.close()
-        conn.close()
+            # 关闭游标，连接归还连接池
+            cursor.close()
         
         print(f"\n✅ 处理完成！共处理 {total_stocks} 只股票，其中 {signals_count} 只最近{len(latest_dates)}个交易日内有买卖点信号")
         print("\n===== 正在从数据库加载结果 =====")
         
         # 从数据库获取结果
-        result = db_utils.get_stocks_with_signals_from_db()
+        result = load_snapshot()
         print(f"✅ 数据加载完成！返回 {result.get('stock_count', 0)} 只股票数据，总共 {result.get('total_stocks', 0)} 只股票")
         
         return result
@@ -172,20 +285,207 @@ def compute_all_stocks_data(force_recompute=False):
         print(f"❌ 处理过程中出错: {str(e)}")
         return {"error": str(e)}
 
-def get_all_stocks_data():
-    """获取所有股票数据并计算买卖点"""
-    print("\n===== 开始获取股票数据 =====")
-    # 尝试从数据库获取数据
-    print("正在从数据库获取已有数据...")
-    result = db_utils.get_stocks_with_signals_from_db()
+def compute_stock_signals(stock_data):
+    """计算单只股票窗口内的买卖点信号和收益率（不访问数据库）
+
+    参数:
+    stock_data: 按trade_date升序的行列表，行末为all_stocks_days.id
+
+    返回:
+    list: [(all_stocks_days_id, buy, sell, earnings_rate), ...]，只包含有信号的行
+    """
+    # 将数据转换为没有ID的格式进行计算
+    stock_data_for_calc = [row[:-1] for row in stock_data]
+    signals = []
     
-    # 如果没有数据，则重新计算
-    if "error" in result:
-        print("⚠️ 数据库中没有找到数据，开始重新计算...")
-        return compute_all_stocks_data(force_recompute=True)
+    for i in range(0, len(stock_data_for_calc)):
+        close = stock_data_for_calc[i][5]
+        
+        # 使用当天收盘价作为买卖点价格
+        buy_signal = close if signal_calculator.calculate_buy_signal(stock_data_for_calc, i) else 0.0
+        sell_signal = close if signal_calculator.calculate_high_fund_outflow(stock_data_for_calc, i) else 0.0
+        
+        if buy_signal > 0 or sell_signal > 0:
+            # 对于卖出信号，找出后续的最低价计算收益率
+            earnings_rate = 0.0
+            if sell_signal > 0 and i < len(stock_data_for_calc) - 1:
+                min_price = close
+                for j in range(i+1, len(stock_data_for_calc)):
+                    if stock_data_for_calc[j][5] < min_price:
+                        min_price = stock_data_for_calc[j][5]
+                if min_price < close:
+                    earnings_rate = (close - min_price) / close * 100
+            
+            signals.append((stock_data[i][-1], buy_signal, sell_signal, earnings_rate))
+    
+    return signals
+
+def compute_batch_signals(stocks_data):
+    """计算一批股票窗口内的买卖点信号（不访问数据库）
+
+    参数:
+    stocks_data: {ts_code: [row, ...]}，fetch_stocks_window()的结果
+
+    返回:
+    tuple: (signals, keys, signal_stocks)
+        signals为upsert_signals()的输入；keys为{all_stocks_days_id: (ts_code, trade_date)}，
+        用于推送写入后变化的信号；signal_stocks为有信号的股票数
+    """
+    signals = []
+    keys = {}
+    signal_stocks = 0
+    for ts_code, stock_data in stocks_data.items():
+        stock_signals = compute_stock_signals(stock_data)
+        if not stock_signals:
+            continue
+        signal_stocks += 1
+        signals.extend(stock_signals)
+        signal_ids = {signal[0] for signal in stock_signals}
+        keys.update((row[-1], (ts_code, row[1])) for row in stock_data if row[-1] in signal_ids)
+    return signals, keys, signal_stocks
+
+def get_all_stocks_data(days=None):
+    """获取所有有信号股票的数据
+    
+    参数:
+    days: 回看的交易日数，None表示默认窗口
+    
+    返回:
+    默认窗口返回快照读取器（响应用SnapshotReader.iter_json()直接从快照文件生成），
+    其他窗口返回结果dict；出错时返回{"error": ...}
+    """
+    if days is not None and days != db_utils.TRADING_DAYS_LIMIT:
+        return get_window_stocks_data(days)
+    
+    # 快照由预热和刷新加载，读请求中不从数据库加载或重新计算
+    reader = get_snapshot()
+    if reader is None:
+        print("⚠️ 信号股票快照尚未加载")
+        return {"error": "信号股票快照尚未加载，请等待预热或刷新完成"}
+    return reader
+
+def get_stocks_delta(since_version):
+    """返回相对since_version的增量：新增、变化的股票数据和移除的股票代码
+
+    变更记录来自快照文件的change_log；since_version过旧、不属于当前快照文件，
+    或本进程快照没有写入文件时，回退为全量结果。
+
+    参数:
+    since_version: 客户端已有的数据版本号
+
+    返回:
+    dict: 增量结果；回退为全量时返回快照读取器（响应中加上delta为False）
+    """
+    reader = get_all_stocks_data()
+    if isinstance(reader, dict):
+        return reader
+    changes = reader.changes_since(since_version)
+    if changes is None:
+        print(f"⚠️ 版本 {since_version} 的变更记录不可用，返回全量数据")
+        return reader
+
+    added = [reader.get_stock_rows(ts_code) for ts_code in changes["added"]]
+    changed = [reader.get_stock_rows(ts_code) for ts_code in changes["changed"]]
+    return {
+        "delta": True,
+        "since_version": since_version,
+        "data_version": reader.version,
+        "column_names": reader.meta["column_names"],
+        "added": added,
+        "changed": changed,
+        "removed": changes["removed"],
+        "stock_returns": [reader.get_return_info(ts_code) for ts_code in changes["added"] + changes["changed"]],
+        "stock_count": reader.stock_count,
+        "total_stocks": reader.meta["total_stocks"],
+        "date_range": reader.meta["date_range"]
+    }
+
+def _build_leaderboard_entries(reader):
+    """从快照构建每只信号股票的排行榜条目（按ts_code排序），每个快照版本只构建一次
+
+    只读取每只股票的买卖点两列和交易日，不解码整行。
+    """
+    entries = []
+    for ts_code in reader.ts_codes():
+        info = reader.get_return_info(ts_code)
+        buy_dates, sell_dates = reader.signal_dates(ts_code)
+        entries.append({
+            "ts_code": ts_code,
+            "name": info["name"],
+            "return_rate": info["return_rate"],
+            "signal_count": info["signal_count"],
+            "buy_count": len(buy_dates),
+            "sell_count": len(sell_dates),
+            "latest_signal_date": max(buy_dates + sell_dates, default=None),
+            "latest_buy_date": max(buy_dates, default=None),
+            "latest_sell_date": max(sell_dates, default=None)
+        })
+    entries.sort(key=lambda entry: entry["ts_code"])
+    return entries
+
+def get_leaderboard(top, order_by="return_rate", signal_type="any", days=None):
+    """获取按收益率、信号数或最近信号日期排名的前top只股票
+
+    默认窗口用堆从快照条目中取前top个，不对全市场排序；其他窗口在数据库中ORDER BY ... LIMIT。
+
+    参数:
+    top: 返回的股票数
+    order_by: 排序键，见db_utils.LEADERBOARD_ORDER_BY
+    signal_type: 信号类型筛选，any/buy/sell
+    days: 回看的交易日数，None表示默认窗口
+    """
+    global _leaderboard_entries
+    if days is not None and days != db_utils.TRADING_DAYS_LIMIT:
+        return db_utils.get_window_leaderboard(days, top, order_by, signal_type)
+
+    reader = get_all_stocks_data()
+    if isinstance(reader, dict):
+        return reader
+    version, entries = _leaderboard_entries
+    if version != reader.version:
+        entries = _build_leaderboard_entries(reader)
+        _leaderboard_entries = (reader.version, entries)
+
+    key = db_utils.leaderboard_order_key(order_by, signal_type)
+    count_key = {"any": "signal_count", "buy": "buy_count", "sell": "sell_count"}[signal_type]
+    candidates = (entry for entry in entries if entry[count_key] > 0)
+    # 与ORDER BY ... DESC, ts_code一致：nlargest对相同取值保持条目的ts_code顺序
+    top_entries = heapq.nlargest(top, candidates, key=lambda entry: entry[key])
+    return {
+        "leaderboard": [dict(entry, rank=rank) for rank, entry in enumerate(top_entries, 1)],
+        "date_range": reader.meta["date_range"],
+        "data_version": reader.version
+    }
+
+def get_window_stocks_data(days):
+    """获取非默认回看窗口的信号股票数据，结果按快照版本缓存
     
-    print(f"✅ 已从数据库成功获取 {result.get('stock_count', 0)} 只股票数据")
-    return result 
+    有信号的股票和收益率来自刷新时维护的窗口统计，行数据用一次批量查询获取。
+    """
+    version = snapshot_version()
+    cached = _window_results.get(days)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    
+    print(f"\n===== 开始获取最近{days}个交易日的股票数据 =====")
+    result = storage.get_repository().stocks_with_signals(days)
+    if "error" not in result:
+        result["data_version"] = version
+        _window_results[days] = (version, result)
+    return result
+
+def get_stock_returns(days=None):
+    """获取有信号股票的收益率统计
+    
+    参数:
+    days: 回看的交易日数，None表示默认窗口（来自快照）；其他窗口直接读取预计算统计
+
+    返回:
+    默认窗口返回快照读取器（响应用SnapshotReader.iter_returns_json()生成），其他窗口返回结果dict
+    """
+    if days is not None and days != db_utils.TRADING_DAYS_LIMIT:
+        return storage.get_repository().window_returns(days)
+    return get_all_stocks_data()
 
 def get_all_available_stocks_data():
     """获取数据库中所有可用的股票数据，不只是有买卖点信号的"""
@@ -194,7 +494,7 @@ def get_all_available_stocks_data():
     try:
         # 从数据库获取所有股票的基本信息
         print("正在从数据库获取所有股票信息...")
-        result = db_utils.get_all_stocks_info()
+        result = storage.get_repository().all_stocks_info()
         
         if "error" in result:
             print(f"❌ 获取股票信息出错: {result['error']}")
@@ -208,6 +508,7 @@ def get_all_available_stocks_data():
         print(f"❌ 处理所有股票数据时出错: {str(e)}")
         return {"error": str(e)} 
 
+@db_utils.primary_reads
 def compute_stocks_data_optimized(force_recompute=False, batch_size=100):
     """优化的股票数据计算函数，使用批处理和索引提升性能
     
@@ -227,186 +528,72 @@ def compute_stocks_data_optimized(force_recompute=False, batch_size=100):
         
         print(f"✓ 获取到最近{len(latest_dates)}个交易日，从 {latest_dates[0]} 到 {latest_dates[-1]}")
         
+        # 同步股票目录，纳入新加载的交易日
+        print("正在同步股票目录...")
+        db_utils.sync_stock_catalog()
+        
+        # 准备窗口统计表
+        window_dates = db_utils.prepare_window_stats()
+        
         # 连接数据库
         print("正在连接数据库...")
-        conn = db_utils.get_db_connection()
-        cursor = conn.cursor()
-        print("✓ 数据库连接成功")
+        with db_utils.get_float_connection() as conn:
+            cursor = conn.cursor()
+            print("✓ 数据库连接成功")
         
-        # 获取所有不同的股票代码
-        print("正在获取所有股票代码...")
-        cursor.execute("""
-            SELECT DISTINCT ts_code 
-            FROM all_stocks_days 
-            WHERE trade_date >= %s
-            ORDER BY ts_code
-        """, (latest_dates[-1],))
+            # 获取窗口内有交易的股票代码（来自股票目录）
+            print("正在获取所有股票代码...")
+            all_stocks = db_utils.get_window_ts_codes(latest_dates[-1])
+            total_stocks = len(all_stocks)
+            print(f"✓ 共找到 {total_stocks} 只股票需要处理")
         
-        all_stocks = [row[0] for row in cursor.fetchall()]
-        total_stocks = len(all_stocks)
-        print(f"✓ 共找到 {total_stocks} 只股票需要处理")
+            # 计数器
+            signals_count = 0
+            processed_count = 0
         
-        # 计数器
-        signals_count = 0
-        processed_count = 0
+            # 批处理股票
+            print("\n===== 开始批量处理股票数据 =====")
         
-        # 批处理股票
-        print("\n===== 开始批量处理股票数据 =====")
-        
-        # 分批处理股票
-        for batch_start in range(0, total_stocks, batch_size):
-            batch_end = min(batch_start + batch_size, total_stocks)
-            batch_stocks = all_stocks[batch_start:batch_end]
-            
-            print(f"正在处理第 {batch_start//batch_size + 1} 批，股票 {batch_start+1}-{batch_end}/{total_stocks}")
-            
-            # 为批量查询构建SQL参数
-            batch_params = []
-            batch_query_parts = []
-            
-            for ts_code in batch_stocks:
-                batch_params.extend([ts_code, latest_dates[-1]])
-                batch_query_parts.append("(ts_code = %s AND trade_date >= %s)")
+            # 分批处理股票
+            for batch_start in range(0, total_stocks, batch_size):
+                batch_end = min(batch_start + batch_size, total_stocks)
+                batch_stocks = all_stocks[batch_start:batch_end]
             
-            # 只获取最近几个交易日的数据（一次性获取整批股票的数据）
-            batch_query = f"""
-                SELECT ts_code, trade_date, open, high, low, close, pre_close, pct_chg, vol, bay, ma120, ma250, name, id
-                FROM all_stocks_days
-                WHERE {" OR ".join(batch_query_parts)}
-                ORDER BY ts_code, trade_date
-            """
+                print(f"正在处理第 {batch_start//batch_size + 1} 批，股票 {batch_start+1}-{batch_end}/{total_stocks}")
             
-            cursor.execute(batch_query, batch_params)
-            all_stock_data = cursor.fetchall()
-            
-            # 按股票代码分组数据
-            stocks_data = {}
-            for row in all_stock_data:
-                ts_code = row[0]
-                if ts_code not in stocks_data:
-                    stocks_data[ts_code] = []
-                stocks_data[ts_code].append(row)
-            
-            # 处理每只股票
-            for ts_code, stock_data in stocks_data.items():
-                processed_count += 1
-                percentage = processed_count / total_stocks * 100
-                print(f"处理进度: {processed_count}/{total_stocks} ({percentage:.1f}%) - 当前: {ts_code}")
-                
-                if not stock_data:
-                    print(f"    ⚠️ 股票 {ts_code} 没有最近交易日数据，跳过")
-                    continue
-                
-                # 计算买卖点信号
-                stock_rows = []
-                has_signal = False  # 标记是否有买卖点信号
+                # 只获取最近几个交易日的数据（一次性获取整批股票的数据）
+                stocks_data = db_utils.fetch_stocks_window(cursor, batch_stocks, latest_dates[-1])
+                processed_count += len(stocks_data)
                 
-                # 将数据转换为没有ID的格式进行计算
-                stock_data_for_calc = [row[:-1] for row in stock_data]
+                # 计算整批股票的买卖点信号，一次批量写入
+                signals, keys, signal_stocks = compute_batch_signals(stocks_data)
+                signals_count += signal_stocks
+                changed = []
+                db_utils.upsert_signals(cursor, signals, changed)
+                signal_feed.record_signals(cursor, changed, keys)
+                print(f"处理进度: {processed_count}/{total_stocks} ({processed_count / total_stocks * 100:.1f}%) - 本批 {len(signals)} 个信号")
+            
+                # 插件策略在同一批窗口数据上计算
+                db_utils.upsert_strategy_signals(cursor, strategies.evaluate_strategies(stocks_data))
                 
-                # 更新数据库中的信号，并收集结果
-                for i in range(0, len(stock_data_for_calc)):
-                    current_row = stock_data_for_calc[i]
-                    id_value = stock_data[i][-1]  # 获取ID值
-                    
-                    # 转换数据类型，处理Decimal
-                    stock_row = []
-                    for j, item in enumerate(current_row):
-                        if isinstance(item, Decimal):
-                            stock_row.append(float(item))
-                        else:
-                            stock_row.append(item)
-                    
-                    # 计算买入信号和卖出信号
-                    buy_signal = 0.0
-                    sell_signal = 0.0
-                    
-                    if signal_calculator.calculate_buy_signal(stock_data_for_calc, i):
-                        buy_signal = float(stock_row[5])  # 使用当天收盘价作为买点价格
-                        has_signal = True  # 有信号
-                    
-                    if signal_calculator.calculate_high_fund_outflow(stock_data_for_calc, i):
-                        sell_signal = float(stock_row[5])  # 使用当天收盘价作为卖点价格
-                        has_signal = True  # 有信号
-                    
-                    # 如果有买入或卖出信号，保存到数据库
-                    if buy_signal > 0 or sell_signal > 0:
-                        # 获取all_stocks_days的ID
-                        all_stocks_days_id = id_value
-                        
-                        # 检查是否已经存在记录
-                        cursor.execute("""
-                            SELECT id FROM high_level_inflows 
-                            WHERE all_stocks_days_id = %s
-                        """, (all_stocks_days_id,))
-                        
-                        existing = cursor.fetchone()
-                        
-                        # 计算收益率
-                        earnings_rate = 0.0
-                        if sell_signal > 0:
-                            # 对于卖出信号，找出后续的最低价计算收益率
-                            if i < len(stock_data_for_calc) - 1:
-                                current_price = float(stock_data_for_calc[i][5]) if isinstance(stock_data_for_calc[i][5], Decimal) else stock_data_for_calc[i][5]
-                                min_price = current_price
-                                
-                                for j in range(i+1, len(stock_data_for_calc)):
-                                    price = float(stock_data_for_calc[j][5]) if isinstance(stock_data_for_calc[j][5], Decimal) else stock_data_for_calc[j][5]
-                                    if price < min_price:
-                                        min_price = price
-                                
-                                if min_price < current_price:
-                                    earnings_rate = (current_price - min_price) / current_price * 100
-                        
-                        # 插入或更新记录
-                        if existing:
-                            # 更新现有记录
-                            cursor.execute("""
-                                UPDATE high_level_inflows 
-                                SET buy = %s, sell = %s, earnings_rate = %s
-                                WHERE all_stocks_days_id = %s
-                            """, (buy_signal, sell_signal, earnings_rate, all_stocks_days_id))
-                        else:
-                            # 获取下一个可用的ID
-                            cursor.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM high_level_inflows")
-                            next_id = cursor.fetchone()[0]
-                            
-                            # 插入新记录
-                            cursor.execute("""
-                                INSERT INTO high_level_inflows (id, all_stocks_days_id, buy, sell, earnings_rate)
-                                VALUES (%s, %s, %s, %s, %s)
-                            """, (next_id, all_stocks_days_id, buy_signal, sell_signal, earnings_rate))
-                    
-                    # 构建返回的数据行，保持原始格式，但用我们计算的买卖点替换bay字段
-                    # ts_code, trade_date, open, high, low, close, pre_close, pct_chg, vol, buy, ma120, ma250, name, sell
-                    result_row = stock_row[:9]  # 保留前9个字段
-                    result_row.append(buy_signal)  # 添加计算得到的买点 (替换bay字段)
-                    result_row.extend(stock_row[10:13])  # 添加ma120, ma250, name
-                    result_row.append(sell_signal)  # 添加计算得到的卖点
-                    
-                    stock_rows.append(result_row)
+                # 更新这批股票的窗口统计
+                db_utils.refresh_window_stats(cursor, batch_stocks, window_dates)
                 
-                # 如果有信号，记录该股票
-                if has_signal:
-                    conn.commit()
-                    signals_count += 1
-                    print(f"    ✓ 股票 {ts_code} 有买卖点信号，已保存到数据库")
-                else:
-                    conn.commit()  # 即使没有信号也提交，确保更新了数据库
-                    print(f"    - 股票 {ts_code} 没有买卖点信号")
-            
-            # 每批次结束后提交一次
+                # 每批次结束后提交一次，提交后变化的信号推送给订阅者
+                conn.commit()
+        
+            # 所有批次写入后更新全市场每日统计
+            db_utils.refresh_market_breadth(cursor, latest_dates[-1])
             conn.commit()
         
-        # 关闭数据库连接
-        cursor.close()
-        conn.close()
+            # 关闭游标，连接归还连接池
+            cursor.close()
         
         print(f"\n✅ 处理完成！共处理 {total_stocks} 只股票，其中 {signals_count} 只最近{len(latest_dates)}个交易日内有买卖点信号")
         print("\n===== 正在从数据库加载结果 =====")
         
         # 从数据库获取结果
-        result = db_utils.get_stocks_with_signals_from_db()
+        result = load_snapshot()
         print(f"✅ 数据加载完成！返回 {result.get('stock_count', 0)} 只股票数据，总共 {result.get('total_stocks', 0)} 只股票")
         
         return result
@@ -1,7 +1,14 @@
 import psycopg2
-from decimal import Decimal
+from psycopg2 import extensions, extras, pool
+import fcntl
+import os
+import struct
+import threading
+import itertools
+from contextlib import contextmanager
+from functools import wraps
 import time
-from datetime import datetime
+from datetime import date, datetime
 
 # 数据库配置
 DB_CONFIG = {
@@ -12,13 +19,526 @@ DB_CONFIG = {
     'password': '123456'
 }
 
+# 只读副本配置（格式同DB_CONFIG），为空时所有查询都走主库
+DB_REPLICAS = []
+
+# 副本连接失败后暂停使用的时间（秒）
+REPLICA_RETRY_SECONDS = 30
+
+# 同一台机器上各工作进程共享的主库写入位置（8字节的LSN，只增不减）；
+# 主库重建后LSN从头开始时删除该文件
+REQUIRED_LSN_PATH = os.environ.get("REQUIRED_LSN_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshots', 'required_lsn'))
+
 # 只计算最近20个交易日
 TRADING_DAYS_LIMIT = 20
 
+# 预计算滚动统计的标准回看窗口（交易日数），API的days参数只接受这些值
+STANDARD_WINDOWS = (20, 60, 120)
+
+# 连接池配置
+DB_POOL_MIN_CONN = 1
+DB_POOL_MAX_CONN = 10
+
+# 内存中股票目录的有效期（秒），过期后从stock_catalog表重新加载
+STOCK_CATALOG_TTL = 300
+
+# high_level_inflows按trade_date的月份分区，保留最近的月数（0表示不删除旧分区）
+# 保留期不会短于最长的标准窗口，窗口内的信号所在的分区总是保留
+SIGNAL_RETENTION_MONTHS = 24
+
+# 提前创建的未来月份分区数
+SIGNAL_PARTITIONS_AHEAD = 2
+
+# 分区维护的事务级咨询锁
+SIGNAL_PARTITION_LOCK_ID = 7304203
+
+# 写入high_level_inflows和all_stocks_days时的事务级咨询锁：新记录的id按MAX(id)+1分配，
+# 刷新、实时写入和多个工作进程的插入需要串行，持有到事务提交
+SIGNALS_WRITE_LOCK_ID = 7304201
+STOCK_BARS_WRITE_LOCK_ID = 7304204
+
+# 返回给API的列名，与STOCK_WINDOW_COLUMNS一一对应
+STOCK_COLUMN_NAMES = ["ts_code", "trade_date", "open", "high", "low", "close", "pre_close", "pct_chg", "vol", "bay", "ma120", "ma250", "name", "sell"]
+
+# 窗口查询的输出列，数值列的NULL在SQL中直接转为0
+STOCK_WINDOW_COLUMNS = """
+    a.ts_code, a.trade_date, COALESCE(a.open, 0), COALESCE(a.high, 0), COALESCE(a.low, 0),
+    COALESCE(a.close, 0), COALESCE(a.pre_close, 0), COALESCE(a.pct_chg, 0), COALESCE(a.vol, 0),
+    COALESCE(h.buy, 0) AS bay, COALESCE(a.ma120, 0), COALESCE(a.ma250, 0), a.name, COALESCE(h.sell, 0)
+"""
+
+# 热点查询，函数中直接使用，同时供create_database_indexes中的索引顾问EXPLAIN
+LATEST_DATES_SQL = """
+    SELECT DISTINCT trade_date 
+    FROM all_stocks_days 
+    ORDER BY trade_date DESC 
+    LIMIT %s
+"""
+
+# high_level_inflows按trade_date分区，连接时同时给出h.trade_date的范围，只扫描窗口所在的分区
+WINDOW_SIGNAL_STATS_SQL = """
+    SELECT a.ts_code, COUNT(h.id), AVG(h.earnings_rate)
+    FROM all_stocks_days a
+    JOIN high_level_inflows h ON a.id = h.all_stocks_days_id AND h.trade_date = a.trade_date
+    WHERE a.trade_date >= %s AND h.trade_date >= %s AND (h.buy > 0 OR h.sell > 0)
+    GROUP BY a.ts_code
+"""
+
+PRECOMPUTED_WINDOW_STATS_SQL = """
+    SELECT ts_code, signal_count, avg_earnings_rate
+    FROM stock_window_stats
+    WHERE window_days = %s AND start_date = %s AND signal_count > 0
+"""
+
+# 只统计指定的股票（实时写入后更新快照时使用）
+CODES_WINDOW_SIGNAL_STATS_SQL = """
+    SELECT a.ts_code, COUNT(h.id), AVG(h.earnings_rate)
+    FROM all_stocks_days a
+    JOIN high_level_inflows h ON a.id = h.all_stocks_days_id AND h.trade_date = a.trade_date
+    WHERE a.trade_date >= %s AND h.trade_date >= %s AND (h.buy > 0 OR h.sell > 0) AND a.ts_code = ANY(%s)
+    GROUP BY a.ts_code
+"""
+
+CODES_PRECOMPUTED_WINDOW_STATS_SQL = """
+    SELECT ts_code, signal_count, avg_earnings_rate
+    FROM stock_window_stats
+    WHERE window_days = %s AND start_date = %s AND signal_count > 0 AND ts_code = ANY(%s)
+"""
+
+# 窗口内某个插件策略的信号
+STRATEGY_SIGNALS_SQL = """
+    SELECT a.ts_code, a.name, a.trade_date, s.value
+    FROM strategy_signals s
+    JOIN all_stocks_days a ON a.id = s.all_stocks_days_id
+    WHERE s.strategy_id = %s AND a.trade_date >= %s AND (%s::text IS NULL OR a.ts_code = %s)
+    ORDER BY a.trade_date DESC, a.ts_code
+"""
+
+# 全市场每日信号统计，按交易日范围查询
+MARKET_BREADTH_SQL = """
+    SELECT trade_date, active_tickers, buy_count, sell_count, signal_count, avg_earnings_rate
+    FROM market_breadth
+    WHERE trade_date >= %s AND trade_date <= %s
+    ORDER BY trade_date
+"""
+
+# 排行榜可选的排序键
+LEADERBOARD_ORDER_BY = ("return_rate", "signal_count", "latest_signal_date")
+
+# 排行榜的排序键 -> stock_window_stats中的列
+LEADERBOARD_INDEX_COLUMNS = {
+    "return_rate": "avg_earnings_rate",
+    "signal_count": "signal_count",
+    "latest_signal_date": "last_signal_date",
+    "latest_buy_date": "last_buy_date",
+    "latest_sell_date": "last_sell_date"
+}
+
+# 信号类型筛选条件
+LEADERBOARD_SIGNAL_FILTERS = {
+    "any": "signal_count > 0",
+    "buy": "buy_count > 0",
+    "sell": "sell_count > 0"
+}
+
+LEADERBOARD_COLUMNS = "ts_code, signal_count, buy_count, sell_count, avg_earnings_rate, last_signal_date, last_buy_date, last_sell_date"
+
+PRECOMPUTED_LEADERBOARD_SQL = f"""
+    SELECT {LEADERBOARD_COLUMNS}
+    FROM stock_window_stats
+    WHERE window_days = %s AND start_date = %s AND {{signal_filter}}
+    ORDER BY {{order_column}} DESC NULLS LAST, ts_code
+    LIMIT %s
+"""
+
+# 非标准窗口没有预计算统计，分组现算后同样只返回前K行
+WINDOW_LEADERBOARD_SQL = f"""
+    SELECT {LEADERBOARD_COLUMNS}
+    FROM (
+        SELECT a.ts_code, COUNT(h.id) AS signal_count,
+               COUNT(h.id) FILTER (WHERE h.buy > 0) AS buy_count, COUNT(h.id) FILTER (WHERE h.sell > 0) AS sell_count,
+               COALESCE(AVG(h.earnings_rate), 0) AS avg_earnings_rate, MAX(a.trade_date) AS last_signal_date,
+               MAX(a.trade_date) FILTER (WHERE h.buy > 0) AS last_buy_date,
+               MAX(a.trade_date) FILTER (WHERE h.sell > 0) AS last_sell_date
+        FROM all_stocks_days a
+        JOIN high_level_inflows h ON a.id = h.all_stocks_days_id AND h.trade_date = a.trade_date
+        WHERE a.trade_date >= %s AND h.trade_date >= %s AND (h.buy > 0 OR h.sell > 0)
+        GROUP BY a.ts_code
+    ) stats
+    WHERE {{signal_filter}}
+    ORDER BY {{order_column}} DESC NULLS LAST, ts_code
+    LIMIT %s
+"""
+
+STOCK_WINDOW_SQL = f"""
+    SELECT {STOCK_WINDOW_COLUMNS}
+    FROM all_stocks_days a
+    LEFT JOIN high_level_inflows h ON a.id = h.all_stocks_days_id AND h.trade_date = a.trade_date AND h.trade_date >= %s
+    WHERE a.ts_code = %s AND a.trade_date >= %s
+    ORDER BY a.trade_date
+"""
+
+STOCK_RETURN_SQL = """
+    SELECT AVG(h.earnings_rate), COUNT(h.id)
+    FROM high_level_inflows h
+    JOIN all_stocks_days a ON h.all_stocks_days_id = a.id AND h.trade_date = a.trade_date
+    WHERE a.ts_code = %s AND a.trade_date >= %s AND h.trade_date >= %s AND (h.buy > 0 OR h.sell > 0)
+"""
+
+BATCH_STOCK_WINDOW_SQL = f"""
+    SELECT {STOCK_WINDOW_COLUMNS}
+    FROM all_stocks_days a
+    LEFT JOIN high_level_inflows h ON a.id = h.all_stocks_days_id AND h.trade_date = a.trade_date AND h.trade_date >= %s
+    WHERE a.ts_code = ANY(%s) AND a.trade_date >= %s
+    ORDER BY a.ts_code, a.trade_date
+"""
+
+BATCH_STOCK_RETURN_SQL = """
+    SELECT a.ts_code, AVG(h.earnings_rate), COUNT(h.id)
+    FROM high_level_inflows h
+    JOIN all_stocks_days a ON h.all_stocks_days_id = a.id AND h.trade_date = a.trade_date
+    WHERE a.ts_code = ANY(%s) AND a.trade_date >= %s AND h.trade_date >= %s AND (h.buy > 0 OR h.sell > 0)
+    GROUP BY a.ts_code
+"""
+
+FETCH_WINDOW_SQL = """
+    SELECT ts_code, trade_date, open, high, low, close, pre_close, pct_chg, vol, bay, ma120, ma250, name, id
+    FROM all_stocks_days
+    WHERE ts_code = ANY(%s) AND trade_date >= %s
+    ORDER BY ts_code, trade_date
+"""
+
+# FETCH_WINDOW_SQL结果中的数值列及其位置
+WINDOW_COLUMN_POSITIONS = {
+    "open": 2,
+    "high": 3,
+    "low": 4,
+    "close": 5,
+    "pre_close": 6,
+    "pct_chg": 7,
+    "vol": 8,
+    "ma120": 10,
+    "ma250": 11
+}
+
+WINDOW_FINGERPRINT_SQL = """
+    SELECT MAX(trade_date), COUNT(*), MAX(id)
+    FROM all_stocks_days
+    WHERE trade_date >= %s
+"""
+
+# 信号行的分区键取自all_stocks_days
+SIGNAL_TRADE_DATES_SQL = """
+    SELECT id, trade_date FROM all_stocks_days WHERE id = ANY(%s)
+"""
+
+EXISTING_SIGNALS_SQL = """
+    SELECT all_stocks_days_id, buy, sell, earnings_rate FROM high_level_inflows
+    WHERE all_stocks_days_id = ANY(%s) AND trade_date >= %s
+"""
+
+# high_level_inflows的月份分区：名称、范围和估计行数
+SIGNAL_PARTITIONS_SQL = """
+    SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'high_level_inflows'::regclass
+"""
+
+# NUMERIC -> float 类型转换器
+# 只注册到连接池中的连接上，get_db_connection()返回的普通连接仍然得到Decimal
+FLOAT_NUMERIC = extensions.new_type(
+    extensions.DECIMAL.values,
+    'FLOAT_NUMERIC',
+    lambda value, cursor: float(value) if value is not None else None
+)
+
+_float_pool = None
+_float_pool_lock = threading.Lock()
+
+# 每个线程的语句超时（毫秒），由准入控制按请求类别设置；连接池中每个连接当前生效的超时
+_statement_timeout = threading.local()
+_connection_timeouts = {}
+
+# 内存中的股票目录 {ts_code: (ts_code, name, first_trade_date, last_trade_date, active)}
+_stock_catalog = None
+_stock_catalog_loaded_at = 0.0
+_stock_catalog_lock = threading.Lock()
+
+def get_conn_string(config=None):
+    """根据DB_CONFIG（或指定的副本配置）构建连接字符串"""
+    config = config or DB_CONFIG
+    return f"host={config['host']} port={config['port']} dbname={config['database']} user={config['user']} password={config['password']}"
+
 def get_db_connection():
-    """获取数据库连接"""
-    conn_string = f"host={DB_CONFIG['host']} port={DB_CONFIG['port']} dbname={DB_CONFIG['database']} user={DB_CONFIG['user']} password={DB_CONFIG['password']}"
-    return psycopg2.connect(conn_string)
+    """获取数据库连接（NUMERIC列返回Decimal）"""
+    return psycopg2.connect(get_conn_string())
+
+def set_statement_timeout(timeout_ms):
+    """设置当前线程后续从连接池获取的连接的语句超时（毫秒，0表示不限制）"""
+    _statement_timeout.value = timeout_ms or 0
+
+def get_statement_timeout():
+    """当前线程的语句超时（毫秒）"""
+    return getattr(_statement_timeout, "value", 0)
+
+def _get_float_pool():
+    """懒加载NUMERIC->float连接池"""
+    global _float_pool
+    if _float_pool is None:
+        with _float_pool_lock:
+            if _float_pool is None:
+                _float_pool = pool.ThreadedConnectionPool(DB_POOL_MIN_CONN, DB_POOL_MAX_CONN, get_conn_string())
+    return _float_pool
+
+def _prepare_connection(conn):
+    """注册NUMERIC->float转换，并在语句超时与当前线程不同时重新设置（单独提交，不受后续回滚影响）"""
+    extensions.register_type(FLOAT_NUMERIC, conn)
+    timeout = get_statement_timeout()
+    if _connection_timeouts.get(id(conn), 0) != timeout:
+        cursor = conn.cursor()
+        cursor.execute("SET statement_timeout = %s", (timeout,))
+        cursor.close()
+        conn.commit()
+        _connection_timeouts[id(conn)] = timeout
+
+def _release_connection(conn_pool, conn):
+    """回滚未提交的事务并把连接归还连接池"""
+    if conn.closed:
+        _connection_timeouts.pop(id(conn), None)
+        conn_pool.putconn(conn, close=True)
+    else:
+        conn.rollback()
+        conn_pool.putconn(conn)
+
+@contextmanager
+def get_float_connection():
+    """从主库连接池获取一个NUMERIC列直接返回float的连接
+
+    用法:
+        with db_utils.get_float_connection() as conn:
+            cursor = conn.cursor()
+            ...
+
+    退出时未提交的事务会被回滚，连接归还连接池。
+    连接的statement_timeout跟随当前线程的set_statement_timeout设置。
+    """
+    float_pool = _get_float_pool()
+    conn = float_pool.getconn()
+    try:
+        _prepare_connection(conn)
+        yield conn
+    finally:
+        _release_connection(float_pool, conn)
+
+
+class _Replica:
+    """一个只读副本的连接池和健康状态"""
+
+    def __init__(self, config):
+        self.config = config
+        self.name = f"{config['host']}:{config['port']}"
+        self.pool = None
+        self.down_until = 0.0
+        self.failures = 0
+        self.reads = 0
+        # 已确认回放到的主库写入位置
+        self.replayed_lsn = 0
+
+    def get_pool(self):
+        if self.pool is None:
+            with _float_pool_lock:
+                if self.pool is None:
+                    self.pool = pool.ThreadedConnectionPool(DB_POOL_MIN_CONN, DB_POOL_MAX_CONN, get_conn_string(self.config))
+        return self.pool
+
+    def mark_down(self, error):
+        self.failures += 1
+        self.down_until = time.monotonic() + REPLICA_RETRY_SECONDS
+        print(f"⚠️ 只读副本 {self.name} 不可用，{REPLICA_RETRY_SECONDS}秒内改用其他副本或主库: {str(error)}")
+
+    def is_caught_up(self, conn, required_lsn):
+        """副本是否已回放到required_lsn（不是流复制备库时无法确认，视为未追上）"""
+        if required_lsn <= self.replayed_lsn:
+            return True
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_last_wal_replay_lsn()::text")
+        replayed = cursor.fetchone()[0]
+        cursor.close()
+        conn.rollback()
+        if replayed is None:
+            return False
+        self.replayed_lsn = max(self.replayed_lsn, _parse_lsn(replayed))
+        return required_lsn <= self.replayed_lsn
+
+
+_replicas = None
+_replica_counter = itertools.count()
+
+# 最近一次刷新或实时写入后主库的WAL位置，副本回放到这里之前读请求仍走主库
+# （进程内记录的值，和REQUIRED_LSN_PATH中其他进程记录的值取最大）
+_required_lsn = 0
+_required_lsn_fd = None
+_required_lsn_pid = None
+_required_lsn_lock = threading.Lock()
+
+# 当前线程是否固定使用主库读取（刷新和写入过程中的读取）
+_primary_reads = threading.local()
+
+def _parse_lsn(lsn):
+    """把'16/B374D848'格式的WAL位置转换为整数"""
+    high, _, low = lsn.partition("/")
+    return (int(high, 16) << 32) + int(low, 16)
+
+def _get_replicas():
+    global _replicas
+    if _replicas is None:
+        _replicas = [_Replica(config) for config in DB_REPLICAS]
+    return _replicas
+
+def _required_lsn_file():
+    """打开共享的写入位置文件（调用方持有_required_lsn_lock），打不开时返回None，只使用进程内记录
+
+    flock的锁属于打开的文件描述，fork出的子进程和父进程共用同一个描述时互不排斥，所以每个进程重新打开。
+    """
+    global _required_lsn_fd, _required_lsn_pid
+    if _required_lsn_pid != os.getpid():
+        if _required_lsn_fd is not None:
+            os.close(_required_lsn_fd)
+            _required_lsn_fd = None
+        _required_lsn_pid = os.getpid()
+        try:
+            os.makedirs(os.path.dirname(REQUIRED_LSN_PATH), exist_ok=True)
+            _required_lsn_fd = os.open(REQUIRED_LSN_PATH, os.O_RDWR | os.O_CREAT, 0o644)
+        except OSError as e:
+            print(f"⚠️ 无法打开共享的写入位置文件 {REQUIRED_LSN_PATH}，只按本进程的写入路由副本: {str(e)}")
+    return _required_lsn_fd
+
+def _shared_required_lsn(lsn=0):
+    """读取各进程共享的写入位置，lsn更大时先写入文件，返回两者的最大值"""
+    with _required_lsn_lock:
+        fd = _required_lsn_file()
+        if fd is None:
+            return lsn
+        fcntl.flock(fd, fcntl.LOCK_EX if lsn else fcntl.LOCK_SH)
+        try:
+            data = os.pread(fd, 8, 0)
+            current = struct.unpack("<Q", data)[0] if len(data) == 8 else 0
+            if lsn > current:
+                os.pwrite(fd, struct.pack("<Q", lsn), 0)
+                current = lsn
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    return current
+
+def get_required_lsn():
+    """副本必须回放到的主库写入位置（包括其他工作进程记录的写入）"""
+    global _required_lsn
+    _required_lsn = max(_required_lsn, _shared_required_lsn())
+    return _required_lsn
+
+def record_primary_write(cursor=None):
+    """提交写入后调用：记录主库当前WAL位置，副本回放到这里之前所有工作进程的读请求都不会路由到该副本"""
+    global _required_lsn
+    if not DB_REPLICAS:
+        return
+    if cursor is None:
+        with get_float_connection() as conn:
+            return record_primary_write(conn.cursor())
+    cursor.execute("SELECT pg_current_wal_lsn()::text")
+    lsn = _parse_lsn(cursor.fetchone()[0])
+    _required_lsn = max(_required_lsn, _shared_required_lsn(lsn))
+
+def primary_reads(func):
+    """装饰器：函数执行期间当前线程的读取都走主库（刷新、写入和写后立即读取的流程使用）"""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        previous = getattr(_primary_reads, "value", False)
+        _primary_reads.value = True
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _primary_reads.value = previous
+    return wrapper
+
+def _checkout_replica():
+    """按轮询顺序选择健康且已追上最近写入的副本，返回(副本, 连接)；没有可用副本时返回(None, None)"""
+    replicas = _get_replicas()
+    if not replicas or getattr(_primary_reads, "value", False):
+        return None, None
+    required_lsn = get_required_lsn()
+    start = next(_replica_counter)
+    now = time.monotonic()
+    for k in range(len(replicas)):
+        replica = replicas[(start + k) % len(replicas)]
+        if replica.down_until > now:
+            continue
+        conn = None
+        try:
+            conn = replica.get_pool().getconn()
+            _prepare_connection(conn)
+            if required_lsn and not replica.is_caught_up(conn, required_lsn):
+                replica.get_pool().putconn(conn)
+                continue
+            return replica, conn
+        except psycopg2.Error as e:
+            replica.mark_down(e)
+            if conn is not None:
+                replica.get_pool().putconn(conn, close=True)
+    return None, None
+
+@contextmanager
+def get_read_connection():
+    """获取只读查询的连接：优先轮询健康的副本，副本都不可用、落后于最近写入
+    或当前线程固定使用主库时使用主库连接
+
+    用法与get_float_connection相同，只能执行只读查询。
+    """
+    replica, conn = _checkout_replica()
+    if replica is None:
+        with get_float_connection() as conn:
+            yield conn
+        return
+    replica.reads += 1
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+        # 连接断开等错误：副本暂停使用，本次查询的错误照常抛出
+        replica.mark_down(e)
+        raise
+    finally:
+        _release_connection(replica.get_pool(), conn)
+
+def get_replica_status():
+    """各副本的健康状态和读取次数"""
+    now = time.monotonic()
+    return {
+        "required_lsn": get_required_lsn() if DB_REPLICAS else _required_lsn,
+        "replicas": [{
+            "replica": replica.name,
+            "healthy": replica.down_until <= now,
+            "reads": replica.reads,
+            "failures": replica.failures,
+            "replayed_lsn": replica.replayed_lsn
+        } for replica in _get_replicas()]
+    }
+
+def close_pools():
+    """关闭主库和所有副本的连接池，下次使用时重新创建
+
+    连接不能跨进程共享：prefork服务的父进程在派生工作进程之前调用，
+    工作进程各自建立自己的连接池。
+    """
+    global _float_pool
+    with _float_pool_lock:
+        pools = [_float_pool] + [replica.pool for replica in _replicas or []]
+        _float_pool = None
+        for replica in _replicas or []:
+            replica.pool = None
+    for conn_pool in pools:
+        if conn_pool is not None and not conn_pool.closed:
+            conn_pool.closeall()
+    _connection_timeouts.clear()
 
 def get_latest_trading_dates(limit=TRADING_DAYS_LIMIT):
     """获取最近的交易日期列表
@@ -30,21 +550,15 @@ def get_latest_trading_dates(limit=TRADING_DAYS_LIMIT):
     list: 交易日期列表，按日期降序排序
     """
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # 获取最近的交易日期
-        cursor.execute("""
-            SELECT DISTINCT trade_date 
-            FROM all_stocks_days 
-            ORDER BY trade_date DESC 
-            LIMIT %s
-        """, (limit,))
-        
-        dates = [row[0] for row in cursor.fetchall()]
-        
-        cursor.close()
-        conn.close()
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            
+            # 获取最近的交易日期
+            cursor.execute(LATEST_DATES_SQL, (limit,))
+            
+            dates = [row[0] for row in cursor.fetchall()]
+            
+            cursor.close()
         
         return dates
     except Exception as e:
@@ -52,29 +566,153 @@ def get_latest_trading_dates(limit=TRADING_DAYS_LIMIT):
         return []
 
 def get_all_stocks_count():
-    """获取数据库中股票数量"""
+    """获取数据库中股票数量（来自股票目录）"""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # 获取股票总数
-        cursor.execute("SELECT COUNT(DISTINCT ts_code) FROM all_stocks_days")
-        count = cursor.fetchone()[0]
-        
-        cursor.close()
-        conn.close()
-        
-        return count
+        return len(get_stock_catalog())
     except Exception as e:
         print(f"获取股票总数时出错: {str(e)}")
         return 0
 
-def get_stocks_with_signals_from_db():
-    """从数据库获取有买卖点信号的股票数据"""
+def _window_stats_ready(cursor, days, start_date):
+    """预计算的窗口统计是否覆盖当前窗口"""
+    if days not in STANDARD_WINDOWS:
+        return False
+    cursor.execute("SELECT to_regclass('stock_window_stats') IS NOT NULL")
+    if not cursor.fetchone()[0]:
+        return False
+    cursor.execute("""
+        SELECT EXISTS(SELECT 1 FROM stock_window_stats WHERE window_days = %s AND start_date = %s)
+    """, (days, start_date))
+    return cursor.fetchone()[0]
+
+def get_window_signal_stats(cursor, days, start_date, ts_codes=None):
+    """获取窗口内有信号的股票及其信号数和平均收益率
+    
+    优先读取刷新时维护的stock_window_stats，不可用时用一次分组查询现算。
+    
+    参数:
+    ts_codes: 只统计这些股票，None表示全部股票
+    
+    返回:
+    dict: {ts_code: (signal_count, avg_return_rate)}
+    """
+    if _window_stats_ready(cursor, days, start_date):
+        if ts_codes is None:
+            cursor.execute(PRECOMPUTED_WINDOW_STATS_SQL, (days, start_date))
+        else:
+            cursor.execute(CODES_PRECOMPUTED_WINDOW_STATS_SQL, (days, start_date, list(ts_codes)))
+    elif ts_codes is None:
+        cursor.execute(WINDOW_SIGNAL_STATS_SQL, (start_date, start_date))
+    else:
+        cursor.execute(CODES_WINDOW_SIGNAL_STATS_SQL, (start_date, start_date, list(ts_codes)))
+    return {row[0]: (row[1] or 0, row[2] or 0.0) for row in cursor.fetchall()}
+
+def build_signal_stocks_result(latest_dates, total_stocks, signal_stats, rows_by_code):
+    """由窗口信号统计和窗口行构建信号股票结果（各存储后端共用）
+    
+    参数:
+    latest_dates: 窗口内的交易日（降序）
+    total_stocks: 股票总数
+    signal_stats: get_window_signal_stats的结果
+    rows_by_code: {ts_code: [STOCK_WINDOW_COLUMNS行, ...]}
+    """
+    # 构建结果数据
+    data = []
+    stock_returns = []
+    for ts_code in sorted(signal_stats):
+        stock_rows = rows_by_code.get(ts_code)
+        if not stock_rows:
+            continue
+        
+        signal_count, avg_return_rate = signal_stats[ts_code]
+        
+        # 添加收益率信息
+        stock_returns.append({
+            "ts_code": ts_code,
+            "name": stock_rows[0][12],
+            "signal_count": signal_count,
+            "return_rate": avg_return_rate
+        })
+        data.append(stock_rows)
+    
+    # 按收益率排序股票
+    print("正在按收益率排序股票...")
+    stock_returns.sort(key=lambda x: x["return_rate"], reverse=True)
+    
+    # 构建结果
+    return {
+        "column_names": STOCK_COLUMN_NAMES,
+        "data": data,
+        "page": 1,
+        "stock_count": len(data),
+        "total_stocks": total_stocks,
+        "date_range": {
+            "start": latest_dates[-1],
+            "end": latest_dates[0],
+            "days": len(latest_dates)
+        },
+        "stock_returns": stock_returns
+    }
+
+def build_stock_result(ts_code, stock_rows, signal_count, return_rate, latest_dates):
+    """由一只股票的窗口行和收益率构建单只股票结果（各存储后端共用）"""
+    return {
+        "column_names": STOCK_COLUMN_NAMES,
+        "data": [stock_rows],
+        "page": 1,
+        "stock_count": 1,
+        # 检查买入或卖出信号 (bay或sell字段)
+        "has_signal": any(row[9] > 0 or row[-1] > 0 for row in stock_rows),
+        "date_range": {
+            "start": latest_dates[-1],
+            "end": latest_dates[0],
+            "days": len(latest_dates)
+        },
+        "return_info": {
+            "ts_code": ts_code,
+            "name": stock_rows[0][12],
+            "signal_count": signal_count or 0,
+            "return_rate": return_rate or 0.0
+        }
+    }
+
+def build_window_returns_result(latest_dates, signal_stats, names):
+    """由窗口信号统计构建收益率统计结果（按收益率降序，各存储后端共用）
+
+    参数:
+    latest_dates: 窗口内的交易日（降序）
+    signal_stats: get_window_signal_stats的结果
+    names: {ts_code: 股票名称}
+    """
+    stock_returns = [
+        {
+            "ts_code": ts_code,
+            "name": names.get(ts_code) or "",
+            "signal_count": signal_count,
+            "return_rate": avg_return_rate
+        }
+        for ts_code, (signal_count, avg_return_rate) in signal_stats.items()
+    ]
+    stock_returns.sort(key=lambda x: x["return_rate"], reverse=True)
+    return {
+        "stock_returns": stock_returns,
+        "date_range": {
+            "start": latest_dates[-1],
+            "end": latest_dates[0],
+            "days": len(latest_dates)
+        }
+    }
+
+def get_stocks_with_signals_from_db(days=TRADING_DAYS_LIMIT):
+    """从数据库获取有买卖点信号的股票数据
+    
+    参数:
+    days: 回看的交易日数
+    """
     try:
         # 获取最近的交易日期
         print("正在获取最近的交易日期...")
-        latest_dates = get_latest_trading_dates(TRADING_DAYS_LIMIT)
+        latest_dates = get_latest_trading_dates(days)
         if not latest_dates:
             print("❌ 错误: 无法获取最近交易日期")
             return {"error": "无法获取最近交易日期"}
@@ -87,215 +725,330 @@ def get_stocks_with_signals_from_db():
         
         # 连接数据库
         print("正在连接数据库...")
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        print("✓ 数据库连接成功")
-        
-        # 查询有信号的股票（在最近20天内有买点或卖点的股票）
-        print("正在查询有买卖点信号的股票...")
-        cursor.execute("""
-            SELECT DISTINCT a.ts_code 
-            FROM all_stocks_days a
-            JOIN high_level_inflows h ON a.id = h.all_stocks_days_id
-            WHERE a.trade_date >= %s AND (h.buy > 0 OR h.sell > 0)
-            ORDER BY a.ts_code
-        """, (latest_dates[-1],))
-        
-        stocks_with_signals = [row[0] for row in cursor.fetchall()]
-        
-        if not stocks_with_signals:
-            print("❌ 没有找到有信号的股票")
-            cursor.close()
-            conn.close()
-            return {"error": "没有找到有信号的股票"}
-        
-        print(f"✓ 找到 {len(stocks_with_signals)} 只有买卖点信号的股票 (数据库总共 {total_stocks} 只股票)")
-        
-        # 构建结果数据
-        print("正在获取股票详细数据...")
-        column_names = ["ts_code", "trade_date", "open", "high", "low", "close", "pre_close", "pct_chg", "vol", "bay", "ma120", "ma250", "name", "sell"]
-        data = []
-        stock_returns = []
-        
-        # 获取每只股票的数据
-        for idx, ts_code in enumerate(stocks_with_signals):
-            # 每处理一只股票都输出一次
-            print(f"  正在加载第 {idx+1}/{len(stocks_with_signals)} 只股票数据: {ts_code}")
-                
-            # 获取股票最近20天数据，包括买卖点信息
-            cursor.execute("""
-                SELECT a.ts_code, a.trade_date, a.open, a.high, a.low, a.close, a.pre_close, 
-                       a.pct_chg, a.vol, h.buy as bay, a.ma120, a.ma250, a.name, h.sell
-                FROM all_stocks_days a
-                LEFT JOIN high_level_inflows h ON a.id = h.all_stocks_days_id
-                WHERE a.ts_code = %s AND a.trade_date >= %s
-                ORDER BY a.trade_date
-            """, (ts_code, latest_dates[-1]))
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            print("✓ 数据库连接成功")
             
-            stock_data = cursor.fetchall()
+            # 查询有信号的股票及其收益率（窗口内有买点或卖点的股票）
+            print("正在查询有买卖点信号的股票...")
+            signal_stats = get_window_signal_stats(cursor, days, latest_dates[-1])
+            stocks_with_signals = sorted(signal_stats)
             
-            if stock_data:
-                # 转换数据类型
-                stock_rows = []
-                for row in stock_data:
-                    stock_row = []
-                    for j, item in enumerate(row):
-                        if isinstance(item, Decimal):
-                            stock_row.append(float(item))
-                        elif item is None:
-                            # 将NULL值转换为0.0
-                            stock_row.append(0.0)
-                        else:
-                            stock_row.append(item)
-                    stock_rows.append(stock_row)
-                
-                # 获取股票收益率
-                cursor.execute("""
-                    SELECT AVG(h.earnings_rate), COUNT(h.id)
-                    FROM high_level_inflows h
-                    JOIN all_stocks_days a ON h.all_stocks_days_id = a.id
-                    WHERE a.ts_code = %s AND a.trade_date >= %s AND (h.buy > 0 OR h.sell > 0)
-                """, (ts_code, latest_dates[-1]))
-                
-                avg_return = cursor.fetchone()
-                avg_return_rate = float(avg_return[0]) if avg_return and avg_return[0] else 0.0
-                signal_count = int(avg_return[1]) if avg_return and avg_return[1] else 0
-                
-                # 添加收益率信息
-                stock_info = {
-                    "ts_code": ts_code,
-                    "name": stock_rows[0][12] if stock_rows and len(stock_rows[0]) > 12 else "",
-                    "signal_count": signal_count,
-                    "return_rate": avg_return_rate
-                }
-                stock_returns.append(stock_info)
-                
-                data.append(stock_rows)
-        
-        # 关闭数据库连接
-        cursor.close()
-        conn.close()
-        
-        # 按收益率排序股票
-        print("正在按收益率排序股票...")
-        stock_returns.sort(key=lambda x: x["return_rate"], reverse=True)
+            if not stocks_with_signals:
+                print("❌ 没有找到有信号的股票")
+                cursor.close()
+                return {"error": "没有找到有信号的股票"}
+            
+            print(f"✓ 找到 {len(stocks_with_signals)} 只有买卖点信号的股票 (数据库总共 {total_stocks} 只股票)")
+            
+            # 一次查询获取所有有信号股票的窗口数据（数值列已由连接转换为float）
+            print("正在获取股票详细数据...")
+            cursor.execute(BATCH_STOCK_WINDOW_SQL, (latest_dates[-1], stocks_with_signals, latest_dates[-1]))
+            rows_by_code = {}
+            for row in cursor.fetchall():
+                rows_by_code.setdefault(row[0], []).append(row)
+            
+            # 关闭游标，连接归还连接池
+            cursor.close()
         
-        # 构建结果
-        result = {
-            "column_names": column_names,
-            "data": data,
-            "page": 1,
-            "stock_count": len(data),
-            "total_stocks": total_stocks,
-            "date_range": {
-                "start": latest_dates[-1],
-                "end": latest_dates[0],
-                "days": len(latest_dates)
-            },
-            "stock_returns": stock_returns
-        }
+        result = build_signal_stocks_result(latest_dates, total_stocks, signal_stats, rows_by_code)
         
-        print(f"✅ 数据加载完成！共加载了 {len(data)} 只股票的数据")
+        print(f"✅ 数据加载完成！共加载了 {result['stock_count']} 只股票的数据")
         return result
     except Exception as e:
         print(f"❌ 从数据库获取股票数据时出错: {str(e)}")
         return {"error": str(e)}
 
-def get_single_stock_data(ts_code):
-    """获取单只股票数据并计算买卖点"""
+def get_single_stock_data(ts_code, days=TRADING_DAYS_LIMIT):
+    """获取单只股票数据并计算买卖点
+    
+    参数:
+    ts_code: 股票代码
+    days: 回看的交易日数
+    """
     try:
         # 获取最近的交易日期
-        latest_dates = get_latest_trading_dates(TRADING_DAYS_LIMIT)
+        latest_dates = get_latest_trading_dates(days)
         if not latest_dates:
             return {"error": "无法获取最近交易日期"}
         
         # 连接数据库
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # 获取股票数据
-        cursor.execute("""
-            SELECT a.ts_code, a.trade_date, a.open, a.high, a.low, a.close, a.pre_close, 
-                   a.pct_chg, a.vol, h.buy as bay, a.ma120, a.ma250, a.name, h.sell
-            FROM all_stocks_days a
-            LEFT JOIN high_level_inflows h ON a.id = h.all_stocks_days_id
-            WHERE a.ts_code = %s AND a.trade_date >= %s
-            ORDER BY a.trade_date
-        """, (ts_code, latest_dates[-1]))
-        
-        stock_data = cursor.fetchall()
-        
-        if not stock_data:
-            cursor.close()
-            conn.close()
-            return {"error": f"没有找到股票 {ts_code} 的数据"}
-        
-        # 构建结果数据
-        column_names = ["ts_code", "trade_date", "open", "high", "low", "close", "pre_close", "pct_chg", "vol", "bay", "ma120", "ma250", "name", "sell"]
-        
-        # 转换数据类型
-        stock_rows = []
-        has_signal = False
-        
-        for row in stock_data:
-            stock_row = []
-            for j, item in enumerate(row):
-                if isinstance(item, Decimal):
-                    stock_row.append(float(item))
-                elif item is None:
-                    # 将NULL值转换为0.0
-                    stock_row.append(0.0)
-                else:
-                    stock_row.append(item)
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
             
-            if stock_row[9] > 0 or stock_row[-1] > 0:  # 检查买入或卖出信号 (bay或sell字段)
-                has_signal = True
-                
-            stock_rows.append(stock_row)
+            # 获取股票数据（数值列已由连接转换为float）
+            cursor.execute(STOCK_WINDOW_SQL, (latest_dates[-1], ts_code, latest_dates[-1]))
+            
+            stock_rows = cursor.fetchall()
+            
+            if not stock_rows:
+                cursor.close()
+                return {"error": f"没有找到股票 {ts_code} 的数据"}
+            
+            # 获取股票收益率，优先读取预计算的窗口统计
+            if _window_stats_ready(cursor, days, latest_dates[-1]):
+                cursor.execute("""
+                    SELECT avg_earnings_rate, signal_count FROM stock_window_stats
+                    WHERE ts_code = %s AND window_days = %s AND start_date = %s
+                """, (ts_code, days, latest_dates[-1]))
+            else:
+                cursor.execute(STOCK_RETURN_SQL, (ts_code, latest_dates[-1], latest_dates[-1]))
+            
+            avg_return = cursor.fetchone() or (None, None)
+            
+            # 关闭游标，连接归还连接池
+            cursor.close()
         
-        # 获取股票收益率
-        cursor.execute("""
-            SELECT AVG(h.earnings_rate), COUNT(h.id)
-            FROM high_level_inflows h
-            JOIN all_stocks_days a ON h.all_stocks_days_id = a.id
-            WHERE a.ts_code = %s AND a.trade_date >= %s AND (h.buy > 0 OR h.sell > 0)
-        """, (ts_code, latest_dates[-1]))
+        return build_stock_result(ts_code, stock_rows, avg_return[1], avg_return[0], latest_dates)
+    except Exception as e:
+        return {"error": str(e)}
+
+def build_stocks_results(ts_codes, rows_by_code, returns_by_code, latest_dates):
+    """多只股票的结果 {ts_code: 单只股票结果}，没有数据的股票对应{"error": ...}
+
+    参数:
+    rows_by_code: {ts_code: [STOCK_WINDOW_COLUMNS行, ...]}
+    returns_by_code: {ts_code: (ts_code, 平均收益率, 信号数)}
+    """
+    results = {}
+    for ts_code in ts_codes:
+        stock_rows = rows_by_code.get(ts_code)
+        if not stock_rows:
+            results[ts_code] = {"error": f"没有找到股票 {ts_code} 的数据"}
+            continue
+        avg_return = returns_by_code.get(ts_code) or (ts_code, None, None)
+        results[ts_code] = build_stock_result(ts_code, stock_rows, avg_return[2], avg_return[1], latest_dates)
+    return results
+
+def get_multiple_stocks_data(ts_codes):
+    """一次查询获取多只股票数据，每只股票的结果与get_single_stock_data格式相同
+    
+    参数:
+    ts_codes: 股票代码列表
+    
+    返回:
+    dict: {ts_code: 单只股票结果}，没有数据的股票对应{"error": ...}；整体出错时返回{"error": ...}
+    """
+    try:
+        # 获取最近的交易日期
+        latest_dates = get_latest_trading_dates(TRADING_DAYS_LIMIT)
+        if not latest_dates:
+            return {"error": "无法获取最近交易日期"}
         
-        avg_return = cursor.fetchone()
-        avg_return_rate = float(avg_return[0]) if avg_return and avg_return[0] else 0.0
-        signal_count = int(avg_return[1]) if avg_return and avg_return[1] else 0
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            
+            # 一次查询获取所有股票的窗口数据（数值列已由连接转换为float）
+            cursor.execute(BATCH_STOCK_WINDOW_SQL, (latest_dates[-1], list(ts_codes), latest_dates[-1]))
+            rows_by_code = {}
+            for row in cursor.fetchall():
+                rows_by_code.setdefault(row[0], []).append(row)
+            
+            # 一次分组聚合获取所有股票的收益率
+            cursor.execute(BATCH_STOCK_RETURN_SQL, (list(ts_codes), latest_dates[-1], latest_dates[-1]))
+            returns_by_code = {row[0]: row for row in cursor.fetchall()}
+            
+            # 关闭游标，连接归还连接池
+            cursor.close()
         
-        # 添加收益率信息
-        stock_info = {
-            "ts_code": ts_code,
-            "name": stock_rows[0][12] if stock_rows and len(stock_rows[0]) > 12 else "",
-            "signal_count": signal_count,
-            "return_rate": avg_return_rate
-        }
+        return build_stocks_results(ts_codes, rows_by_code, returns_by_code, latest_dates)
+    except Exception as e:
+        return {"error": str(e)}
+
+def get_window_ts_codes(start_date):
+    """获取窗口内有交易数据的股票代码列表（按代码排序，来自股票目录）"""
+    return [entry[0] for entry in get_stock_catalog().values() if entry[3] is not None and entry[3] >= start_date]
+
+def fetch_stocks_window(cursor, ts_codes, start_date):
+    """一次查询获取一批股票在窗口内的原始数据
+
+    参数:
+    cursor: 数据库游标
+    ts_codes: 股票代码列表
+    start_date: 窗口起始交易日
+
+    返回:
+    dict: {ts_code: [row, ...]}，每只股票的行按trade_date升序，行末为all_stocks_days.id
+    """
+    cursor.execute(FETCH_WINDOW_SQL, (list(ts_codes), start_date))
+    
+    stocks_data = {}
+    for row in cursor.fetchall():
+        stocks_data.setdefault(row[0], []).append(row)
+    return stocks_data
+
+def lock_signal_writes(cursor):
+    """获取写入high_level_inflows的事务级咨询锁，事务提交或回滚时释放"""
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (SIGNALS_WRITE_LOCK_ID,))
+
+def upsert_signals(cursor, signals, changed=None):
+    """批量写入买卖点信号到high_level_inflows（不提交事务）
+
+    参数:
+    cursor: 数据库游标
+    signals: [(all_stocks_days_id, buy, sell, earnings_rate), ...]
+    changed: 可选列表，追加新增或取值发生变化的信号
+
+    返回:
+    int: 写入（更新+插入）的行数
+    """
+    if not signals:
+        return 0
+    
+    # 查询已有记录之前加锁，其他事务不会同时插入同一行或分配到相同的id
+    lock_signal_writes(cursor)
+    
+    # 信号行的交易日（分区键），之后的查询和更新只扫描这些交易日所在的分区
+    ids = [signal[0] for signal in signals]
+    cursor.execute(SIGNAL_TRADE_DATES_SQL, (ids,))
+    trade_dates = dict(cursor.fetchall())
+    # all_stocks_days中已不存在的行没有分区键，不能写入
+    unresolved = len(signals) - sum(1 for signal in signals if signal[0] in trade_dates)
+    if unresolved:
+        print(f"⚠️ {unresolved} 个信号对应的all_stocks_days行不存在，已跳过")
+        signals = [signal for signal in signals if signal[0] in trade_dates]
+        ids = [signal[0] for signal in signals]
+    if not signals:
+        return 0
+    start_date = min(trade_dates[row_id] for row_id in ids)
+    
+    # 一次查询找出已存在的记录及其当前取值
+    cursor.execute(EXISTING_SIGNALS_SQL, (ids, start_date))
+    existing = {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+    
+    updates = [signal for signal in signals if signal[0] in existing]
+    inserts = [signal for signal in signals if signal[0] not in existing]
+    if inserts:
+        # 新记录所在月份的分区不存在时补建；早于保留期的月份已整体删除，不再写入
+        expired = _ensure_insert_partitions(cursor, [trade_dates[signal[0]] for signal in inserts])
+        if expired:
+            before = len(inserts)
+            inserts = [signal for signal in inserts
+                       if _parse_trade_date(trade_dates[signal[0]]).replace(day=1) not in expired]
+            print(f"⚠️ {before - len(inserts)} 个信号早于保留期（{SIGNAL_RETENTION_MONTHS}个月），已跳过")
+            signals = updates + inserts
+    if changed is not None:
+        changed.extend(signal for signal in signals if existing.get(signal[0]) != tuple(signal[1:]))
+    
+    # 批量更新现有记录
+    if updates:
+        extras.execute_values(cursor, cursor.mogrify("""
+            UPDATE high_level_inflows AS h
+            SET buy = v.buy, sell = v.sell, earnings_rate = v.earnings_rate
+            FROM (VALUES %%s) AS v(all_stocks_days_id, buy, sell, earnings_rate)
+            WHERE h.all_stocks_days_id = v.all_stocks_days_id AND h.trade_date >= %s
+        """, (start_date,)), updates)
+    
+    # 批量插入新记录，ID在当前最大值之后连续分配
+    if inserts:
+        cursor.execute("SELECT COALESCE(MAX(id), 0) FROM high_level_inflows")
+        next_id = cursor.fetchone()[0] + 1
+        extras.execute_values(cursor, """
+            INSERT INTO high_level_inflows (id, all_stocks_days_id, trade_date, buy, sell, earnings_rate)
+            VALUES %s
+        """, [(next_id + k, signal[0], trade_dates[signal[0]]) + tuple(signal[1:]) for k, signal in enumerate(inserts)])
+    
+    return len(updates) + len(inserts)
+
+def ensure_strategy_signals_table(cursor):
+    """创建插件策略信号表，按(策略id, all_stocks_days_id)存储"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS strategy_signals (
+            strategy_id TEXT NOT NULL,
+            all_stocks_days_id BIGINT NOT NULL,
+            value DOUBLE PRECISION NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            PRIMARY KEY (strategy_id, all_stocks_days_id)
+        )
+    """)
+
+def upsert_strategy_signals(cursor, signals):
+    """批量写入插件策略信号到strategy_signals（不提交事务），取值未变的行不改写
+
+    参数:
+    cursor: 数据库游标
+    signals: [(strategy_id, all_stocks_days_id, value), ...]
+
+    返回:
+    int: 新增或取值变化的行数
+    """
+    if not signals:
+        return 0
+    written = extras.execute_values(cursor, """
+        INSERT INTO strategy_signals (strategy_id, all_stocks_days_id, value)
+        VALUES %s
+        ON CONFLICT (strategy_id, all_stocks_days_id) DO UPDATE SET
+            value = EXCLUDED.value,
+            updated_at = now()
+        WHERE strategy_signals.value IS DISTINCT FROM EXCLUDED.value
+        RETURNING 1
+    """, signals, page_size=1000, fetch=True)
+    return len(written)
+
+def get_strategy_signals(strategy_id, ts_code=None, days=TRADING_DAYS_LIMIT):
+    """获取窗口内某个插件策略的信号（按交易日降序、股票代码升序）
+
+    参数:
+    strategy_id: 策略id
+    ts_code: 只返回这只股票的信号，None表示全部股票
+    days: 回看的交易日数
+
+    返回:
+    dict: {"signals": [...], "date_range": {...}}，出错时返回{"error": ...}
+    """
+    try:
+        latest_dates = get_latest_trading_dates(days)
+        if not latest_dates:
+            return {"error": "无法获取最近交易日期"}
         
-        # 关闭数据库连接
-        cursor.close()
-        conn.close()
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT to_regclass('strategy_signals') IS NOT NULL")
+            if not cursor.fetchone()[0]:
+                cursor.close()
+                return {"error": "策略信号尚未生成，请先刷新数据"}
+            cursor.execute(STRATEGY_SIGNALS_SQL, (strategy_id, latest_dates[-1], ts_code, ts_code))
+            rows = cursor.fetchall()
+            cursor.close()
         
-        # 构建结果
-        result = {
-            "column_names": column_names,
-            "data": [stock_rows],
-            "page": 1,
-            "stock_count": 1,
-            "has_signal": has_signal,
+        return {
+            "signals": [
+                {"ts_code": row_ts_code, "name": name, "trade_date": trade_date, "value": value}
+                for row_ts_code, name, trade_date, value in rows
+            ],
             "date_range": {
                 "start": latest_dates[-1],
                 "end": latest_dates[0],
                 "days": len(latest_dates)
-            },
-            "return_info": stock_info
+            }
         }
-        
-        return result
     except Exception as e:
         return {"error": str(e)}
 
+def get_window_fingerprint():
+    """计算刷新窗口的数据指纹：(最大交易日, 行数, 最大id)
+
+    走trade_date索引的一次聚合查询，窗口内新增或删除行、新交易日到达时指纹都会变化，
+    用于跳过数据没有变化的刷新。
+
+    返回:
+    str: "最大交易日|行数|最大id"，没有交易日时返回None
+    """
+    latest_dates = get_latest_trading_dates()
+    if not latest_dates:
+        return None
+    with get_float_connection() as conn:
+        cursor = conn.cursor()
+        fingerprint = window_fingerprint(cursor, latest_dates[-1])
+        cursor.close()
+    return fingerprint
+
+def window_fingerprint(cursor, start_date):
+    """在调用方的事务中计算从start_date开始的窗口指纹，格式同get_window_fingerprint()"""
+    cursor.execute(WINDOW_FINGERPRINT_SQL, (start_date,))
+    max_trade_date, row_count, max_id = cursor.fetchone()
+    return f"{max_trade_date}|{row_count}|{max_id}"
+
 def get_all_stocks_info():
     """获取数据库中所有股票的基本信息"""
     try:
@@ -304,26 +1057,15 @@ def get_all_stocks_info():
         if not latest_dates:
             return {"error": "无法获取最近交易日期"}
         
-        # 连接数据库
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
         # 获取股票总数
         total_stocks = get_all_stocks_count()
         
-        # 获取所有股票代码和名称
-        cursor.execute("""
-            SELECT DISTINCT ts_code, name 
-            FROM all_stocks_days
-            WHERE trade_date >= %s
-            ORDER BY ts_code
-        """, (latest_dates[-1],))
-        
-        stocks = [{"ts_code": row[0], "name": row[1]} for row in cursor.fetchall()]
-        
-        # 关闭数据库连接
-        cursor.close()
-        conn.close()
+        # 窗口内有交易的股票代码和名称（来自股票目录）
+        stocks = [
+            {"ts_code": entry[0], "name": entry[1]}
+            for entry in get_stock_catalog().values()
+            if entry[3] is not None and entry[3] >= latest_dates[-1]
+        ]
         
         result = {
             "stocks": stocks,
@@ -340,97 +1082,941 @@ def get_all_stocks_info():
     except Exception as e:
         return {"error": str(e)}
 
-def create_database_indexes():
-    """创建数据库索引以提升查询性能"""
+def ensure_stock_catalog_table(cursor):
+    """创建股票目录表（列类型沿用all_stocks_days）"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS stock_catalog AS
+        SELECT ts_code, name, trade_date AS first_trade_date, trade_date AS last_trade_date, TRUE AS active
+        FROM all_stocks_days
+        WITH NO DATA
+    """)
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_stock_catalog_ts_code ON stock_catalog (ts_code)")
+
+def sync_stock_catalog(rebuild=False):
+    """增量维护股票目录表并刷新内存中的目录
+    
+    只扫描目录中最近交易日及之后的all_stocks_days行（走trade_date索引），
+    新股票插入目录，已有股票更新名称和最后交易日；active表示最近交易日窗口内有交易。
+    
+    参数:
+    rebuild: 是否清空后全量重建（历史数据被回补时使用）
+    
+    返回:
+    int: 本次插入或更新的股票数
+    """
+    with get_float_connection() as conn:
+        cursor = conn.cursor()
+        ensure_stock_catalog_table(cursor)
+        
+        if rebuild:
+            cursor.execute("TRUNCATE stock_catalog")
+        
+        cursor.execute("SELECT MAX(last_trade_date) FROM stock_catalog")
+        since = cursor.fetchone()[0]
+        
+        # 目录为空时全量构建，否则只处理最近交易日及之后的数据（包括同一天后到的数据）
+        where = "WHERE trade_date >= %s" if since is not None else ""
+        cursor.execute(f"""
+            INSERT INTO stock_catalog (ts_code, name, first_trade_date, last_trade_date, active)
+            SELECT ts_code, (array_agg(name ORDER BY trade_date DESC))[1], MIN(trade_date), MAX(trade_date), TRUE
+            FROM all_stocks_days
+            {where}
+            GROUP BY ts_code
+            ON CONFLICT (ts_code) DO UPDATE SET
+                name = EXCLUDED.name,
+                first_trade_date = LEAST(stock_catalog.first_trade_date, EXCLUDED.first_trade_date),
+                last_trade_date = GREATEST(stock_catalog.last_trade_date, EXCLUDED.last_trade_date)
+        """, (since,) if since is not None else None)
+        changed = cursor.rowcount
+        
+        # 更新活跃标记：最近交易日窗口内有交易
+        cursor.execute(LATEST_DATES_SQL, (TRADING_DAYS_LIMIT,))
+        dates = [row[0] for row in cursor.fetchall()]
+        if dates:
+            cursor.execute("""
+                UPDATE stock_catalog SET active = (last_trade_date >= %s)
+                WHERE active IS DISTINCT FROM (last_trade_date >= %s)
+            """, (dates[-1], dates[-1]))
+        
+        conn.commit()
+        cursor.close()
+    
+    _load_stock_catalog()
+    print(f"✓ 股票目录已同步，本次更新 {changed} 只股票")
+    return changed
+
+def touch_stock_catalog(cursor, ts_code, name, trade_date):
+    """写入单根K线后更新股票目录（不提交事务），并同步内存目录"""
+    cursor.execute("""
+        INSERT INTO stock_catalog (ts_code, name, first_trade_date, last_trade_date, active)
+        VALUES (%s, %s, %s, %s, TRUE)
+        ON CONFLICT (ts_code) DO UPDATE SET
+            name = COALESCE(EXCLUDED.name, stock_catalog.name),
+            last_trade_date = GREATEST(stock_catalog.last_trade_date, EXCLUDED.last_trade_date),
+            active = TRUE
+    """, (ts_code, name, trade_date, trade_date))
+    with _stock_catalog_lock:
+        if _stock_catalog is not None:
+            entry = _stock_catalog.get(ts_code)
+            if entry is None:
+                _stock_catalog[ts_code] = (ts_code, name, trade_date, trade_date, True)
+            else:
+                _stock_catalog[ts_code] = (ts_code, name or entry[1], entry[2], max(entry[3], trade_date), True)
+
+def _load_stock_catalog():
+    """从stock_catalog表加载内存目录"""
+    global _stock_catalog, _stock_catalog_loaded_at
+    with get_float_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT ts_code, name, first_trade_date, last_trade_date, active
+            FROM stock_catalog
+            ORDER BY ts_code
+        """)
+        catalog = {row[0]: row for row in cursor.fetchall()}
+        cursor.close()
+    with _stock_catalog_lock:
+        _stock_catalog = catalog
+        _stock_catalog_loaded_at = time.time()
+    return catalog
+
+def get_stock_catalog():
+    """返回内存中的股票目录，过期时从stock_catalog表重新加载，表不存在时先同步
+    
+    返回:
+    dict: {ts_code: (ts_code, name, first_trade_date, last_trade_date, active)}，按ts_code排序
+    """
+    if _stock_catalog is not None and time.time() - _stock_catalog_loaded_at < STOCK_CATALOG_TTL:
+        return _stock_catalog
     try:
-        print("正在创建数据库索引...")
-        conn = get_db_connection()
+        catalog = _load_stock_catalog()
+    except psycopg2.errors.UndefinedTable:
+        sync_stock_catalog()
+        catalog = _stock_catalog
+    if not catalog:
+        # 目录表存在但尚未构建
+        sync_stock_catalog()
+        catalog = _stock_catalog
+    return catalog
+
+def _trade_date_type(cursor):
+    """all_stocks_days.trade_date的列类型"""
+    cursor.execute("""
+        SELECT format_type(atttypid, atttypmod) FROM pg_attribute
+        WHERE attrelid = 'all_stocks_days'::regclass AND attname = 'trade_date'
+    """)
+    return cursor.fetchone()[0]
+
+def ensure_window_stats_table(cursor):
+    """创建滚动窗口统计表（日期列类型沿用all_stocks_days）"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS stock_window_stats AS
+        SELECT ts_code, 0 AS window_days, trade_date AS start_date, trade_date AS end_date,
+               0::bigint AS buy_count, 0::bigint AS sell_count, 0::bigint AS signal_count,
+               0::double precision AS avg_earnings_rate, 0::double precision AS max_earnings_rate,
+               trade_date AS last_signal_date, trade_date AS last_buy_date, trade_date AS last_sell_date
+        FROM all_stocks_days
+        WITH NO DATA
+    """)
+    # 早期创建的表没有最近信号日期列，按trade_date的类型补上
+    date_type = _trade_date_type(cursor)
+    for column in ("last_signal_date", "last_buy_date", "last_sell_date"):
+        cursor.execute(f"ALTER TABLE stock_window_stats ADD COLUMN IF NOT EXISTS {column} {date_type}")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_stock_window_stats_ts_code ON stock_window_stats (ts_code, window_days)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_stock_window_stats_window ON stock_window_stats (window_days, start_date)")
+    # 排行榜按各排序键ORDER BY ... LIMIT时直接按索引顺序读取前K行
+    for key, column in LEADERBOARD_INDEX_COLUMNS.items():
+        cursor.execute(f"""
+            CREATE INDEX IF NOT EXISTS idx_stock_window_stats_{key}
+            ON stock_window_stats (window_days, start_date, {column} DESC NULLS LAST)
+        """)
+
+def _parse_trade_date(value):
+    """把交易日（date或YYYY-MM-DD、YYYYMMDD格式的字符串）转换为date"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = str(value)
+    return datetime.strptime(text, "%Y%m%d" if len(text) == 8 else "%Y-%m-%d").date()
+
+def format_trade_date(value, sample):
+    """把date转换为与sample（trade_date列中已有的取值）相同的表示，使Python中的比较和SQL参数与列类型一致
+
+    date类型的列返回date，YYYYMMDD格式的文本列返回YYYYMMDD，其他（包括没有已有取值时）返回YYYY-MM-DD
+    """
+    if isinstance(sample, date):
+        return value
+    if isinstance(sample, str) and len(sample) == 8:
+        return value.strftime("%Y%m%d")
+    return value.isoformat()
+
+def _add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+def _signal_partition_name(month):
+    return f"high_level_inflows_p{month:%Y%m}"
+
+def _signal_partition_bound(month, sample):
+    """分区边界：与trade_date现有取值相同的格式（date类型的列为YYYY-MM-DD）"""
+    if isinstance(sample, str) and len(sample) == 8:
+        return month.strftime("%Y%m%d")
+    return month.isoformat()
+
+def _create_signal_partition(cursor, table, month, sample):
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {_signal_partition_name(month)} PARTITION OF {table}
+        FOR VALUES FROM (%s) TO (%s)
+    """, (_signal_partition_bound(month, sample), _signal_partition_bound(_add_months(month, 1), sample)))
+
+def _signal_partition_months(cursor):
+    """high_level_inflows现有的月份分区 {month: 分区名}"""
+    cursor.execute(SIGNAL_PARTITIONS_SQL)
+    return {date(int(name[-6:-2]), int(name[-2:]), 1): name for name, _, _ in cursor.fetchall()}
+
+def _partition_signal_table(cursor, exists, months, sample):
+    """把high_level_inflows改为按trade_date分区的表，复制第一个分区之后的信号，返回复制的行数"""
+    date_type = _trade_date_type(cursor)
+    if exists:
+        columns = "LIKE high_level_inflows"
+    else:
+        columns = "id BIGINT NOT NULL, all_stocks_days_id BIGINT NOT NULL, buy DOUBLE PRECISION, sell DOUBLE PRECISION, earnings_rate DOUBLE PRECISION"
+    cursor.execute(f"""
+        CREATE TABLE high_level_inflows_partitioned ({columns}, trade_date {date_type} NOT NULL)
+        PARTITION BY RANGE (trade_date)
+    """)
+    for month in months:
+        _create_signal_partition(cursor, "high_level_inflows_partitioned", month, sample)
+    
+    copied = 0
+    if exists:
+        cursor.execute("""
+            INSERT INTO high_level_inflows_partitioned
+            SELECT h.*, a.trade_date
+            FROM high_level_inflows h
+            JOIN all_stocks_days a ON a.id = h.all_stocks_days_id
+            WHERE a.trade_date >= %s
+        """, (_signal_partition_bound(months[0], sample),))
+        copied = cursor.rowcount
+        cursor.execute("ALTER TABLE high_level_inflows RENAME TO high_level_inflows_unpartitioned")
+    cursor.execute("ALTER TABLE high_level_inflows_partitioned RENAME TO high_level_inflows")
+    
+    # 在分区表上建的索引自动建到每个分区（包括之后创建的分区）上
+    cursor.execute("ALTER TABLE high_level_inflows ADD PRIMARY KEY (id, trade_date)")
+    for index in SIGNAL_PARTITION_INDEXES:
+        cursor.execute(_index_sql(index, concurrently=False))
+    return copied
+
+def ensure_signal_partitions(cursor):
+    """确保high_level_inflows按月分区：创建保留期内和之后SIGNAL_PARTITIONS_AHEAD个月的分区，
+    删除早于保留期的分区（不提交事务）
+    
+    尚未分区的表在第一次调用时迁移：保留期内的信号连同trade_date复制到新的分区表，
+    原表重命名为high_level_inflows_unpartitioned保留，确认无误后可手动删除。
+    月份按数据中最近的交易日计算，而不是当前日期，历史数据库不会因为时间流逝被清空。
+    
+    返回:
+    dict: {"migrated": 迁移时复制的行数（未迁移为None）, "created": [分区名], "dropped": [分区名]}
+    """
+    # 先取写入锁再取分区锁（与upsert_signals补建分区的顺序相同）：删除分区需要等写入信号的事务提交，
+    # 而持有写入锁的事务不会再反过来等待分区维护
+    lock_signal_writes(cursor)
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (SIGNAL_PARTITION_LOCK_ID,))
+    cursor.execute(LATEST_DATES_SQL, (max(STANDARD_WINDOWS),))
+    dates = [row[0] for row in cursor.fetchall()]
+    if not dates:
+        return {"migrated": None, "created": [], "dropped": []}
+    
+    sample = dates[0]
+    latest_month = _parse_trade_date(dates[0]).replace(day=1)
+    window_month = _parse_trade_date(dates[-1]).replace(day=1)
+    if SIGNAL_RETENTION_MONTHS > 0:
+        first_month = min(_add_months(latest_month, 1 - SIGNAL_RETENTION_MONTHS), window_month)
+    else:
+        cursor.execute("SELECT MIN(trade_date) FROM all_stocks_days")
+        first_month = _parse_trade_date(cursor.fetchone()[0]).replace(day=1)
+    last_month = _add_months(max(latest_month, date.today().replace(day=1)), SIGNAL_PARTITIONS_AHEAD)
+    months = [first_month]
+    while months[-1] < last_month:
+        months.append(_add_months(months[-1], 1))
+    
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('high_level_inflows')")
+    row = cursor.fetchone()
+    migrated = None
+    if row is None or row[0] != 'p':
+        migrated = _partition_signal_table(cursor, row is not None, months, sample)
+    
+    existing = _signal_partition_months(cursor)
+    created = []
+    for month in months:
+        if month not in existing:
+            _create_signal_partition(cursor, "high_level_inflows", month, sample)
+            created.append(_signal_partition_name(month))
+    
+    # 整个分区一次删除，不逐行DELETE
+    dropped = []
+    if SIGNAL_RETENTION_MONTHS > 0:
+        for month, name in sorted(existing.items()):
+            if month < first_month:
+                cursor.execute(f"DROP TABLE {name}")
+                dropped.append(name)
+    return {"migrated": migrated, "created": created, "dropped": dropped}
+
+def _ensure_insert_partitions(cursor, values):
+    """确保要插入的交易日所在的月份分区存在（不提交事务）
+
+    刷新和实时写入的交易日通常已有分区，只有超出提前创建范围（或分区维护失败）时才补建。
+    调用方已持有SIGNALS_WRITE_LOCK_ID，与ensure_signal_partitions的加锁顺序相同。
+
+    返回:
+    set: 早于最早分区（超出保留期、分区已删除）的月份，这些信号不写入
+    """
+    existing = _signal_partition_months(cursor)
+    if not existing:
+        # 表尚未迁移为分区表
+        return set()
+    missing = {_parse_trade_date(value).replace(day=1) for value in values} - existing.keys()
+    if not missing:
+        return set()
+    oldest = min(existing)
+    expired = {month for month in missing if month < oldest}
+    if missing - expired:
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (SIGNAL_PARTITION_LOCK_ID,))
+        for month in sorted(missing - expired):
+            _create_signal_partition(cursor, "high_level_inflows", month, values[0])
+            print(f"✓ 补建信号分区: {_signal_partition_name(month)}")
+    return expired
+
+def maintain_signal_partitions():
+    """在单独的事务中维护high_level_inflows的分区（服务启动和每次刷新开始时调用）"""
+    with get_float_connection() as conn:
         cursor = conn.cursor()
+        result = ensure_signal_partitions(cursor)
+        conn.commit()
+        cursor.close()
+    
+    if result["migrated"] is not None:
+        print(f"✓ high_level_inflows已改为按月分区，复制了 {result['migrated']} 行信号（原表保留为high_level_inflows_unpartitioned）")
+    if result["created"]:
+        print(f"✓ 创建信号分区: {', '.join(result['created'])}")
+    if result["dropped"]:
+        print(f"✓ 删除超出保留期的信号分区: {', '.join(result['dropped'])}")
+    return result
+
+def get_signal_partitions():
+    """high_level_inflows各分区的范围和估计行数（按月份升序）"""
+    try:
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(SIGNAL_PARTITIONS_SQL)
+            rows = cursor.fetchall()
+            cursor.close()
+        partitions = [{"name": name, "bound": bound, "estimated_rows": max(int(rows_estimate), 0)}
+                      for name, bound, rows_estimate in sorted(rows)]
+        return {
+            "partitions": partitions,
+            "retention_months": SIGNAL_RETENTION_MONTHS,
+            "partitions_ahead": SIGNAL_PARTITIONS_AHEAD
+        }
+    except Exception as e:
+        return {"error": str(e)}
+
+def prepare_window_stats():
+    """刷新开始时调用：维护信号分区，确保统计表和策略信号表存在，并返回各标准窗口的起止交易日
+    
+    返回:
+    dict: {window_days: (start_date, end_date)}，交易日不足时用现有的全部交易日
+    """
+    maintain_signal_partitions()
+    with get_float_connection() as conn:
+        cursor = conn.cursor()
+        ensure_window_stats_table(cursor)
+        ensure_strategy_signals_table(cursor)
+        conn.commit()
+        cursor.close()
+    
+    dates = get_latest_trading_dates(max(STANDARD_WINDOWS))
+    if not dates:
+        return {}
+    return {days: (dates[min(days, len(dates)) - 1], dates[0]) for days in STANDARD_WINDOWS}
+
+def refresh_window_stats(cursor, ts_codes, window_dates=None):
+    """重新计算一批股票在各标准窗口内的信号统计并写入stock_window_stats（不提交事务）
+    
+    刷新时每写完一批信号就对这批股票调用一次，每个窗口一条分组语句。
+    
+    参数:
+    cursor: 数据库游标
+    ts_codes: 股票代码列表
+    window_dates: prepare_window_stats()的结果
+    """
+    if not ts_codes:
+        return
+    for days, (start_date, end_date) in window_dates.items():
+        cursor.execute("""
+            INSERT INTO stock_window_stats (ts_code, window_days, start_date, end_date, buy_count, sell_count,
+                                            signal_count, avg_earnings_rate, max_earnings_rate,
+                                            last_signal_date, last_buy_date, last_sell_date)
+            SELECT c.ts_code, %s, %s, %s,
+                   COUNT(h.id) FILTER (WHERE h.buy > 0), COUNT(h.id) FILTER (WHERE h.sell > 0), COUNT(h.id),
+                   COALESCE(AVG(h.earnings_rate), 0), COALESCE(MAX(h.earnings_rate), 0),
+                   MAX(a.trade_date) FILTER (WHERE h.id IS NOT NULL),
+                   MAX(a.trade_date) FILTER (WHERE h.buy > 0), MAX(a.trade_date) FILTER (WHERE h.sell > 0)
+            FROM unnest(%s::text[]) AS c(ts_code)
+            LEFT JOIN all_stocks_days a ON a.ts_code = c.ts_code AND a.trade_date >= %s
+            LEFT JOIN high_level_inflows h ON h.all_stocks_days_id = a.id AND h.trade_date = a.trade_date
+                                          AND h.trade_date >= %s AND (h.buy > 0 OR h.sell > 0)
+            GROUP BY c.ts_code
+            ON CONFLICT (ts_code, window_days) DO UPDATE SET
+                start_date = EXCLUDED.start_date,
+                end_date = EXCLUDED.end_date,
+                buy_count = EXCLUDED.buy_count,
+                sell_count = EXCLUDED.sell_count,
+                signal_count = EXCLUDED.signal_count,
+                avg_earnings_rate = EXCLUDED.avg_earnings_rate,
+                max_earnings_rate = EXCLUDED.max_earnings_rate,
+                last_signal_date = EXCLUDED.last_signal_date,
+                last_buy_date = EXCLUDED.last_buy_date,
+                last_sell_date = EXCLUDED.last_sell_date
+        """, (days, start_date, end_date, list(ts_codes), start_date, start_date))
+
+def refresh_current_window_stats(cursor, ts_codes, window_dates):
+    """只在已覆盖当前窗口的预计算统计中更新一批股票（实时写入后调用，不提交事务）
+    
+    统计还停留在旧起始日的窗口不更新：只写入部分股票会让读取方以为统计已覆盖新窗口，
+    这样的窗口由下次刷新整体重算。
+    
+    参数:
+    cursor: 数据库游标
+    ts_codes: 股票代码列表
+    window_dates: {window_days: (start_date, end_date)}
+    """
+    ready = {days: dates for days, dates in window_dates.items() if _window_stats_ready(cursor, days, dates[0])}
+    refresh_window_stats(cursor, ts_codes, ready)
+
+def ensure_market_breadth_table(cursor):
+    """创建全市场每日信号统计表（日期列类型沿用all_stocks_days）"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS market_breadth AS
+        SELECT trade_date, 0::bigint AS active_tickers, 0::bigint AS buy_count, 0::bigint AS sell_count,
+               0::bigint AS signal_count, 0::double precision AS avg_earnings_rate, now() AS updated_at
+        FROM all_stocks_days
+        WITH NO DATA
+    """)
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_market_breadth_trade_date ON market_breadth (trade_date)")
+
+def refresh_market_breadth(cursor, start_date):
+    """重新统计start_date之后每个交易日的全市场信号数并写入market_breadth（不提交事务）
+    
+    刷新只改写窗口内的信号，因此每次只重算窗口内的交易日，更早的日期保持不变；
+    表为空时（第一次刷新）统计全部历史交易日。
+
+    统计在信号写入之后从表中重算，而不是在计算信号的同一遍中累加：刷新只写入本次算出的信号行，
+    之前写入、本次不再产生信号的行仍留在表中，快照和各查询都会读到它们；分布式刷新的分片也分散在多个进程中。
+    只有按表中的最终状态统计才与/api/stocks等接口一致，代价是窗口内交易日的一次分组查询。
+
+    参数:
+    cursor: 数据库游标
+    start_date: 窗口起始交易日
+    """
+    ensure_market_breadth_table(cursor)
+    cursor.execute("SELECT EXISTS(SELECT 1 FROM market_breadth)")
+    if cursor.fetchone()[0]:
+        signal_filter, date_filter, params = "AND h.trade_date >= %s", "a.trade_date >= %s", (start_date, start_date)
+    else:
+        signal_filter, date_filter, params = "", "TRUE", None
+    cursor.execute(f"""
+        INSERT INTO market_breadth (trade_date, active_tickers, buy_count, sell_count, signal_count, avg_earnings_rate, updated_at)
+        SELECT a.trade_date, COUNT(DISTINCT a.ts_code),
+               COUNT(h.id) FILTER (WHERE h.buy > 0), COUNT(h.id) FILTER (WHERE h.sell > 0),
+               COUNT(h.id) FILTER (WHERE h.buy > 0 OR h.sell > 0),
+               COALESCE(AVG(h.earnings_rate) FILTER (WHERE h.buy > 0 OR h.sell > 0), 0), now()
+        FROM all_stocks_days a
+        LEFT JOIN high_level_inflows h ON h.all_stocks_days_id = a.id AND h.trade_date = a.trade_date {signal_filter}
+        WHERE {date_filter}
+        GROUP BY a.trade_date
+        ON CONFLICT (trade_date) DO UPDATE SET
+            active_tickers = EXCLUDED.active_tickers,
+            buy_count = EXCLUDED.buy_count,
+            sell_count = EXCLUDED.sell_count,
+            signal_count = EXCLUDED.signal_count,
+            avg_earnings_rate = EXCLUDED.avg_earnings_rate,
+            updated_at = EXCLUDED.updated_at
+    """, params)
+
+def get_market_breadth(start_date=None, end_date=None):
+    """获取交易日范围内全市场每日的买卖点信号统计（按日期升序）
+    
+    参数:
+    start_date: 起始交易日，None表示不限
+    end_date: 结束交易日，None表示不限
+    
+    返回:
+    dict: {"market_breadth": [...], "days": 行数}，出错时返回{"error": ...}
+    """
+    try:
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT to_regclass('market_breadth') IS NOT NULL")
+            if not cursor.fetchone()[0]:
+                cursor.close()
+                return {"error": "市场统计尚未生成，请先刷新数据"}
+            cursor.execute("SELECT MIN(trade_date), MAX(trade_date) FROM market_breadth")
+            first_date, last_date = cursor.fetchone()
+            if first_date is None:
+                cursor.close()
+                return {"error": "市场统计尚未生成，请先刷新数据"}
+            cursor.execute(MARKET_BREADTH_SQL, (start_date or first_date, end_date or last_date))
+            rows = cursor.fetchall()
+            cursor.close()
         
-        # 使用事务来确保原子性操作
-        conn.autocommit = False
+        return {
+            "market_breadth": [
+                {
+                    "trade_date": trade_date,
+                    "active_tickers": active_tickers,
+                    "buy_count": buy_count,
+                    "sell_count": sell_count,
+                    "signal_count": signal_count,
+                    "avg_earnings_rate": avg_earnings_rate
+                }
+                for trade_date, active_tickers, buy_count, sell_count, signal_count, avg_earnings_rate in rows
+            ],
+            "days": len(rows)
+        }
+    except Exception as e:
+        return {"error": str(e)}
+
+def get_window_returns(days):
+    """获取窗口内有信号股票的收益率统计（按收益率降序）
+    
+    参数:
+    days: 回看的交易日数
+    
+    返回:
+    dict: {"stock_returns": [...], "date_range": {...}}，出错时返回{"error": ...}
+    """
+    try:
+        latest_dates = get_latest_trading_dates(days)
+        if not latest_dates:
+            return {"error": "无法获取最近交易日期"}
         
-        # 检查索引是否已存在，并尝试创建
-        indexes_to_create = [
-            {
-                "name": "idx_all_stocks_days_ts_code",
-                "table": "all_stocks_days",
-                "columns": "ts_code",
-                "description": "ts_code索引"
-            },
-            {
-                "name": "idx_all_stocks_days_trade_date",
-                "table": "all_stocks_days",
-                "columns": "trade_date",
-                "description": "trade_date索引"
-            },
-            {
-                "name": "idx_all_stocks_days_ts_code_trade_date",
-                "table": "all_stocks_days",
-                "columns": "ts_code, trade_date",
-                "description": "ts_code和trade_date复合索引"
-            },
-            {
-                "name": "idx_high_level_inflows_all_stocks_days_id",
-                "table": "high_level_inflows",
-                "columns": "all_stocks_days_id",
-                "description": "high_level_inflows外键索引"
-            },
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            signal_stats = get_window_signal_stats(cursor, days, latest_dates[-1])
+            cursor.close()
+        
+        catalog = get_stock_catalog()
+        names = {ts_code: entry[1] for ts_code, entry in catalog.items()}
+        return build_window_returns_result(latest_dates, signal_stats, names)
+    except Exception as e:
+        return {"error": str(e)}
+
+def leaderboard_order_key(order_by, signal_type):
+    """排行榜实际使用的排序键：按最近信号日期排序且只看买点或卖点时，取该类信号的最近日期"""
+    if order_by == "latest_signal_date" and signal_type in ("buy", "sell"):
+        return f"latest_{signal_type}_date"
+    return order_by
+
+def _leaderboard_ready(cursor, days, start_date):
+    """预计算统计是否覆盖当前窗口，且已填充最近信号日期（旧表升级后第一次刷新前为空）"""
+    if not _window_stats_ready(cursor, days, start_date):
+        return False
+    cursor.execute("""
+        SELECT NOT EXISTS(
+            SELECT 1 FROM stock_window_stats
+            WHERE window_days = %s AND start_date = %s AND signal_count > 0 AND last_signal_date IS NULL
+        )
+    """, (days, start_date))
+    return cursor.fetchone()[0]
+
+def get_window_leaderboard(days, top, order_by="return_rate", signal_type="any"):
+    """按排序键取窗口内前top只有信号的股票，用ORDER BY ... LIMIT在数据库中完成
+
+    参数:
+    days: 回看的交易日数
+    top: 返回的股票数
+    order_by: 排序键，见LEADERBOARD_INDEX_COLUMNS
+    signal_type: 信号类型筛选，any/buy/sell
+
+    返回:
+    dict: {"leaderboard": [...], "date_range": {...}}，出错时返回{"error": ...}
+    """
+    try:
+        latest_dates = get_latest_trading_dates(days)
+        if not latest_dates:
+            return {"error": "无法获取最近交易日期"}
+        start_date = latest_dates[-1]
+        placeholders = {
+            "signal_filter": LEADERBOARD_SIGNAL_FILTERS[signal_type],
+            "order_column": LEADERBOARD_INDEX_COLUMNS[leaderboard_order_key(order_by, signal_type)]
+        }
+        
+        with get_read_connection() as conn:
+            cursor = conn.cursor()
+            if _leaderboard_ready(cursor, days, start_date):
+                cursor.execute(PRECOMPUTED_LEADERBOARD_SQL.format(**placeholders), (days, start_date, top))
+            else:
+                cursor.execute(WINDOW_LEADERBOARD_SQL.format(**placeholders), (start_date, start_date, top))
+            rows = cursor.fetchall()
+            cursor.close()
+        
+        catalog = get_stock_catalog()
+        leaderboard = [
             {
-                "name": "idx_high_level_inflows_signals",
-                "table": "high_level_inflows",
-                "columns": "buy, sell",
-                "description": "买卖信号索引"
+                "rank": rank,
+                "ts_code": ts_code,
+                "name": catalog[ts_code][1] if ts_code in catalog else "",
+                "return_rate": avg_return_rate or 0.0,
+                "signal_count": signal_count,
+                "buy_count": buy_count,
+                "sell_count": sell_count,
+                "latest_signal_date": last_signal_date,
+                "latest_buy_date": last_buy_date,
+                "latest_sell_date": last_sell_date
             }
+            for rank, (ts_code, signal_count, buy_count, sell_count, avg_return_rate,
+                       last_signal_date, last_buy_date, last_sell_date) in enumerate(rows, 1)
         ]
+        return {
+            "leaderboard": leaderboard,
+            "date_range": {
+                "start": latest_dates[-1],
+                "end": latest_dates[0],
+                "days": len(latest_dates)
+            }
+        }
+    except Exception as e:
+        return {"error": str(e)}
+
+# 需要维护的索引
+# include/where/unique可选，分别对应INCLUDE覆盖列、部分索引条件和唯一索引
+INDEXES = [
+    {
+        "name": "idx_all_stocks_days_ts_code",
+        "table": "all_stocks_days",
+        "columns": "ts_code",
+        "description": "ts_code索引"
+    },
+    {
+        "name": "idx_all_stocks_days_trade_date",
+        "table": "all_stocks_days",
+        "columns": "trade_date",
+        "description": "trade_date索引"
+    },
+    {
+        "name": "idx_all_stocks_days_ts_code_trade_date",
+        "table": "all_stocks_days",
+        "columns": "ts_code, trade_date",
+        "description": "ts_code和trade_date复合索引"
+    },
+    {
+        "name": "idx_all_stocks_days_ts_code_trade_date_covering",
+        "table": "all_stocks_days",
+        "columns": "ts_code, trade_date",
+        "include": "id, open, high, low, close, pre_close, pct_chg, vol, bay, ma120, ma250, name",
+        "description": "ts_code和trade_date覆盖索引"
+    },
+]
+
+# 分区表high_level_inflows上的索引：不能CONCURRENTLY创建，由ensure_signal_partitions在建表时创建，
+# 之后新建的分区自动带上；唯一索引必须包含分区键trade_date
+SIGNAL_PARTITION_INDEXES = [
+    {
+        "name": "idx_high_level_inflows_part_day",
+        "table": "high_level_inflows",
+        "columns": "all_stocks_days_id, trade_date",
+        "unique": True,
+        "description": "high_level_inflows外键唯一索引"
+    },
+    {
+        "name": "idx_high_level_inflows_part_signal_rows",
+        "table": "high_level_inflows",
+        "columns": "all_stocks_days_id, trade_date",
+        "include": "buy, sell, earnings_rate",
+        "where": "buy > 0 OR sell > 0",
+        "description": "有信号行的部分索引"
+    }
+]
+
+# 索引顾问检查的热点查询及其预期使用的索引
+# params中的占位符: ts_code为样例股票代码，start_date为窗口起始交易日
+HOT_QUERIES = [
+    {
+        "name": "get_latest_trading_dates",
+        "sql": LATEST_DATES_SQL,
+        "params": lambda ts_code, start_date: (TRADING_DAYS_LIMIT,),
+        "intended_indexes": ["idx_all_stocks_days_trade_date"]
+    },
+    {
+        "name": "get_window_signal_stats",
+        "sql": WINDOW_SIGNAL_STATS_SQL,
+        "params": lambda ts_code, start_date: (start_date, start_date),
+        "intended_indexes": ["idx_high_level_inflows_part_signal_rows", "idx_all_stocks_days_trade_date"]
+    },
+    {
+        "name": "get_window_signal_stats.precomputed",
+        "sql": PRECOMPUTED_WINDOW_STATS_SQL,
+        "params": lambda ts_code, start_date: (TRADING_DAYS_LIMIT, start_date),
+        "intended_indexes": ["idx_stock_window_stats_window"]
+    },
+    {
+        "name": "get_window_leaderboard",
+        "sql": PRECOMPUTED_LEADERBOARD_SQL.format(signal_filter=LEADERBOARD_SIGNAL_FILTERS["any"],
+                                                  order_column=LEADERBOARD_INDEX_COLUMNS["return_rate"]),
+        "params": lambda ts_code, start_date: (TRADING_DAYS_LIMIT, start_date, 50),
+        "intended_indexes": ["idx_stock_window_stats_return_rate"]
+    },
+    {
+        "name": "get_market_breadth",
+        "sql": MARKET_BREADTH_SQL,
+        "params": lambda ts_code, start_date: (start_date, start_date),
+        "intended_indexes": ["idx_market_breadth_trade_date"]
+    },
+    {
+        "name": "stock_window",
+        "sql": STOCK_WINDOW_SQL,
+        "params": lambda ts_code, start_date: (start_date, ts_code, start_date),
+        "intended_indexes": ["idx_all_stocks_days_ts_code_trade_date_covering", "idx_high_level_inflows_part_day"]
+    },
+    {
+        "name": "stock_return",
+        "sql": STOCK_RETURN_SQL,
+        "params": lambda ts_code, start_date: (ts_code, start_date, start_date),
+        "intended_indexes": ["idx_all_stocks_days_ts_code_trade_date_covering", "idx_high_level_inflows_part_signal_rows"]
+    },
+    {
+        "name": "get_multiple_stocks_data.window",
+        "sql": BATCH_STOCK_WINDOW_SQL,
+        "params": lambda ts_code, start_date: (start_date, [ts_code], start_date),
+        "intended_indexes": ["idx_all_stocks_days_ts_code_trade_date_covering", "idx_high_level_inflows_part_day"]
+    },
+    {
+        "name": "get_multiple_stocks_data.returns",
+        "sql": BATCH_STOCK_RETURN_SQL,
+        "params": lambda ts_code, start_date: ([ts_code], start_date, start_date),
+        "intended_indexes": ["idx_all_stocks_days_ts_code_trade_date_covering", "idx_high_level_inflows_part_signal_rows"]
+    },
+    {
+        "name": "fetch_stocks_window",
+        "sql": FETCH_WINDOW_SQL,
+        "params": lambda ts_code, start_date: ([ts_code], start_date),
+        "intended_indexes": ["idx_all_stocks_days_ts_code_trade_date_covering"]
+    },
+    {
+        "name": "upsert_signals.existing",
+        "sql": EXISTING_SIGNALS_SQL,
+        "params": lambda ts_code, start_date: ([0], start_date),
+        "intended_indexes": ["idx_high_level_inflows_part_day"]
+    },
+    {
+        "name": "get_window_fingerprint",
+        "sql": WINDOW_FINGERPRINT_SQL,
+        "params": lambda ts_code, start_date: (start_date,),
+        "intended_indexes": ["idx_all_stocks_days_trade_date"]
+    }
+]
+
+def _index_sql(index, concurrently=True, name=None, table=None):
+    """根据索引定义构建CREATE INDEX [CONCURRENTLY]语句，name和table可替换为分区上的索引名和分区"""
+    unique = "UNIQUE " if index.get("unique") else ""
+    concurrent = "CONCURRENTLY " if concurrently else ""
+    sql = f"CREATE {unique}INDEX {concurrent}IF NOT EXISTS {name or index['name']} ON {table or index['table']} ({index['columns']})"
+    if index.get("include"):
+        sql += f" INCLUDE ({index['include']})"
+    if index.get("where"):
+        sql += f" WHERE {index['where']}"
+    return sql
+
+def _plan_indexes(plan):
+    """递归收集EXPLAIN计划中用到的索引名"""
+    used = set()
+    if "Index Name" in plan:
+        used.add(plan["Index Name"])
+    for child in plan.get("Plans", []):
+        used |= _plan_indexes(child)
+    return used
+
+def explain_hot_queries(cursor):
+    """对热点查询执行EXPLAIN，报告预期索引是否被使用
+
+    返回:
+    list: 每个查询的检查结果
+    """
+    cursor.execute(LATEST_DATES_SQL, (TRADING_DAYS_LIMIT,))
+    dates = [row[0] for row in cursor.fetchall()]
+    if not dates:
+        return []
+    cursor.execute("SELECT ts_code FROM all_stocks_days WHERE trade_date = %s LIMIT 1", (dates[0],))
+    row = cursor.fetchone()
+    ts_code = row[0] if row else ""
+    
+    # 分区上的索引归到分区表上对应的索引名
+    cursor.execute("""
+        SELECT c.relname, p.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE c.relkind = 'i'
+    """)
+    parent_indexes = dict(cursor.fetchall())
+    
+    report = []
+    for query in HOT_QUERIES:
+        try:
+            cursor.execute("EXPLAIN (FORMAT JSON) " + query["sql"], query["params"](ts_code, dates[-1]))
+            plan = cursor.fetchone()[0][0]["Plan"]
+            used = sorted({parent_indexes.get(name, name) for name in _plan_indexes(plan)})
+            uses_intended = any(name in used for name in query["intended_indexes"])
+            report.append({
+                "query": query["name"],
+                "intended_indexes": query["intended_indexes"],
+                "used_indexes": used,
+                "uses_intended_index": uses_intended,
+                "estimated_cost": plan.get("Total Cost")
+            })
+            mark = "✓" if uses_intended else "⚠️"
+            print(f"{mark} {query['name']}: 使用索引 {', '.join(used) if used else '无'}")
+        except Exception as e:
+            report.append({"query": query["name"], "error": str(e)})
+            print(f"❌ EXPLAIN {query['name']} 失败: {str(e)}")
+    return report
+
+# 分区表上的索引缺少哪些分区的子索引
+MISSING_PARTITION_INDEXES_SQL = """
+    SELECT c.relname
+    FROM pg_inherits p
+    JOIN pg_class c ON c.oid = p.inhrelid
+    WHERE p.inhparent = %s::regclass
+      AND NOT EXISTS (
+          SELECT 1
+          FROM pg_inherits pi
+          JOIN pg_index i ON i.indexrelid = pi.inhrelid
+          WHERE pi.inhparent = %s::regclass AND i.indrelid = c.oid
+      )
+    ORDER BY c.relname
+"""
+
+def _ensure_partitioned_index(cursor, index, existing_indexes):
+    """补建分区表上缺失或无效的索引，返回"exists"、"created"或"skipped"
+
+    分区表上不能CONCURRENTLY建索引：先用ON ONLY只在父表上建（此时无效，只改目录，瞬间完成），
+    再在每个缺少子索引的分区上CONCURRENTLY建索引并ATTACH到父索引，所有分区都挂上后父索引自动变为有效。
+    之前中途失败留下的无效子索引删除重建，已建好但未挂上的子索引直接挂上。
+    """
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (index["table"],))
+    row = cursor.fetchone()
+    if row is None or row[0] != "p":
+        # 尚未分区，ensure_signal_partitions迁移时会一起建索引
+        return "skipped"
+    if existing_indexes.get(index["name"]) is True:
+        return "exists"
+    
+    if index["name"] not in existing_indexes:
+        cursor.execute(_index_sql(index, concurrently=False, table=f"ONLY {index['table']}"))
+    cursor.execute(MISSING_PARTITION_INDEXES_SQL, (index["table"], index["name"]))
+    for (partition,) in cursor.fetchall():
+        # 分区名以YYYYMM结尾，子索引名不超过63个字符
+        name = f"{index['name']}_{partition[-6:]}"
+        if existing_indexes.get(name) is False:
+            cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+        cursor.execute(_index_sql(index, name=name, table=partition))
+        cursor.execute(f"ALTER INDEX {index['name']} ATTACH PARTITION {name}")
+    return "created"
+
+def create_database_indexes(advise=True):
+    """创建数据库索引以提升查询性能
+    
+    使用CREATE INDEX CONCURRENTLY在事务外逐个建索引，不阻塞all_stocks_days的写入，
+    单个索引失败不影响其他索引。并发建索引失败会留下无效索引，下次执行时会删除重建。
+    分区表high_level_inflows上缺失或无效的索引逐个分区补建（见_ensure_partitioned_index）。
+    
+    参数:
+    advise: 是否对热点查询执行EXPLAIN并报告预期索引是否被使用
+    """
+    try:
+        print("正在创建数据库索引...")
+        conn = get_db_connection()
+        # CONCURRENTLY不能在事务中执行
+        conn.autocommit = True
+        cursor = conn.cursor()
         
-        # 获取现有索引
+        # 获取现有索引及其是否有效
         cursor.execute("""
-            SELECT indexname FROM pg_indexes 
-            WHERE schemaname = 'public'
+            SELECT c.relname, i.indisvalid
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE n.nspname = 'public'
         """)
-        existing_indexes = [row[0] for row in cursor.fetchall()]
+        existing_indexes = dict(cursor.fetchall())
         
         created_count = 0
         existing_count = 0
+        failed_count = 0
+        index_report = []
         
-        # 创建不存在的索引
-        for index in indexes_to_create:
-            if index["name"] in existing_indexes:
-                print(f"✓ {index['description']}已存在")
-                existing_count += 1
-                continue
-            
+        for index in INDEXES:
+            status = "exists"
             try:
-                create_sql = f"CREATE INDEX {index['name']} ON {index['table']} ({index['columns']})"
+                if existing_indexes.get(index["name"]) is True:
+                    print(f"✓ {index['description']}已存在")
+                    existing_count += 1
+                    index_report.append({"name": index["name"], "status": status})
+                    continue
+                
+                if index["name"] in existing_indexes:
+                    # 之前并发建索引失败留下的无效索引
+                    print(f"⚠️ {index['description']}无效，删除后重建...")
+                    cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index['name']}")
+                
                 print(f"创建{index['description']}...")
-                cursor.execute(create_sql)
+                cursor.execute(_index_sql(index))
                 print(f"✓ {index['description']}创建成功")
                 created_count += 1
+                status = "created"
             except Exception as e:
-                # 如果索引已存在但检查失败，记录错误并继续
-                if "已经存在" in str(e):
-                    print(f"✓ {index['description']}已存在 (创建时检测到)")
-                    existing_count += 1
-                else:
-                    print(f"❌ 创建{index['description']}失败: {str(e)}")
-                    # 不抛出异常，继续尝试创建其他索引
+                print(f"❌ 创建{index['description']}失败: {str(e)}")
+                failed_count += 1
+                index_report.append({"name": index["name"], "status": "error", "error": str(e)})
+                # 不抛出异常，继续尝试创建其他索引
+                continue
+            index_report.append({"name": index["name"], "status": status})
         
-        # 提交事务
-        conn.commit()
+        for index in SIGNAL_PARTITION_INDEXES:
+            try:
+                status = _ensure_partitioned_index(cursor, index, existing_indexes)
+            except Exception as e:
+                print(f"❌ 创建{index['description']}失败: {str(e)}")
+                failed_count += 1
+                index_report.append({"name": index["name"], "status": "error", "error": str(e)})
+                continue
+            if status == "exists":
+                print(f"✓ {index['description']}已存在")
+                existing_count += 1
+            elif status == "created":
+                print(f"✓ {index['description']}已补建到所有分区")
+                created_count += 1
+            else:
+                print(f"⚠️ {index['table']}尚未分区，跳过{index['description']}")
+            index_report.append({"name": index["name"], "status": status})
+        
+        advisor_report = []
+        if advise:
+            print("正在检查热点查询的执行计划...")
+            advisor_report = explain_hot_queries(cursor)
         
         # 关闭连接
         cursor.close()
         conn.close()
         
-        print(f"✅ 所有索引处理完成 (新创建: {created_count}, 已存在: {existing_count})")
-        return {"success": True, "message": f"数据库索引处理完成 (新创建: {created_count}, 已存在: {existing_count})"}
+        message = f"数据库索引处理完成 (新创建: {created_count}, 已存在: {existing_count}, 失败: {failed_count})"
+        print(f"✅ {message}")
+        return {"success": failed_count == 0, "message": message, "indexes": index_report, "advisor": advisor_report}
     except Exception as e:
-        # 如果出错，回滚事务
         if 'conn' in locals() and conn:
-            conn.rollback()
-            cursor.close()
             conn.close()
         
         print(f"❌ 创建索引时出错: {str(e)}")
-        return {"error": str(e)} 
\ No newline at end of file
+        return {"error": str(e)}
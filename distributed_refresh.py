@@ -0,0 +1,399 @@
+"""分布式刷新：协调者把股票分片写入工作队列表，任意多个工作进程并行领取计算
+
+协调者（coordinator）为一次刷新创建refresh_runs记录，把窗口内的股票按批切成分片写入refresh_shards。
+工作进程（worker）可以在同一台或多台机器上运行，用SELECT ... FOR UPDATE SKIP LOCKED领取分片，
+领取时获得一个租约，用现有的compute_stock_signals计算信号后，在同一个事务中写入信号、
+更新窗口统计并把分片标记为完成。工作进程崩溃后租约过期，分片会被其他工作进程重新领取；
+完成时校验分片仍由自己持有，租约已被接管的结果会被回滚，不会重复写入。
+
+用法:
+    python distributed_refresh.py coordinate --batch-size 100 --workers 4
+    python distributed_refresh.py worker [--run-id 12]
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+import db_utils
+import data_processor
+import signal_feed
+import strategies
+
+# 分片租约时长（秒），超过后未完成的分片可以被其他工作进程领取
+LEASE_SECONDS = 300
+
+# 分片处理出错时最多尝试的次数，超过后标记为failed
+MAX_SHARD_ATTEMPTS = 3
+
+# 没有可领取的分片时轮询间隔（秒）
+POLL_INTERVAL = 1.0
+
+CLAIM_SHARD_SQL = """
+    UPDATE refresh_shards
+    SET status = 'running', worker_id = %s, attempts = attempts + 1,
+        started_at = now(), lease_expires_at = now() + %s * INTERVAL '1 second'
+    WHERE (run_id, shard_no) = (
+        SELECT run_id, shard_no FROM refresh_shards
+        WHERE run_id = %s
+          AND (status = 'pending' OR (status = 'running' AND lease_expires_at < now()))
+        ORDER BY shard_no
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING shard_no, ts_codes
+"""
+
+
+def ensure_work_queue_tables(cursor):
+    """创建分布式刷新的运行、窗口和分片表"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS refresh_runs (
+            run_id BIGSERIAL PRIMARY KEY,
+            status TEXT NOT NULL DEFAULT 'running',
+            batch_size INTEGER NOT NULL,
+            shard_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            finished_at TIMESTAMPTZ
+        )
+    """)
+    # 窗口起止日期的列类型沿用all_stocks_days.trade_date
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS refresh_run_windows AS
+        SELECT 0::BIGINT AS run_id, 0 AS window_days, trade_date AS start_date, trade_date AS end_date
+        FROM all_stocks_days
+        WITH NO DATA
+    """)
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_refresh_run_windows_run ON refresh_run_windows (run_id, window_days)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS refresh_shards (
+            run_id BIGINT NOT NULL REFERENCES refresh_runs (run_id) ON DELETE CASCADE,
+            shard_no INTEGER NOT NULL,
+            ts_codes TEXT[] NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            worker_id TEXT,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            lease_expires_at TIMESTAMPTZ,
+            started_at TIMESTAMPTZ,
+            finished_at TIMESTAMPTZ,
+            stocks INTEGER,
+            signals INTEGER,
+            rows_written INTEGER,
+            busy_seconds DOUBLE PRECISION,
+            error TEXT,
+            PRIMARY KEY (run_id, shard_no)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_refresh_shards_claim ON refresh_shards (run_id, status, lease_expires_at)")
+
+@db_utils.primary_reads
+def start_run(batch_size=100):
+    """协调者：同步股票目录、准备窗口统计，把窗口内的股票切成分片写入工作队列
+
+    返回:
+    int: 运行id，没有可处理的交易日时返回None
+    """
+    db_utils.sync_stock_catalog()
+    window_dates = db_utils.prepare_window_stats()
+    if not window_dates:
+        return None
+
+    start_date = window_dates[db_utils.TRADING_DAYS_LIMIT][0]
+    all_stocks = db_utils.get_window_ts_codes(start_date)
+    shards = [all_stocks[start:start + batch_size] for start in range(0, len(all_stocks), batch_size)]
+
+    with db_utils.get_float_connection() as conn:
+        cursor = conn.cursor()
+        ensure_work_queue_tables(cursor)
+        cursor.execute("""
+            INSERT INTO refresh_runs (batch_size, shard_count) VALUES (%s, %s) RETURNING run_id
+        """, (batch_size, len(shards)))
+        run_id = cursor.fetchone()[0]
+        cursor.executemany("""
+            INSERT INTO refresh_run_windows (run_id, window_days, start_date, end_date) VALUES (%s, %s, %s, %s)
+        """, [(run_id, days, start, end) for days, (start, end) in window_dates.items()])
+        cursor.executemany("""
+            INSERT INTO refresh_shards (run_id, shard_no, ts_codes) VALUES (%s, %s, %s)
+        """, [(run_id, shard_no, shard) for shard_no, shard in enumerate(shards)])
+        conn.commit()
+        cursor.close()
+
+    print(f"✓ 刷新运行 {run_id}：{len(all_stocks)} 只股票，{len(shards)} 个分片")
+    return run_id
+
+def _latest_run_id(cursor):
+    cursor.execute("SELECT run_id FROM refresh_runs WHERE status = 'running' ORDER BY run_id DESC LIMIT 1")
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def _run_windows(cursor, run_id):
+    cursor.execute("SELECT window_days, start_date, end_date FROM refresh_run_windows WHERE run_id = %s", (run_id,))
+    return {days: (start, end) for days, start, end in cursor.fetchall()}
+
+def _pending_shards(cursor, run_id):
+    """尚未完成（等待领取或处理中）的分片数"""
+    cursor.execute("SELECT COUNT(*) FROM refresh_shards WHERE run_id = %s AND status IN ('pending', 'running')", (run_id,))
+    return cursor.fetchone()[0]
+
+def _release_failed_shard(cursor, run_id, shard_no, worker_id, error):
+    """释放出错的分片：未超过最大尝试次数时放回队列，否则标记为failed"""
+    cursor.execute("""
+        UPDATE refresh_shards
+        SET status = CASE WHEN attempts < %s THEN 'pending' ELSE 'failed' END,
+            lease_expires_at = NULL, error = %s
+        WHERE run_id = %s AND shard_no = %s AND worker_id = %s AND status = 'running'
+    """, (MAX_SHARD_ATTEMPTS, error, run_id, shard_no, worker_id))
+
+def _process_shard(cursor, run_id, shard_no, ts_codes, window_dates, worker_id):
+    """计算一个分片并在同一事务中写入结果和完成标记（调用方提交）
+
+    返回:
+    dict: 分片统计；分片租约已被其他工作进程接管时返回None
+    """
+    started = time.perf_counter()
+    stocks_data = db_utils.fetch_stocks_window(cursor, ts_codes, window_dates[db_utils.TRADING_DAYS_LIMIT][0])
+    signals, keys, signal_stocks = data_processor.compute_batch_signals(stocks_data)
+    strategy_signals = strategies.evaluate_strategies(stocks_data)
+
+    changed = []
+    rows_written = db_utils.upsert_signals(cursor, signals, changed)
+    # 变化的信号随分片事务记录为推送事件，服务进程的订阅者都能收到
+    signal_feed.record_signals(cursor, changed, keys)
+    db_utils.upsert_strategy_signals(cursor, strategy_signals)
+    db_utils.refresh_window_stats(cursor, ts_codes, window_dates)
+    busy_seconds = time.perf_counter() - started
+
+    cursor.execute("""
+        UPDATE refresh_shards
+        SET status = 'done', finished_at = now(), stocks = %s, signals = %s, rows_written = %s, busy_seconds = %s
+        WHERE run_id = %s AND shard_no = %s AND worker_id = %s AND status = 'running'
+    """, (len(stocks_data), signal_stocks, rows_written, busy_seconds, run_id, shard_no, worker_id))
+    if cursor.rowcount == 0:
+        return None
+    return {"stocks": len(stocks_data), "signals": signal_stocks, "rows_written": rows_written, "busy_seconds": busy_seconds}
+
+@db_utils.primary_reads
+def run_worker(run_id=None, worker_id=None, poll_interval=POLL_INTERVAL):
+    """工作进程：循环领取并处理分片，直到运行中的所有分片都已完成
+
+    参数:
+    run_id: 运行id，None表示最新的运行中的刷新
+    worker_id: 工作进程标识，默认为"主机名-进程号-随机后缀"
+    poll_interval: 暂时没有可领取分片（其他工作进程持有租约）时的轮询间隔
+
+    返回:
+    dict: 本工作进程处理的分片数和股票数
+    """
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    processed = {"worker_id": worker_id, "shards": 0, "stocks": 0, "lost_leases": 0}
+
+    with db_utils.get_float_connection() as conn:
+        cursor = conn.cursor()
+        if run_id is None:
+            run_id = _latest_run_id(cursor)
+            if run_id is None:
+                print("没有运行中的刷新")
+                cursor.close()
+                return processed
+        window_dates = _run_windows(cursor, run_id)
+        conn.commit()
+        print(f"工作进程 {worker_id} 开始处理刷新运行 {run_id}")
+
+        while True:
+            # 领取分片并立即提交，租约对其他工作进程可见
+            cursor.execute(CLAIM_SHARD_SQL, (worker_id, LEASE_SECONDS, run_id))
+            claimed = cursor.fetchone()
+            conn.commit()
+
+            if claimed is None:
+                if _pending_shards(cursor, run_id) == 0:
+                    conn.commit()
+                    break
+                conn.commit()
+                time.sleep(poll_interval)
+                continue
+
+            shard_no, ts_codes = claimed
+            try:
+                stats = _process_shard(cursor, run_id, shard_no, ts_codes, window_dates, worker_id)
+            except Exception as e:
+                conn.rollback()
+                print(f"❌ 分片 {shard_no} 处理出错: {str(e)}")
+                _release_failed_shard(cursor, run_id, shard_no, worker_id, str(e))
+                conn.commit()
+                continue
+            if stats is None:
+                conn.rollback()
+                processed["lost_leases"] += 1
+                print(f"⚠️ 分片 {shard_no} 的租约已被接管，放弃本次结果")
+                continue
+            conn.commit()
+            processed["shards"] += 1
+            processed["stocks"] += stats["stocks"]
+            print(f"✓ 分片 {shard_no}：{stats['stocks']} 只股票，{stats['rows_written']} 个信号，{stats['busy_seconds']:.2f}秒")
+
+        cursor.close()
+
+    print(f"工作进程 {worker_id} 完成：{processed['shards']} 个分片，{processed['stocks']} 只股票")
+    return processed
+
+def spawn_local_workers(run_id, count):
+    """在本机启动count个工作进程"""
+    script = os.path.abspath(__file__)
+    return [subprocess.Popen([sys.executable, script, "worker", "--run-id", str(run_id)], cwd=os.path.dirname(script))
+            for _ in range(count)]
+
+def run_summary(run_id):
+    """汇总一次运行中每个工作进程的吞吐量
+
+    返回:
+    dict: 运行状态、总耗时和按工作进程汇总的分片数、股票数、信号数、忙碌时间和每秒股票数
+    """
+    with db_utils.get_float_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT worker_id, COUNT(*), SUM(stocks), SUM(signals), SUM(rows_written), SUM(busy_seconds),
+                   EXTRACT(EPOCH FROM MAX(finished_at) - MIN(started_at))
+            FROM refresh_shards
+            WHERE run_id = %s AND status = 'done'
+            GROUP BY worker_id
+            ORDER BY worker_id
+        """, (run_id,))
+        workers = [{
+            "worker_id": worker_id,
+            "shards": shards,
+            "stocks": stocks,
+            "signal_stocks": signals,
+            "rows_written": rows_written,
+            "busy_seconds": round(busy_seconds, 3),
+            "active_seconds": round(float(active_seconds or 0), 3),
+            "stocks_per_second": round(stocks / busy_seconds, 1) if busy_seconds else 0.0
+        } for worker_id, shards, stocks, signals, rows_written, busy_seconds, active_seconds in cursor.fetchall()]
+        cursor.execute("""
+            SELECT r.status, r.shard_count,
+                   COUNT(s.shard_no) FILTER (WHERE s.status = 'done'),
+                   COUNT(s.shard_no) FILTER (WHERE s.status = 'failed'),
+                   COUNT(s.shard_no) FILTER (WHERE s.attempts > 1),
+                   EXTRACT(EPOCH FROM COALESCE(r.finished_at, now()) - r.created_at)
+            FROM refresh_runs r
+            LEFT JOIN refresh_shards s ON s.run_id = r.run_id
+            WHERE r.run_id = %s
+            GROUP BY r.run_id
+        """, (run_id,))
+        status, shard_count, done, failed, reclaimed, wall_seconds = cursor.fetchone()
+        cursor.close()
+
+    total_stocks = sum(worker["stocks"] for worker in workers)
+    wall_seconds = float(wall_seconds or 0)
+    return {
+        "run_id": run_id,
+        "status": status,
+        "shard_count": shard_count,
+        "shards_done": done,
+        "shards_failed": failed,
+        "shards_reclaimed": reclaimed,
+        "wall_seconds": round(wall_seconds, 3),
+        "stocks": total_stocks,
+        "stocks_per_second": round(total_stocks / wall_seconds, 1) if wall_seconds else 0.0,
+        "workers": workers
+    }
+
+@db_utils.primary_reads
+def compute_stocks_data_distributed(batch_size=100, local_workers=2, poll_interval=POLL_INTERVAL):
+    """协调一次分布式刷新：写入分片、启动本机工作进程，等待所有分片（包括其他机器上的工作进程处理的）完成
+
+    参数:
+    batch_size: 每个分片的股票数
+    local_workers: 本机启动的工作进程数，0表示只等待其他机器上的工作进程
+    poll_interval: 检查完成状态的间隔
+
+    返回:
+    dict: 与其他刷新函数相同的结果，另含distributed_stats
+    """
+    print("\n===== 开始分布式计算最近交易日股票数据 =====")
+    try:
+        run_id = start_run(batch_size)
+        if run_id is None:
+            return {"error": "无法获取最近交易日期"}
+
+        processes = spawn_local_workers(run_id, local_workers)
+        while True:
+            with db_utils.get_float_connection() as conn:
+                cursor = conn.cursor()
+                pending = _pending_shards(cursor, run_id)
+                cursor.close()
+            if pending == 0:
+                break
+            # 本机工作进程全部退出但仍有分片未完成时（例如全部崩溃），补启动一个
+            if processes and all(process.poll() is not None for process in processes):
+                print(f"⚠️ 本机工作进程已全部退出，仍有 {pending} 个分片未完成，重新启动一个工作进程")
+                processes = spawn_local_workers(run_id, 1)
+            time.sleep(poll_interval)
+
+        for process in processes:
+            process.wait()
+
+        with db_utils.get_float_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE refresh_runs
+                SET status = CASE WHEN EXISTS (
+                        SELECT 1 FROM refresh_shards WHERE run_id = %s AND status = 'failed'
+                    ) THEN 'failed' ELSE 'done' END,
+                    finished_at = now()
+                WHERE run_id = %s
+            """, (run_id, run_id))
+            # 所有分片完成后更新全市场每日统计
+            cursor.execute("""
+                SELECT start_date FROM refresh_run_windows WHERE run_id = %s AND window_days = %s
+            """, (run_id, db_utils.TRADING_DAYS_LIMIT))
+            db_utils.refresh_market_breadth(cursor, cursor.fetchone()[0])
+            conn.commit()
+            cursor.close()
+
+        summary = run_summary(run_id)
+        print(f"✅ 分布式刷新完成：{summary['stocks']} 只股票，{summary['wall_seconds']}秒，{len(summary['workers'])} 个工作进程")
+        if summary["shards_failed"]:
+            print(f"⚠️ {summary['shards_failed']} 个分片多次出错未完成")
+
+        result = data_processor.load_snapshot()
+        result["distributed_stats"] = summary
+        return result
+    except Exception as e:
+        print(f"❌ 分布式刷新出错: {str(e)}")
+        return {"error": str(e)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="分布式刷新买卖点信号")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    coordinate = subparsers.add_parser("coordinate", help="写入分片并等待刷新完成")
+    coordinate.add_argument("--batch-size", type=int, default=100, help="每个分片的股票数")
+    coordinate.add_argument("--workers", type=int, default=2, help="本机启动的工作进程数")
+
+    worker = subparsers.add_parser("worker", help="领取并处理分片")
+    worker.add_argument("--run-id", type=int, default=None, help="运行id，默认为最新的运行中的刷新")
+    worker.add_argument("--worker-id", default=None, help="工作进程标识")
+
+    summary = subparsers.add_parser("summary", help="输出一次运行的吞吐量汇总")
+    summary.add_argument("run_id", type=int)
+
+    args = parser.parse_args(argv)
+    if args.command == "coordinate":
+        result = compute_stocks_data_distributed(batch_size=args.batch_size, local_workers=args.workers)
+        if "error" in result:
+            print(result["error"])
+            return 1
+        print(result["distributed_stats"])
+    elif args.command == "worker":
+        run_worker(run_id=args.run_id, worker_id=args.worker_id)
+    else:
+        print(run_summary(args.run_id))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,707 @@
+"""实时行情写入：新K线到达时立即计算买卖点信号
+
+每只股票在进程内保留最近TRADING_DAYS_LIMIT根K线的环形缓冲区（收盘价、成交量、信号），
+以及末尾SIGNAL_WINDOW根收盘价的滑动和：新K线到达时sum += new - evicted，只计算这一根K线的信号，
+再只更新收益率可能因这根K线变化的卖点，结果与signal_calculator/compute_stock_signals的批量计算完全一致。
+同一交易日的多次写入（盘中K线）会替换当日K线并重新计算。
+
+缓冲区属于写入它的进程：多进程服务（server.py）中实时写入只由第0号工作进程处理，
+其他工作进程把/api/ingest转发给它（见owner_address）。写入事务中按股票获取咨询锁后核对数据库中该股票的最新K线，
+缓冲区落后（其他进程或外部加载写入过K线）时重新读取。
+一次请求的全部K线先整体校验，再在同一个事务中写入K线、信号、插件策略信号、窗口统计和全市场每日统计，
+任何一根K线出错时整批回滚（包括推送事件）；窗口没有移动时同一事务中推进刷新记录的数据指纹，调度器不会为此重新刷新。提交后让这些股票的单只股票缓存失效，并在后台把它们合并进新版本快照。
+"""
+import http.client
+import os
+import threading
+import time
+from collections import deque
+from datetime import date, datetime
+
+from psycopg2 import extras
+
+import data_processor
+import db_utils
+import refresh_scheduler
+import signal_feed
+import stock_cache
+import strategies
+
+# 信号均线窗口，与signal_calculator的默认值一致
+SIGNAL_WINDOW = 5
+
+# 按股票加锁的事务级咨询锁命名空间（第二个键为hashtext(ts_code)），同一只股票的写入串行
+TICKER_LOCK_NAMESPACE = 7304205
+
+# 双精度浮点数的单位舍入误差，滑动和的误差上界按它累计
+UNIT_ROUNDOFF = 2.0 ** -53
+
+# 滑动和的累计误差超过收盘价绝对值之和的这个比例时，按窗口重新求和
+RESYNC_ERROR_RATIO = 2.0 ** -30
+
+# 写入提交后等待这么久（秒）再更新快照，期间写入的股票合并为一次更新
+SNAPSHOT_UPDATE_DELAY = 0.5
+
+# 快照更新失败后重试的间隔（秒）
+SNAPSHOT_RETRY_DELAY = 5
+
+# 多进程服务中负责实时写入的工作进程的回环地址 (host, port)，由server.py在其他工作进程中设置；
+# None表示由本进程写入
+owner_address = None
+
+# 转发写入请求的超时（秒）
+FORWARD_TIMEOUT = 120
+
+# 按hashtext排序后依次获取股票的咨询锁：任意两个事务以相同的顺序加锁，不会互相等待
+LOCK_TICKERS_SQL = """
+    SELECT pg_advisory_xact_lock(%s, key)
+    FROM (SELECT DISTINCT hashtext(c) AS key FROM unnest(%s::text[]) AS c ORDER BY key) keys
+"""
+
+# 每只股票最新一根K线，用于核对进程内的缓冲区是否落后于数据库
+LATEST_BARS_SQL = """
+    SELECT c.ts_code, a.id, a.trade_date
+    FROM unnest(%s::text[]) AS c(ts_code)
+    CROSS JOIN LATERAL (
+        SELECT id, trade_date FROM all_stocks_days
+        WHERE ts_code = c.ts_code
+        ORDER BY trade_date DESC
+        LIMIT 1
+    ) a
+"""
+
+# 每只股票最近的K线和已有信号（按交易日降序）
+RECENT_BARS_SQL = """
+    SELECT c.ts_code, a.trade_date, a.close, a.vol, a.id,
+           COALESCE(h.buy, 0), COALESCE(h.sell, 0), COALESCE(h.earnings_rate, 0)
+    FROM unnest(%s::text[]) AS c(ts_code)
+    CROSS JOIN LATERAL (
+        SELECT id, trade_date, close, vol FROM all_stocks_days
+        WHERE ts_code = c.ts_code
+        ORDER BY trade_date DESC
+        LIMIT %s
+    ) a
+    LEFT JOIN high_level_inflows h ON a.id = h.all_stocks_days_id AND h.trade_date = a.trade_date
+    ORDER BY c.ts_code, a.trade_date DESC
+"""
+
+# K线的可选字段，缺省为NULL
+OPTIONAL_FIELDS = ("open", "high", "low", "pre_close", "pct_chg", "ma120", "ma250")
+
+
+class Bar:
+    """环形缓冲区中的一根K线及其信号
+
+    seq为K线在缓冲区中的序号（替换当日K线时沿用）；after_min只用于卖点，
+    是它与最新一根K线之间（不含两端）的最低收盘价，没有中间K线时为None。
+    """
+    __slots__ = ("trade_date", "close", "vol", "id", "buy", "sell", "earnings_rate", "seq", "after_min")
+
+    def __init__(self, trade_date, close, vol, id, buy=0.0, sell=0.0, earnings_rate=0.0):
+        self.trade_date = trade_date
+        self.close = close
+        self.vol = vol
+        self.id = id
+        self.buy = buy
+        self.sell = sell
+        self.earnings_rate = earnings_rate
+        self.seq = 0
+        self.after_min = None
+
+    @property
+    def has_signal(self):
+        return self.buy > 0 or self.sell > 0
+
+    def signal(self):
+        return (self.id, self.buy, self.sell, self.earnings_rate)
+
+
+def _min_close(first, second):
+    """两个收盘价中较小的一个，忽略None"""
+    if first is None:
+        return second
+    if second is None:
+        return first
+    return min(first, second)
+
+
+class TickerState:
+    """单只股票的增量信号状态
+
+    均线：末尾SIGNAL_WINDOW根K线收盘价的滑动和及其舍入误差上界。收盘价与均线的差超出误差上界时，
+    比较结果与批量计算逐位求和得到的均线相同；落在误差范围内时按批量计算的顺序重新求和再比较。
+    卖点：sells按交易日升序保存批量计算会更新收益率的卖点，它们的after_min随交易日单调不减，
+    新K线只需从最新的卖点向前更新到第一个不受影响的卖点为止。
+    """
+    __slots__ = ("ts_code", "bars", "sells", "next_seq", "before", "window_start",
+                 "ma_sum", "ma_abs", "ma_err", "ma_missing", "rescan")
+
+    def __init__(self, ts_code, bars=()):
+        self.ts_code = ts_code
+        self.bars = deque(bars, maxlen=db_utils.TRADING_DAYS_LIMIT)
+        for seq, bar in enumerate(self.bars):
+            bar.seq = seq
+        self.next_seq = len(self.bars)
+        # 缓冲区中早于窗口起始日的K线数
+        self.before = 0
+        self.window_start = None
+        self.sells = deque()
+        self._resync_sum()
+        # 从数据库读取的缓冲区：第一次写入时完整检查一遍窗口内卖点的收益率
+        self.rescan = bool(self.bars)
+
+    def _resync_sum(self):
+        """按批量计算的顺序重新计算末尾SIGNAL_WINDOW根K线的收盘价之和"""
+        recent = [self.bars[k] for k in range(max(0, len(self.bars) - SIGNAL_WINDOW), len(self.bars))]
+        prices = [item.close for item in recent if item.close is not None]
+        self.ma_sum = sum(prices)
+        self.ma_abs = sum(abs(price) for price in prices)
+        self.ma_err = SIGNAL_WINDOW * UNIT_ROUNDOFF * self.ma_abs
+        self.ma_missing = len(recent) - len(prices)
+
+    def _add_close(self, close, sign):
+        """把一个收盘价加入（sign=1）或移出（sign=-1）滑动和，累计舍入误差上界"""
+        if close is None:
+            self.ma_missing += sign
+            return
+        self.ma_sum += sign * close
+        self.ma_abs += sign * abs(close)
+        self.ma_err += UNIT_ROUNDOFF * (abs(self.ma_sum) + self.ma_abs)
+
+    def _locate_window(self, window_start):
+        """维护缓冲区中早于窗口起始日的K线数（窗口只向后移动，均摊O(1)）"""
+        if self.window_start is None or window_start < self.window_start:
+            self.before = sum(1 for item in self.bars if item.trade_date < window_start)
+            self.rescan = self.rescan or self.window_start is not None
+        else:
+            while self.before < len(self.bars) and self.bars[self.before].trade_date < window_start:
+                self.before += 1
+        self.window_start = window_start
+
+    def apply_bar(self, bar, window_start, window=SIGNAL_WINDOW):
+        """写入一根新K线（或替换同一交易日的K线）并计算信号
+
+        参数:
+        bar: Bar对象
+        window_start: 当前全市场交易日窗口的第一天
+        window: 均线窗口期
+
+        返回:
+        tuple: (被替换的旧K线或None, 需要写入的信号列表[(id, buy, sell, earnings_rate)])
+        """
+        replaced = None
+        middle = None
+        if self.bars and self.bars[-1].trade_date == bar.trade_date:
+            replaced = self.bars.pop()
+            bar.seq = replaced.seq
+            self._add_close(replaced.close, -1)
+            if self.sells and self.sells[-1] is replaced:
+                self.sells.pop()
+        elif self.bars and bar.trade_date < self.bars[-1].trade_date:
+            raise ValueError(f"股票 {self.ts_code} 的K线 {bar.trade_date} 早于已有的 {self.bars[-1].trade_date}")
+        else:
+            bar.seq = self.next_seq
+            self.next_seq += 1
+            if self.bars:
+                middle = self.bars[-1]
+            if len(self.bars) >= SIGNAL_WINDOW:
+                self._add_close(self.bars[-SIGNAL_WINDOW].close, -1)
+            if len(self.bars) == self.bars.maxlen:
+                # 最旧的K线被挤出缓冲区
+                self.before = max(0, self.before - 1)
+        self.bars.append(bar)
+        self._add_close(bar.close, 1)
+        if self.ma_err > RESYNC_ERROR_RATIO * self.ma_abs:
+            self._resync_sum()
+
+        # 新K线在批量计算窗口中的位置
+        self._locate_window(window_start)
+        position = len(self.bars) - self.before - 1
+        buy_signal, sell_signal = self._evaluate(position, window)
+        bar.buy = bar.close if buy_signal else 0.0
+        bar.sell = bar.close if sell_signal else 0.0
+
+        updates = self._update_earnings(bar, replaced, middle, window)
+        if bar.sell > 0:
+            bar.after_min = None
+            self.sells.append(bar)
+        if bar.has_signal:
+            updates.append(bar.signal())
+        return replaced, updates
+
+    def _evaluate(self, position, window):
+        """最新一根K线的买入和高位资金净流出信号，均线取滑动和，比较结果不确定时按批量顺序重新求和"""
+        if window != SIGNAL_WINDOW:
+            return evaluate_signals(self.bars, position, window)
+        if position < window or self.ma_missing:
+            return False, False
+
+        current = self.bars[-1]
+        previous = self.bars[-2]
+        current_price = current.close if current.close is not None else 0
+        current_volume = current.vol if current.vol is not None else 0
+        prev_price = previous.close if previous.close is not None else 0
+        prev_volume = previous.vol if previous.vol is not None else 0
+
+        # 成交量和涨跌条件不满足时不需要均线
+        volume_up = current_volume > prev_volume * 1.1
+        maybe_buy = volume_up and current_price > prev_price and current_price > 0
+        maybe_sell = volume_up and current_price < prev_price and current_price > 0
+        if not (maybe_buy or maybe_sell):
+            return False, False
+
+        ma = self.ma_sum / window
+        threshold = ma * 0.95 if maybe_buy else ma
+        # 滑动和与批量求和之差的上界（含除法和乘法的舍入），放大一倍留出余量
+        tolerance = 2 * (self.ma_err + window * UNIT_ROUNDOFF * self.ma_abs) / window + 4 * UNIT_ROUNDOFF * abs(threshold)
+        if abs(current_price - threshold) <= tolerance:
+            self._resync_sum()
+            ma = self.ma_sum / window
+        return maybe_buy and current_price < ma * 0.95, maybe_sell and current_price > ma
+
+    def _update_earnings(self, bar, replaced, middle, window):
+        """更新收益率因新K线变化的卖点，返回变化的信号行
+
+        卖点的收益率取其后最低收盘价，即min(after_min, 最新K线的收盘价)。
+        批量计算只重算窗口内下标>=window的行，其余卖点从sells中移除，不再更新。
+        """
+        first_seq = self.bars[self.before].seq if self.before < len(self.bars) else bar.seq
+        while self.sells and (self.sells[0].seq < first_seq + window or self.sells[0].seq < self.bars[0].seq):
+            self.sells.popleft()
+
+        updates = []
+        if self.rescan:
+            self.rescan = False
+            self._rebuild_sells(first_seq + window)
+            for item in reversed(self.sells):
+                self._set_earnings(item, _min_close(item.after_min, bar.close), updates)
+            return updates
+
+        if replaced is not None:
+            # 替换最新K线：只有after_min高于新旧收盘价中较低者的卖点可能变化
+            threshold = _min_close(replaced.close, bar.close)
+            for item in reversed(self.sells):
+                if item.after_min is not None and (threshold is None or item.after_min <= threshold):
+                    break
+                self._set_earnings(item, _min_close(item.after_min, bar.close), updates)
+            return updates
+
+        # 追加新K线：原来的最新K线成为中间K线，先把它的收盘价并入after_min
+        middle_close = middle.close if middle is not None else None
+        threshold = _min_close(middle_close, bar.close)
+        for item in reversed(self.sells):
+            if item is middle:
+                self._set_earnings(item, bar.close, updates)
+                continue
+            lowered = middle_close is not None and (item.after_min is None or item.after_min > middle_close)
+            if lowered:
+                item.after_min = middle_close
+            elif item.after_min is not None and (threshold is None or item.after_min <= threshold):
+                break
+            self._set_earnings(item, _min_close(item.after_min, bar.close), updates)
+        return updates
+
+    def _rebuild_sells(self, first_eligible):
+        """从缓冲区重建需要更新收益率的卖点及其after_min，不含最新一根K线（从数据库读取缓冲区后的第一次写入时）"""
+        self.sells = deque()
+        between = None
+        for k in range(len(self.bars) - 2, -1, -1):
+            item = self.bars[k]
+            if item.seq < first_eligible:
+                break
+            if item.sell > 0:
+                item.after_min = between
+                self.sells.appendleft(item)
+            between = _min_close(between, item.close)
+
+    @staticmethod
+    def _set_earnings(item, later_min, updates):
+        """按其后最低收盘价计算卖点的收益率，取值变化时记入updates"""
+        earnings_rate = 0.0
+        if later_min is not None and later_min < item.sell:
+            earnings_rate = (item.sell - later_min) / item.sell * 100
+        if earnings_rate != item.earnings_rate:
+            item.earnings_rate = earnings_rate
+            updates.append(item.signal())
+
+
+def evaluate_signals(bars, position, window=SIGNAL_WINDOW):
+    """按signal_calculator的规则计算最新一根K线的买入和高位资金净流出信号
+
+    只读取缓冲区末尾window根K线，计算顺序与批量计算相同，浮点结果逐位一致。
+
+    参数:
+    bars: K线缓冲区（按交易日升序）
+    position: 最新K线在批量计算窗口中的下标
+    window: 均线窗口期
+
+    返回:
+    tuple: (是否买入信号, 是否卖出信号)
+    """
+    if position < window:
+        return False, False
+
+    recent = [bars[k] for k in range(len(bars) - window, len(bars))]
+    prices = [item.close for item in recent if item.close is not None]
+    if len(prices) < window:
+        return False, False
+
+    # 计算简单移动平均线
+    ma = sum(prices) / len(prices)
+
+    current = recent[-1]
+    previous = recent[-2]
+    current_price = current.close if current.close is not None else 0
+    current_volume = current.vol if current.vol is not None else 0
+    prev_price = previous.close if previous.close is not None else 0
+    prev_volume = previous.vol if previous.vol is not None else 0
+
+    volume_up = current_volume > prev_volume * 1.1
+    buy = current_price < ma * 0.95 and volume_up and current_price > prev_price
+    sell = current_price > ma and volume_up and current_price < prev_price
+    return buy and current_price > 0, sell and current_price > 0
+
+
+def parse_trade_date(value, sample=None):
+    """校验YYYY-MM-DD或YYYYMMDD格式的交易日，转换为与sample（数据库中已有的trade_date）相同的表示
+
+    all_stocks_days.trade_date可能是date列，也可能是YYYY-MM-DD或YYYYMMDD格式的文本列，
+    转换后才能与从数据库读取的交易日比较，并作为SQL参数绑定到trade_date上。
+    """
+    if isinstance(value, datetime):
+        parsed = value.date()
+    elif isinstance(value, date):
+        parsed = value
+    else:
+        parsed = None
+        for fmt in ("%Y-%m-%d", "%Y%m%d"):
+            try:
+                parsed = datetime.strptime(str(value), fmt).date()
+                break
+            except ValueError:
+                continue
+        if parsed is None:
+            raise ValueError(f"无法识别的交易日期: {value}")
+    return db_utils.format_trade_date(parsed, sample)
+
+
+def _optional_float(bar_data, field):
+    value = bar_data.get(field)
+    return float(value) if value is not None else None
+
+
+class SignalIngestor:
+    """进程内的实时写入器：保留每只股票的缓冲区和全市场最近的交易日，写入K线和信号
+
+    同一进程中的写入请求串行执行；提交后在后台线程中合并更新快照。
+    """
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        self._states = {}
+        # 全市场最近max(STANDARD_WINDOWS)个交易日（升序），None表示尚未从数据库加载
+        self._dates = None
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._pending_event = threading.Event()
+        self._updater = None
+
+    def _prepare(self, bars):
+        """整批校验K线并转换字段类型，任何一根K线不合法时整批拒绝
+
+        返回:
+        tuple: (转换后的K线列表, {ts_code: 该股票的K线列表})
+        """
+        if self._dates is None:
+            self._dates = deque(reversed(db_utils.get_latest_trading_dates(max(db_utils.STANDARD_WINDOWS))),
+                                maxlen=max(db_utils.STANDARD_WINDOWS))
+        sample = self._dates[-1] if self._dates else None
+        prepared = []
+        by_code = {}
+        for bar_data in bars:
+            for field in ("ts_code", "trade_date", "close", "vol"):
+                if bar_data.get(field) is None:
+                    raise ValueError(f"K线缺少字段: {field}")
+            try:
+                # 交易日转换为数据库中trade_date的表示（date或文本）
+                item = dict(bar_data, trade_date=parse_trade_date(bar_data["trade_date"], sample),
+                            close=float(bar_data["close"]), vol=float(bar_data["vol"]))
+                for field in OPTIONAL_FIELDS:
+                    item[field] = _optional_float(bar_data, field)
+            except (TypeError, ValueError):
+                raise ValueError(f"K线字段格式错误: {bar_data}")
+            if item.get("name") is None:
+                catalog_entry = db_utils.get_stock_catalog().get(item["ts_code"])
+                item["name"] = catalog_entry[1] if catalog_entry else None
+            group = by_code.setdefault(item["ts_code"], [])
+            if group and item["trade_date"] < group[-1]["trade_date"]:
+                raise ValueError(f"股票 {item['ts_code']} 的K线 {item['trade_date']} 早于同一请求中的 {group[-1]['trade_date']}")
+            group.append(item)
+            prepared.append(item)
+        return prepared, by_code
+
+    def _sync_dates(self, cursor):
+        """数据库中出现了其他来源写入的交易日时重新加载全市场最近的交易日"""
+        cursor.execute("SELECT MAX(trade_date) FROM all_stocks_days")
+        latest = cursor.fetchone()[0]
+        if latest is not None and (not self._dates or latest != self._dates[-1]):
+            cursor.execute(db_utils.LATEST_DATES_SQL, (max(db_utils.STANDARD_WINDOWS),))
+            self._dates = deque(reversed([row[0] for row in cursor.fetchall()]), maxlen=max(db_utils.STANDARD_WINDOWS))
+
+    def _advance_dates(self, trade_date):
+        """纳入新的交易日，返回包含trade_date后默认窗口的起始日；窗口移动时返回True作为第二个值"""
+        shifted = not self._dates or trade_date > self._dates[-1]
+        if shifted:
+            self._dates.append(trade_date)
+        return self._dates[-min(db_utils.TRADING_DAYS_LIMIT, len(self._dates))], shifted
+
+    def _window_dates(self):
+        """各标准窗口的起止交易日，格式同db_utils.prepare_window_stats()"""
+        return {days: (self._dates[-min(days, len(self._dates))], self._dates[-1]) for days in db_utils.STANDARD_WINDOWS}
+
+    def _sync_states(self, cursor, ts_codes):
+        """核对每只股票的缓冲区与数据库中的最新K线，缺失或落后的缓冲区从数据库重新读取"""
+        cursor.execute(LATEST_BARS_SQL, (ts_codes,))
+        latest = {row[0]: tuple(row[1:]) for row in cursor.fetchall()}
+        stale = []
+        for ts_code in ts_codes:
+            state = self._states.get(ts_code)
+            current = (state.bars[-1].id, state.bars[-1].trade_date) if state is not None and state.bars else None
+            if state is None or current != latest.get(ts_code):
+                stale.append(ts_code)
+        if not stale:
+            return
+        rows_by_code = {ts_code: [] for ts_code in stale}
+        cursor.execute(RECENT_BARS_SQL, (stale, db_utils.TRADING_DAYS_LIMIT))
+        for row in cursor.fetchall():
+            rows_by_code[row[0]].append(Bar(*row[1:]))
+        for ts_code, bars in rows_by_code.items():
+            self._states[ts_code] = TickerState(ts_code, reversed(bars))
+
+    def _persist_bars(self, cursor, prepared):
+        """写入all_stocks_days：已有交易日的K线原地更新，新交易日的K线一次插入，返回(每根K线的id, 插入的id)"""
+        last = {}
+        for item in prepared:
+            bars = self._states[item["ts_code"]].bars
+            last[item["ts_code"]] = (bars[-1].trade_date, bars[-1].id) if bars else None
+        ids = []
+        updates = {}
+        inserts = {}
+        for item in prepared:
+            current = last.get(item["ts_code"])
+            values = tuple(item[field] for field in ("open", "high", "low", "close", "pre_close", "pct_chg", "vol",
+                                                     "ma120", "ma250")) + (item.get("name"),)
+            if current is not None and current[0] == item["trade_date"]:
+                bar_id = current[1]
+                if bar_id in inserts:
+                    inserts[bar_id] = (item["ts_code"], item["trade_date"]) + values
+                else:
+                    updates[bar_id] = values
+            else:
+                bar_id = ("new", len(inserts))
+                inserts[bar_id] = (item["ts_code"], item["trade_date"]) + values
+                last[item["ts_code"]] = (item["trade_date"], bar_id)
+            ids.append(bar_id)
+
+        assigned = {}
+        if inserts:
+            # id按MAX(id)+1连续分配，加锁后其他进程的写入不会分配到相同的id
+            cursor.execute("SELECT pg_advisory_xact_lock(%s)", (db_utils.STOCK_BARS_WRITE_LOCK_ID,))
+            cursor.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM all_stocks_days")
+            next_id = cursor.fetchone()[0]
+            assigned = {key: next_id + k for k, key in enumerate(inserts)}
+            extras.execute_values(cursor, """
+                INSERT INTO all_stocks_days (id, ts_code, trade_date, open, high, low, close, pre_close, pct_chg, vol, ma120, ma250, name)
+                VALUES %s
+            """, [(assigned[key],) + values for key, values in inserts.items()])
+            ids = [assigned.get(bar_id, bar_id) for bar_id in ids]
+        if updates:
+            extras.execute_values(cursor, """
+                UPDATE all_stocks_days AS a
+                SET open = v.open, high = v.high, low = v.low, close = v.close, pre_close = v.pre_close,
+                    pct_chg = v.pct_chg, vol = v.vol, ma120 = COALESCE(v.ma120, a.ma120),
+                    ma250 = COALESCE(v.ma250, a.ma250), name = COALESCE(v.name, a.name)
+                FROM (VALUES %s) AS v(id, open, high, low, close, pre_close, pct_chg, vol, ma120, ma250, name)
+                WHERE a.id = v.id
+            """, [(bar_id,) + values for bar_id, values in updates.items()],
+                template="(%s, %s::float8, %s::float8, %s::float8, %s::float8, %s::float8, %s::float8, %s::float8, %s::float8, %s::float8, %s::text)")
+        return ids, list(assigned.values())
+
+    def _write(self, prepared, by_code):
+        """在一个事务中写入整批K线及其派生数据和推送事件，返回每根K线的结果"""
+        ts_codes = sorted(by_code)
+        with db_utils.get_float_connection() as conn:
+            cursor = conn.cursor()
+            # 持有股票的咨询锁后核对缓冲区，其他进程对同一只股票的写入在本事务提交后才能读取
+            cursor.execute(LOCK_TICKERS_SQL, (TICKER_LOCK_NAMESPACE, ts_codes))
+            self._sync_dates(cursor)
+            self._sync_states(cursor, ts_codes)
+            for ts_code, group in by_code.items():
+                bars = self._states[ts_code].bars
+                if bars and group[0]["trade_date"] < bars[-1].trade_date:
+                    raise ValueError(f"股票 {ts_code} 的K线 {group[0]['trade_date']} 早于已有的 {bars[-1].trade_date}")
+
+            bar_ids, inserted_ids = self._persist_bars(cursor, prepared)
+
+            results = []
+            pending = {}
+            deleted = {}
+            window_shifted = False
+            for item, bar_id in zip(prepared, bar_ids):
+                window_start, shifted = self._advance_dates(item["trade_date"])
+                window_shifted = window_shifted or shifted
+                bar = Bar(item["trade_date"], item["close"], item["vol"], bar_id)
+                replaced, signals = self._states[item["ts_code"]].apply_bar(bar, window_start)
+                # 替换的盘中K线之前有信号、现在没有时删除旧信号
+                if replaced is not None and replaced.has_signal and not bar.has_signal:
+                    deleted[bar_id] = item["trade_date"]
+                    pending.pop(bar_id, None)
+                for signal in signals:
+                    pending[signal[0]] = signal
+                    deleted.pop(signal[0], None)
+                results.append({
+                    "ts_code": item["ts_code"],
+                    "trade_date": str(item["trade_date"]),
+                    "all_stocks_days_id": bar_id,
+                    "buy": bar.buy,
+                    "sell": bar.sell,
+                    "earnings_rate": bar.earnings_rate,
+                    "updated_signals": [
+                        {"all_stocks_days_id": signal[0], "buy": signal[1], "sell": signal[2], "earnings_rate": signal[3]}
+                        for signal in signals
+                    ]
+                })
+
+            changed = []
+            if deleted:
+                # 与upsert_signals相同，先取信号写入锁再修改high_level_inflows
+                db_utils.lock_signal_writes(cursor)
+                cursor.execute("""
+                    DELETE FROM high_level_inflows WHERE all_stocks_days_id = ANY(%s) AND trade_date >= %s
+                    RETURNING all_stocks_days_id
+                """, (sorted(deleted), min(deleted.values())))
+                changed.extend((row[0], 0.0, 0.0, 0.0) for row in cursor.fetchall())
+            db_utils.upsert_signals(cursor, list(pending.values()), changed)
+            # 变化和删除的信号随同一事务记录为推送事件
+            keys = {}
+            for ts_code in ts_codes:
+                for bar in self._states[ts_code].bars:
+                    keys[bar.id] = (ts_code, bar.trade_date)
+            signal_feed.record_signals(cursor, changed, keys)
+
+            # 插件策略在这些股票写入后的窗口数据上重新计算
+            if strategies.STRATEGIES:
+                stocks_data = db_utils.fetch_stocks_window(cursor, ts_codes, window_start)
+                db_utils.upsert_strategy_signals(cursor, strategies.evaluate_strategies(stocks_data))
+            for ts_code, group in by_code.items():
+                db_utils.touch_stock_catalog(cursor, ts_code, group[-1].get("name"), group[-1]["trade_date"])
+            # 窗口移动后各股票的统计都要按新窗口重算，由下次刷新完成；未移动时只更新这些股票
+            if not window_shifted:
+                db_utils.refresh_current_window_stats(cursor, ts_codes, self._window_dates())
+            db_utils.refresh_market_breadth(cursor, window_start)
+            # 刷新结果已与数据一致，推进上次刷新的指纹，避免调度器为这次写入重新计算全市场
+            if not window_shifted:
+                refresh_scheduler.record_ingest(cursor, window_start, inserted_ids, len(prepared))
+            conn.commit()
+            db_utils.record_primary_write(cursor)
+            cursor.close()
+        return results
+
+    @db_utils.primary_reads
+    def ingest(self, bars):
+        """写入一批K线并计算信号
+
+        参数:
+        bars: K线dict列表，每根必须包含ts_code, trade_date, close, vol；
+              可选open, high, low, pre_close, pct_chg, ma120, ma250, name
+
+        返回:
+        list: 每根K线的信号，以及因此更新的信号行
+        """
+        with self._lock:
+            prepared, by_code = self._prepare(bars)
+            try:
+                results = self._write(prepared, by_code)
+            except Exception:
+                # 事务已回滚，这些股票的缓冲区和交易日可能已被修改，下次从数据库重新读取
+                for ts_code in by_code:
+                    self._states.pop(ts_code, None)
+                self._dates = None
+                raise
+        stock_cache.single_stock_cache.invalidate(by_code)
+        self._schedule_snapshot_update(by_code)
+        return results
+
+    def _schedule_snapshot_update(self, ts_codes):
+        """把写入的股票加入待更新集合，由后台线程合并后更新快照"""
+        with self._pending_lock:
+            self._pending.update(ts_codes)
+            if self._updater is None or not self._updater.is_alive():
+                self._updater = threading.Thread(target=self._update_snapshots, name="ingest-snapshot", daemon=True)
+                self._updater.start()
+        self._pending_event.set()
+
+    def _update_snapshots(self):
+        """后台线程：等待写入，把一段时间内写入的股票合并为一次快照更新"""
+        while True:
+            self._pending_event.wait()
+            time.sleep(SNAPSHOT_UPDATE_DELAY)
+            with self._pending_lock:
+                ts_codes, self._pending = self._pending, set()
+                self._pending_event.clear()
+            if not ts_codes:
+                continue
+            try:
+                result = data_processor.update_snapshot(ts_codes)
+                error = result.get("error")
+            except Exception as e:
+                error = str(e)
+            if error:
+                print(f"⚠️ 实时写入后更新快照出错，{SNAPSHOT_RETRY_DELAY}秒后重试: {error}")
+                with self._pending_lock:
+                    self._pending.update(ts_codes)
+                self._pending_event.set()
+                time.sleep(SNAPSHOT_RETRY_DELAY)
+
+
+# 本进程的实时写入器
+ingestor = SignalIngestor()
+
+# fork出的工作进程不能沿用父进程的锁和后台线程，缓冲区也从数据库重新读取
+os.register_at_fork(after_in_child=ingestor._reset)
+
+
+def ingest_bars(bars):
+    """在一个事务中写入多根K线
+
+    参数:
+    bars: K线dict列表，格式见SignalIngestor.ingest
+
+    返回:
+    list: 每根K线的结果
+    """
+    return ingestor.ingest(bars)
+
+
+def forward_ingest(body):
+    """把写入请求原样转发给负责实时写入的工作进程
+
+    参数:
+    body: 请求体（JSON字节串）
+
+    返回:
+    tuple: (状态码, 响应体, 响应头)
+    """
+    conn = http.client.HTTPConnection(*owner_address, timeout=FORWARD_TIMEOUT)
+    try:
+        conn.request("POST", "/api/ingest", body=body, headers={"Content-Type": "application/json"})
+        response = conn.getresponse()
+        headers = {'Content-Type': response.getheader('Content-Type', 'application/json; charset=utf-8')}
+        if response.getheader('Retry-After'):
+            headers['Retry-After'] = response.getheader('Retry-After')
+        return response.status, response.read(), headers
+    finally:
+        conn.close()
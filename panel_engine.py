@@ -0,0 +1,238 @@
+"""截面计算引擎：把全市场的刷新窗口装入(股票 × 交易日)矩阵，用整矩阵运算计算买卖点信号
+
+Panel按全市场交易日对齐收盘价、成交量和all_stocks_days.id，停牌日由mask标记。
+signal_calculator的规则按每只股票自己的行序列计算（停牌日不占位置），
+因此计算前先把每行的有效交易日稳定地左移压紧，再对压紧后的矩阵做均线、量价比较和后续最低价，
+结果与compute_stock_signals逐位一致，稀疏的信号列表交给upsert_signals批量写入。
+"""
+import time
+from operator import itemgetter
+
+import numpy as np
+
+import db_utils
+import data_processor
+import signal_feed
+import storage
+import strategies
+
+# 信号均线窗口，与signal_calculator的默认值一致
+SIGNAL_WINDOW = 5
+
+# 买卖点信号需要的列
+SIGNAL_COLUMNS = ("close", "vol")
+
+
+class Panel:
+    """全市场窗口数据的对齐矩阵
+
+    属性:
+    ts_codes: 股票代码数组（行）
+    trade_dates: 交易日数组（列，升序）
+    values: {列名: float64矩阵}，缺失为NaN
+    ids: int64矩阵，all_stocks_days.id，缺失为-1
+    mask: bool矩阵，该股票当日有交易数据
+    """
+
+    def __init__(self, ts_codes, trade_dates, values, ids, mask):
+        self.ts_codes = ts_codes
+        self.trade_dates = trade_dates
+        self.values = values
+        self.ids = ids
+        self.mask = mask
+        self._compacted = None
+
+    @property
+    def close(self):
+        return self.values["close"]
+
+    @property
+    def vol(self):
+        return self.values["vol"]
+
+    @classmethod
+    def from_groups(cls, ts_codes, groups, columns=SIGNAL_COLUMNS):
+        """从每只股票按trade_date升序的行列表构建面板
+
+        参数:
+        ts_codes: 股票代码列表
+        groups: 与ts_codes对应的行列表（all_stocks_days窗口查询的行，行末为id）
+        columns: 装入面板的数值列，见db_utils.WINDOW_COLUMN_POSITIONS
+        """
+        lengths = np.fromiter(map(len, groups), dtype=np.int64, count=len(groups))
+        rows = [row for group in groups for row in group]
+        trade_dates = sorted({row[1] for row in rows})
+        shape = (len(ts_codes), len(trade_dates))
+
+        values = {column: np.full(shape, np.nan) for column in columns}
+        ids = np.full(shape, -1, dtype=np.int64)
+        mask = np.zeros(shape, dtype=bool)
+        if rows:
+            date_positions = {trade_date: k for k, trade_date in enumerate(trade_dates)}
+            ticker_index = np.repeat(np.arange(len(ts_codes)), lengths)
+            date_index = np.fromiter(map(date_positions.__getitem__, map(itemgetter(1), rows)), dtype=np.int64, count=len(rows))
+            for column, matrix in values.items():
+                matrix[ticker_index, date_index] = np.array(list(map(itemgetter(db_utils.WINDOW_COLUMN_POSITIONS[column]), rows)), dtype=float)
+            ids[ticker_index, date_index] = np.fromiter(map(itemgetter(-1), rows), dtype=np.int64, count=len(rows))
+            mask[ticker_index, date_index] = True
+        return cls(np.array(ts_codes, dtype=object), np.array(trade_dates, dtype=object), values, ids, mask)
+
+    @classmethod
+    def from_stocks_data(cls, stocks_data, columns=SIGNAL_COLUMNS):
+        """从fetch_stocks_window的结果{ts_code: rows}构建面板（行顺序与字典顺序相同）"""
+        ts_codes = list(stocks_data)
+        return cls.from_groups(ts_codes, [stocks_data[ts_code] for ts_code in ts_codes], columns)
+
+    def compact(self):
+        """把每只股票的有效交易日稳定地左移，返回({列名: 矩阵}, ids, 列对应的交易日下标)
+
+        压紧后第j列是该股票窗口内的第j行，与逐只股票计算时的行下标一致。
+        结果在面板上缓存，买卖点信号和插件策略共用。
+        """
+        if self._compacted is not None:
+            return self._compacted
+        order = np.argsort(~self.mask, axis=1, kind="stable")
+        present = np.take_along_axis(self.mask, order, axis=1)
+        values = {column: np.where(present, np.take_along_axis(matrix, order, axis=1), np.nan)
+                  for column, matrix in self.values.items()}
+        ids = np.where(present, np.take_along_axis(self.ids, order, axis=1), -1)
+        self._compacted = (values, ids, order)
+        return self._compacted
+
+
+def evaluate_panel(close, vol, window=SIGNAL_WINDOW):
+    """对压紧后的矩阵计算买入、高位资金净流出信号和卖点收益率
+
+    参数:
+    close, vol: 压紧后的收盘价和成交量矩阵，缺失为NaN
+    window: 均线窗口期
+
+    返回:
+    tuple: (buy, sell, earnings_rate)矩阵，没有信号的位置为0
+    """
+    rows, days = close.shape
+    buy = np.zeros((rows, days))
+    sell = np.zeros((rows, days))
+    earnings_rate = np.zeros((rows, days))
+    if days <= window:
+        return buy, sell, earnings_rate
+
+    # 第j列(j>=window)的均线取j-window+1..j列，按与sum()相同的从左到右顺序累加
+    count = days - window
+    price_sum = close[:, 1:1 + count].copy()
+    for k in range(2, window + 1):
+        price_sum = price_sum + close[:, k:k + count]
+    ma = price_sum / window
+    complete = ~np.isnan(price_sum)
+
+    current = close[:, window:]
+    previous = close[:, window - 1:-1]
+    current_volume = np.nan_to_num(vol[:, window:], nan=0.0)
+    previous_volume = np.nan_to_num(vol[:, window - 1:-1], nan=0.0)
+
+    volume_up = current_volume > previous_volume * 1.1
+    positive = complete & (current > 0)
+    with np.errstate(invalid="ignore"):
+        buy_mask = positive & volume_up & (current < ma * 0.95) & (current > previous)
+        sell_mask = positive & volume_up & (current > ma) & (current < previous)
+    buy[:, window:] = np.where(buy_mask, current, 0.0)
+    sell[:, window:] = np.where(sell_mask, current, 0.0)
+
+    # 卖点之后（不含当天）的最低收盘价，从右向左的累积最小值
+    finite = np.where(np.isnan(close), np.inf, close)
+    suffix_min = np.minimum.accumulate(finite[:, ::-1], axis=1)[:, ::-1]
+    later_min = np.concatenate([suffix_min[:, 1:], np.full((rows, 1), np.inf)], axis=1)
+    has_drop = (sell > 0) & (later_min < close)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        earnings_rate = np.where(has_drop, (close - later_min) / close * 100, 0.0)
+    return buy, sell, earnings_rate
+
+def compute_panel_signals(stocks_data, window=SIGNAL_WINDOW, panel=None):
+    """用面板计算一批股票的信号，结果与逐只调用compute_stock_signals后拼接相同
+
+    参数:
+    stocks_data: {ts_code: 按trade_date升序的行列表，行末为all_stocks_days.id}
+    panel: 已由stocks_data构建的面板（至少包含SIGNAL_COLUMNS），None时新建
+
+    返回:
+    tuple: (信号列表[(all_stocks_days_id, buy, sell, earnings_rate)], {all_stocks_days_id: (ts_code, trade_date)})
+    """
+    if panel is None:
+        panel = Panel.from_stocks_data(stocks_data)
+    values, ids, order = panel.compact()
+    buy, sell, earnings_rate = evaluate_panel(values["close"], values["vol"], window)
+
+    rows, positions = np.nonzero((buy > 0) | (sell > 0))
+    signal_ids = ids[rows, positions].tolist()
+    signals = list(zip(signal_ids, buy[rows, positions].tolist(), sell[rows, positions].tolist(),
+                       earnings_rate[rows, positions].tolist()))
+    dates = panel.trade_dates[order[rows, positions]]
+    keys = dict(zip(signal_ids, zip(panel.ts_codes[rows].tolist(), dates.tolist())))
+    return signals, keys
+
+@db_utils.primary_reads
+def compute_stocks_data_panel(force_recompute=False):
+    """截面方式计算全市场股票数据：一次读取整个窗口，整矩阵计算信号，批量写入
+
+    参数:
+    force_recompute: 是否强制重新计算
+
+    返回:
+    dict: 与其他刷新函数相同的结果，另含panel_stats
+    """
+    print("\n===== 开始截面计算最近交易日股票数据 =====")
+
+    try:
+        repository = storage.get_repository()
+        latest_dates = repository.latest_trading_dates()
+        if not latest_dates:
+            print("❌ 错误: 无法获取最近交易日期")
+            return {"error": "无法获取最近交易日期"}
+        print(f"✓ 获取到最近{len(latest_dates)}个交易日，从 {latest_dates[0]} 到 {latest_dates[-1]}")
+
+        print("正在同步股票目录...")
+        window_dates = repository.prepare_refresh()
+        all_stocks = repository.window_ts_codes(latest_dates[-1])
+        print(f"✓ 共找到 {len(all_stocks)} 只股票需要处理")
+
+        started = time.perf_counter()
+        stocks_data = repository.fetch_window(all_stocks, latest_dates[-1])
+        read_seconds = time.perf_counter() - started
+
+        # 买卖点信号和所有插件策略共用一个面板
+        started = time.perf_counter()
+        panel = Panel.from_stocks_data(stocks_data, strategies.required_columns(SIGNAL_COLUMNS))
+        signals, keys = compute_panel_signals(stocks_data, panel=panel)
+        strategy_signals = strategies.evaluate_panel_strategies(panel)
+        compute_seconds = time.perf_counter() - started
+        print(f"✓ 面板计算完成：{len(stocks_data)} 只股票，{len(signals)} 个信号，{len(strategy_signals)} 个策略信号，{compute_seconds:.3f}秒")
+
+        started = time.perf_counter()
+        changed = []
+        with repository.transaction() as writer:
+            rows_written = writer.upsert_signals(signals, changed)
+            # PostgreSQL存储的推送事件随同一事务记录，本地存储在提交后直接发布
+            if not storage.is_local():
+                signal_feed.record_signals(writer.cursor, changed, keys)
+            writer.upsert_strategy_signals(strategy_signals)
+            writer.refresh_window_stats(all_stocks, window_dates)
+            writer.refresh_market_breadth(latest_dates[-1])
+        write_seconds = time.perf_counter() - started
+
+        signal_feed.publish_signals(changed, keys)
+
+        print("\n===== 正在从数据库加载结果 =====")
+        result = data_processor.load_snapshot()
+        result["panel_stats"] = {
+            "stocks": len(stocks_data),
+            "signals": len(signals),
+            "strategy_signals": len(strategy_signals),
+            "rows_written": rows_written,
+            "read_seconds": round(read_seconds, 3),
+            "compute_seconds": round(compute_seconds, 3),
+            "write_seconds": round(write_seconds, 3)
+        }
+        return result
+    except Exception as e:
+        print(f"❌ 截面计算出错: {str(e)}")
+        return {"error": str(e)}
@@ -0,0 +1,226 @@
+"""流水线刷新：读取、计算、写入三个阶段重叠执行
+
+读取线程预取后续批次的股票数据，计算阶段在调用线程中计算买卖点信号，
+写入线程在后台批量写库。阶段之间用有界队列连接，队列深度决定最多缓冲多少批。
+读取和写入线程各自使用一个连接池中的连接。
+"""
+import queue
+import threading
+import time
+
+import db_utils
+import data_processor
+import signal_feed
+import strategies
+
+# 默认队列深度（相邻阶段之间最多缓冲的批次数）
+DEFAULT_QUEUE_DEPTH = 2
+
+# 队列结束标记
+_END = object()
+
+
+class StageStats:
+    """记录单个流水线阶段的忙碌时间和处理批次数"""
+
+    def __init__(self, name):
+        self.name = name
+        self.busy_seconds = 0.0
+        self.batches = 0
+
+    def to_dict(self, wall_seconds):
+        utilization = self.busy_seconds / wall_seconds * 100 if wall_seconds > 0 else 0.0
+        return {
+            "stage": self.name,
+            "batches": self.batches,
+            "busy_seconds": round(self.busy_seconds, 3),
+            "utilization": round(utilization, 1)
+        }
+
+
+def _put(q, item, stop_event):
+    """向有界队列放入数据，流水线出错停止时放弃等待"""
+    while not stop_event.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _get(q, stop_event):
+    """从队列取数据，流水线出错停止时返回结束标记"""
+    while not stop_event.is_set():
+        try:
+            return q.get(timeout=0.5)
+        except queue.Empty:
+            continue
+    return _END
+
+def _reader(batches, start_date, fetch_queue, stats, stop_event, errors):
+    """读取阶段：逐批预取股票窗口数据"""
+    try:
+        with db_utils.get_float_connection() as conn:
+            cursor = conn.cursor()
+            for batch_stocks in batches:
+                if stop_event.is_set():
+                    break
+                started = time.perf_counter()
+                stocks_data = db_utils.fetch_stocks_window(cursor, batch_stocks, start_date)
+                stats.busy_seconds += time.perf_counter() - started
+                stats.batches += 1
+                if not _put(fetch_queue, stocks_data, stop_event):
+                    break
+            cursor.close()
+        _put(fetch_queue, _END, stop_event)
+    except Exception as e:
+        errors.append(f"读取阶段出错: {str(e)}")
+        stop_event.set()
+
+def _writer(write_queue, window_dates, stats, counters, stop_event, errors):
+    """写入阶段：批量写入信号并更新这批股票的窗口统计，每批提交一次，变化的信号随同一事务记录为推送事件；
+    全部批次写完后更新全市场每日统计"""
+    try:
+        with db_utils.get_float_connection() as conn:
+            cursor = conn.cursor()
+            while True:
+                item = _get(write_queue, stop_event)
+                if item is _END:
+                    break
+                batch_stocks, signals, signal_keys, strategy_signals = item
+                started = time.perf_counter()
+                changed = []
+                counters["rows_written"] += db_utils.upsert_signals(cursor, signals, changed)
+                signal_feed.record_signals(cursor, changed, signal_keys)
+                db_utils.upsert_strategy_signals(cursor, strategy_signals)
+                db_utils.refresh_window_stats(cursor, batch_stocks, window_dates)
+                conn.commit()
+                stats.busy_seconds += time.perf_counter() - started
+                stats.batches += 1
+            # 所有批次写入后更新全市场每日统计
+            if not stop_event.is_set() and window_dates:
+                started = time.perf_counter()
+                db_utils.refresh_market_breadth(cursor, window_dates[db_utils.TRADING_DAYS_LIMIT][0])
+                conn.commit()
+                stats.busy_seconds += time.perf_counter() - started
+            cursor.close()
+    except Exception as e:
+        errors.append(f"写入阶段出错: {str(e)}")
+        stop_event.set()
+
+@db_utils.primary_reads
+def compute_stocks_data_pipelined(force_recompute=False, batch_size=100, queue_depth=DEFAULT_QUEUE_DEPTH):
+    """流水线方式计算股票数据：读取、计算、写入重叠执行
+    
+    参数:
+    force_recompute: 是否强制重新计算
+    batch_size: 每批处理的股票数量
+    queue_depth: 阶段之间队列的最大批次数
+    """
+    print("\n===== 开始流水线计算最近交易日股票数据 =====")
+    
+    try:
+        # 获取最近的交易日期
+        print("正在获取最近的交易日期...")
+        latest_dates = db_utils.get_latest_trading_dates()
+        if not latest_dates:
+            print("❌ 错误: 无法获取最近交易日期")
+            return {"error": "无法获取最近交易日期"}
+        
+        print(f"✓ 获取到最近{len(latest_dates)}个交易日，从 {latest_dates[0]} 到 {latest_dates[-1]}")
+        
+        # 同步股票目录，纳入新加载的交易日
+        print("正在同步股票目录...")
+        db_utils.sync_stock_catalog()
+        
+        # 获取窗口内有交易的股票代码（来自股票目录）
+        print("正在获取所有股票代码...")
+        all_stocks = db_utils.get_window_ts_codes(latest_dates[-1])
+        total_stocks = len(all_stocks)
+        print(f"✓ 共找到 {total_stocks} 只股票需要处理")
+        
+        # 准备窗口统计表
+        window_dates = db_utils.prepare_window_stats()
+        
+        batches = [all_stocks[start:start + batch_size] for start in range(0, total_stocks, batch_size)]
+        queue_depth = max(1, queue_depth)
+        fetch_queue = queue.Queue(maxsize=queue_depth)
+        write_queue = queue.Queue(maxsize=queue_depth)
+        stop_event = threading.Event()
+        errors = []
+        counters = {"rows_written": 0}
+        
+        reader_stats = StageStats("read")
+        compute_stats = StageStats("compute")
+        writer_stats = StageStats("write")
+        
+        print(f"\n===== 开始流水线处理 (批大小: {batch_size}, 队列深度: {queue_depth}) =====")
+        wall_started = time.perf_counter()
+        
+        reader = threading.Thread(target=_reader, args=(batches, latest_dates[-1], fetch_queue, reader_stats, stop_event, errors), daemon=True)
+        writer = threading.Thread(target=_writer, args=(write_queue, window_dates, writer_stats, counters, stop_event, errors), daemon=True)
+        reader.start()
+        writer.start()
+        
+        # 计算阶段在当前线程执行
+        signals_count = 0
+        processed_count = 0
+        try:
+            while True:
+                stocks_data = _get(fetch_queue, stop_event)
+                if stocks_data is _END:
+                    break
+                
+                started = time.perf_counter()
+                batch_signals, signal_keys, signal_stocks = data_processor.compute_batch_signals(stocks_data)
+                signals_count += signal_stocks
+                strategy_signals = strategies.evaluate_strategies(stocks_data)
+                processed_count += len(stocks_data)
+                compute_stats.busy_seconds += time.perf_counter() - started
+                compute_stats.batches += 1
+                
+                print(f"处理进度: {processed_count}/{total_stocks} ({processed_count / total_stocks * 100:.1f}%) - 第 {compute_stats.batches} 批，{len(batch_signals)} 个信号")
+                
+                if not _put(write_queue, (list(stocks_data), batch_signals, signal_keys, strategy_signals), stop_event):
+                    break
+        except Exception as e:
+            errors.append(f"计算阶段出错: {str(e)}")
+            stop_event.set()
+        finally:
+            _put(write_queue, _END, stop_event)
+            writer.join()
+            reader.join()
+        
+        wall_seconds = time.perf_counter() - wall_started
+        
+        if errors:
+            for error in errors:
+                print(f"❌ {error}")
+            return {"error": "; ".join(errors)}
+        
+        # 输出各阶段利用率，利用率最高的阶段就是瓶颈
+        stages = [stats.to_dict(wall_seconds) for stats in (reader_stats, compute_stats, writer_stats)]
+        bottleneck = max(stages, key=lambda stage: stage["utilization"])["stage"]
+        print(f"\n流水线总耗时 {wall_seconds:.2f} 秒，写入 {counters['rows_written']} 行信号")
+        for stage in stages:
+            print(f"  阶段 {stage['stage']}: {stage['batches']} 批, 忙碌 {stage['busy_seconds']} 秒, 利用率 {stage['utilization']}%")
+        print(f"  瓶颈阶段: {bottleneck}")
+        
+        print(f"\n✅ 处理完成！共处理 {total_stocks} 只股票，其中 {signals_count} 只最近{len(latest_dates)}个交易日内有买卖点信号")
+        print("\n===== 正在从数据库加载结果 =====")
+        
+        # 从数据库获取结果
+        result = data_processor.load_snapshot()
+        result["pipeline_stats"] = {
+            "wall_seconds": round(wall_seconds, 3),
+            "queue_depth": queue_depth,
+            "rows_written": counters["rows_written"],
+            "stages": stages,
+            "bottleneck": bottleneck
+        }
+        print(f"✅ 数据加载完成！返回 {result.get('stock_count', 0)} 只股票数据，总共 {result.get('total_stocks', 0)} 只股票")
+        
+        return result
+    except Exception as e:
+        print(f"❌ 处理过程中出错: {str(e)}")
+        return {"error": str(e)}
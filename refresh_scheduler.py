@@ -0,0 +1,376 @@
+"""刷新调度：数据指纹未变化时跳过刷新，并按cron表达式或指纹变化在进程内自动刷新
+
+每次刷新前计算刷新窗口的数据指纹（最大交易日、行数、最大id），与上一次成功刷新记录的指纹相同时直接跳过。
+刷新记录持久化在refresh_history表中，服务重启后仍能判断数据是否变化。
+实时写入（ingest.py）维护了刷新结果的数据变化由record_ingest()在写入事务中推进指纹，不会触发刷新。
+同一进程内用线程锁、多个进程之间用PostgreSQL会话级咨询锁保证刷新不会重叠执行。
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+import db_utils
+import data_processor
+import distributed_refresh
+import panel_engine
+import refresh_pipeline
+import storage
+
+# 是否在服务进程中启动调度器
+SCHEDULER_ENABLED = True
+
+# 定时刷新的cron表达式（分 时 日 月 周），默认工作日收盘后15:30
+REFRESH_SCHEDULE = "30 15 * * 1-5"
+
+# 检查数据指纹的间隔（秒），指纹变化时立即刷新
+FINGERPRINT_POLL_SECONDS = 300
+
+# 定时刷新和指纹触发刷新使用的计算方式
+DEFAULT_METHOD = "optimized"
+
+# 跨进程的刷新互斥锁
+REFRESH_LOCK_ID = 7304202
+
+# 可选的计算方式及其调用
+REFRESH_METHODS = {
+    "legacy": lambda options: data_processor.compute_all_stocks_data(force_recompute=True),
+    "optimized": lambda options: data_processor.compute_stocks_data_optimized(
+        force_recompute=True, batch_size=options.get("batch_size", 100)),
+    "pipelined": lambda options: refresh_pipeline.compute_stocks_data_pipelined(
+        force_recompute=True, batch_size=options.get("batch_size", 100),
+        queue_depth=options.get("queue_depth", refresh_pipeline.DEFAULT_QUEUE_DEPTH)),
+    "panel": lambda options: panel_engine.compute_stocks_data_panel(force_recompute=True),
+    "distributed": lambda options: distributed_refresh.compute_stocks_data_distributed(
+        batch_size=options.get("batch_size", 100), local_workers=options.get("workers", 2))
+}
+
+
+class CronSchedule:
+    """五段式cron表达式（分 时 日 月 周），支持*、数字、列表、范围和步长，周日为0或7"""
+
+    RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"cron表达式需要5段: {expression}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self._parse_field(field, low, high) for field, (low, high) in zip(fields, self.RANGES))
+        self.weekdays = {weekday % 7 for weekday in weekdays}
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    @staticmethod
+    def _parse_field(field, low, high):
+        values = set()
+        for part in field.split(","):
+            value_range, _, step = part.partition("/")
+            if value_range == "*":
+                start, end = low, high
+            elif "-" in value_range:
+                start, end = (int(value) for value in value_range.split("-"))
+            else:
+                start = end = int(value_range)
+            if start < low or end > high or start > end:
+                raise ValueError(f"cron字段超出范围: {field}")
+            values.update(range(start, end + 1, int(step) if step else 1))
+        return values
+
+    def _day_matches(self, moment):
+        day_match = moment.day in self.days
+        weekday_match = (moment.isoweekday() % 7) in self.weekdays
+        # 日和周都有限制时满足其一即可（与cron相同）
+        if self.any_day:
+            return weekday_match
+        if self.any_weekday:
+            return day_match
+        return day_match or weekday_match
+
+    def matches(self, moment):
+        return (moment.minute in self.minutes and moment.hour in self.hours
+                and moment.month in self.months and self._day_matches(moment))
+
+    def next_after(self, moment):
+        """moment之后（不含moment所在分钟）下一次触发的时间，一年内没有时返回None"""
+        candidate = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = candidate + timedelta(days=366)
+        while candidate < limit:
+            if candidate.month not in self.months:
+                candidate = (candidate.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+            elif candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+            elif candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+            else:
+                return candidate
+        return None
+
+
+_run_lock = threading.Lock()
+_scheduler_thread = None
+_scheduler_lock = threading.Lock()
+_scheduler_status = {
+    "enabled": SCHEDULER_ENABLED,
+    "schedule": REFRESH_SCHEDULE,
+    "fingerprint_poll_seconds": FINGERPRINT_POLL_SECONDS,
+    "next_scheduled_at": None,
+    "last_checked_at": None,
+    "last_fingerprint": None,
+    "running": False,
+    "error": None
+}
+
+def ensure_history_table(cursor):
+    """创建刷新记录表"""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS refresh_history (
+            id BIGSERIAL PRIMARY KEY,
+            trigger TEXT NOT NULL,
+            method TEXT NOT NULL,
+            status TEXT NOT NULL,
+            fingerprint TEXT,
+            started_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            finished_at TIMESTAMPTZ,
+            stock_count INTEGER,
+            message TEXT
+        )
+    """)
+
+def _history_row(row):
+    if row is None:
+        return None
+    run_id, trigger, method, status, fingerprint, started_at, finished_at, stock_count, message = row
+    return {
+        "id": run_id,
+        "trigger": trigger,
+        "method": method,
+        "status": status,
+        "fingerprint": fingerprint,
+        "started_at": started_at.isoformat() if started_at else None,
+        "finished_at": finished_at.isoformat() if finished_at else None,
+        "stock_count": stock_count,
+        "message": message
+    }
+
+def get_last_run(status=None):
+    """最近一次刷新记录，status指定时只看该状态（例如'done'）"""
+    with db_utils.get_float_connection() as conn:
+        cursor = conn.cursor()
+        ensure_history_table(cursor)
+        conn.commit()
+        cursor.execute("""
+            SELECT id, trigger, method, status, fingerprint, started_at, finished_at, stock_count, message
+            FROM refresh_history
+            WHERE %s IS NULL OR status = %s
+            ORDER BY id DESC
+            LIMIT 1
+        """, (status, status))
+        row = cursor.fetchone()
+        cursor.close()
+    return _history_row(row)
+
+def _record_run(trigger, method, status, fingerprint, stock_count=None, message=None, run_id=None):
+    """插入新的刷新记录或更新run_id对应的记录，返回记录id"""
+    with db_utils.get_float_connection() as conn:
+        cursor = conn.cursor()
+        ensure_history_table(cursor)
+        if run_id is None:
+            cursor.execute("""
+                INSERT INTO refresh_history (trigger, method, status, fingerprint, stock_count, message, finished_at)
+                VALUES (%s, %s, %s, %s, %s, %s, CASE WHEN %s = 'running' THEN NULL ELSE now() END)
+                RETURNING id
+            """, (trigger, method, status, fingerprint, stock_count, message, status))
+            run_id = cursor.fetchone()[0]
+        else:
+            cursor.execute("""
+                UPDATE refresh_history
+                SET status = %s, stock_count = %s, message = %s, finished_at = now()
+                WHERE id = %s
+            """, (status, stock_count, message, run_id))
+        conn.commit()
+        cursor.close()
+    return run_id
+
+def record_ingest(cursor, window_start, inserted_ids, bar_count):
+    """实时写入在自己的事务中维护了刷新结果时，把最近一次成功刷新的指纹推进到写入后的指纹
+
+    只在窗口没有移动时调用（窗口移动后统计要由刷新重算）。最近一次成功刷新的指纹加上本次插入的行
+    必须正好等于写入后的指纹，否则说明还有其他来源的数据变化，保留旧指纹让调度器刷新。
+    推进的指纹记为trigger='ingest'的刷新记录，连续的实时写入更新同一条记录。
+
+    参数:
+    cursor: 实时写入事务的游标，记录随事务一起提交
+    window_start: 刷新窗口的起始交易日
+    inserted_ids: 本次插入的all_stocks_days行id
+    bar_count: 本次写入的K线数
+
+    返回:
+    bool: 是否推进了指纹
+    """
+    # 刷新执行期间读到的可能是写入前的数据，不推进；持有共享锁直到提交，期间刷新不会开始
+    cursor.execute("SELECT pg_try_advisory_xact_lock_shared(%s)", (REFRESH_LOCK_ID,))
+    if not cursor.fetchone()[0]:
+        return False
+    ensure_history_table(cursor)
+    cursor.execute("""
+        SELECT id, trigger, fingerprint, stock_count FROM refresh_history
+        WHERE status = 'done'
+        ORDER BY id DESC
+        LIMIT 1
+        FOR UPDATE
+    """)
+    last_run = cursor.fetchone()
+    if last_run is None or last_run[2] is None:
+        return False
+    run_id, trigger, fingerprint, stock_count = last_run
+    max_trade_date, row_count, max_id = fingerprint.split("|")
+    expected = f"{max_trade_date}|{int(row_count) + len(inserted_ids)}|{max(inserted_ids) if inserted_ids else max_id}"
+    if db_utils.window_fingerprint(cursor, window_start) != expected:
+        return False
+
+    message = f"实时写入{bar_count}根K线"
+    if trigger == "ingest":
+        cursor.execute("""
+            UPDATE refresh_history SET fingerprint = %s, message = %s, finished_at = now() WHERE id = %s
+        """, (expected, message, run_id))
+    else:
+        cursor.execute("""
+            INSERT INTO refresh_history (trigger, method, status, fingerprint, stock_count, message, finished_at)
+            VALUES ('ingest', 'ingest', 'done', %s, %s, %s, now())
+        """, (expected, stock_count, message))
+    return True
+
+@db_utils.primary_reads
+def run_refresh(method=DEFAULT_METHOD, force=False, trigger="manual", **options):
+    """执行一次刷新：指纹与上次成功刷新相同且快照已加载时跳过；已有刷新在执行时不等待
+
+    参数:
+    method: REFRESH_METHODS中的计算方式
+    force: 为True时忽略指纹，总是重新计算
+    trigger: 触发来源（manual、schedule、fingerprint）
+    options: 传给计算方式的参数（batch_size、queue_depth、workers）
+
+    返回:
+    dict: 刷新结果；跳过时包含skipped和reason（unchanged或running）
+    """
+    if method not in REFRESH_METHODS:
+        raise ValueError(f"未知的计算方式: {method}，可选 {sorted(REFRESH_METHODS)}")
+    if not _run_lock.acquire(blocking=False):
+        return {"skipped": True, "reason": "running", "message": "已有刷新正在执行"}
+    try:
+        if storage.is_local():
+            return _run_local(method, trigger)
+        with db_utils.get_float_connection() as lock_conn:
+            lock_cursor = lock_conn.cursor()
+            lock_cursor.execute("SELECT pg_try_advisory_lock(%s)", (REFRESH_LOCK_ID,))
+            locked = lock_cursor.fetchone()[0]
+            lock_conn.commit()
+            if not locked:
+                return {"skipped": True, "reason": "running", "message": "其他进程正在执行刷新"}
+            _scheduler_status["running"] = True
+            try:
+                return _run_locked(method, force, trigger, options)
+            finally:
+                _scheduler_status["running"] = False
+                lock_cursor.execute("SELECT pg_advisory_unlock(%s)", (REFRESH_LOCK_ID,))
+                lock_conn.commit()
+                lock_cursor.close()
+    finally:
+        _run_lock.release()
+
+def _run_local(method, trigger):
+    """本地SQLite存储：没有跨进程锁、数据指纹和刷新记录，总是用截面方式重新计算"""
+    if method != "panel":
+        print(f"⚠️ 本地存储只支持截面计算，{method} 改用 panel")
+    print(f"开始刷新（{trigger}，本地存储）")
+    _scheduler_status["running"] = True
+    try:
+        result = REFRESH_METHODS["panel"]({})
+    finally:
+        _scheduler_status["running"] = False
+    result["method"] = "panel"
+    return result
+
+def _run_locked(method, force, trigger, options):
+    fingerprint = db_utils.get_window_fingerprint()
+    _scheduler_status["last_fingerprint"] = fingerprint
+    last_run = get_last_run(status="done")
+    if (not force and fingerprint is not None and last_run is not None
+            and last_run["fingerprint"] == fingerprint and data_processor.get_snapshot() is not None):
+        print(f"✓ 数据指纹 {fingerprint} 与上次刷新相同，跳过刷新")
+        return {"skipped": True, "reason": "unchanged", "fingerprint": fingerprint, "last_run": last_run,
+                "message": "数据未变化，跳过刷新"}
+
+    run_id = _record_run(trigger, method, "running", fingerprint)
+    try:
+        result = REFRESH_METHODS[method](options)
+    except Exception as e:
+        result = {"error": str(e)}
+    if "error" in result:
+        _record_run(trigger, method, "failed", fingerprint, message=str(result["error"]), run_id=run_id)
+    else:
+        _record_run(trigger, method, "done", fingerprint, stock_count=result.get("stock_count", 0), run_id=run_id)
+    result["fingerprint"] = fingerprint
+    result["refresh_id"] = run_id
+    return result
+
+def _scheduler_loop(schedule, poll_seconds):
+    """调度线程：到达cron时间或指纹变化时刷新"""
+    next_scheduled = schedule.next_after(datetime.now())
+    next_poll = time.monotonic() + poll_seconds
+    _scheduler_status["next_scheduled_at"] = next_scheduled.isoformat() if next_scheduled else None
+    while True:
+        wait = next_poll - time.monotonic()
+        if next_scheduled is not None:
+            wait = min(wait, (next_scheduled - datetime.now()).total_seconds())
+        time.sleep(max(1.0, min(wait, 60.0)))
+
+        try:
+            if next_scheduled is not None and datetime.now() >= next_scheduled:
+                next_scheduled = schedule.next_after(datetime.now())
+                _scheduler_status["next_scheduled_at"] = next_scheduled.isoformat() if next_scheduled else None
+                print("\n===== 定时刷新开始 =====")
+                run_refresh(DEFAULT_METHOD, trigger="schedule")
+                next_poll = time.monotonic() + poll_seconds
+            elif time.monotonic() >= next_poll:
+                next_poll = time.monotonic() + poll_seconds
+                _scheduler_status["last_checked_at"] = datetime.now().isoformat()
+                fingerprint = db_utils.get_window_fingerprint()
+                _scheduler_status["last_fingerprint"] = fingerprint
+                last_run = get_last_run(status="done")
+                if fingerprint is not None and (last_run is None or last_run["fingerprint"] != fingerprint):
+                    print(f"\n===== 数据指纹变化为 {fingerprint}，开始刷新 =====")
+                    run_refresh(DEFAULT_METHOD, trigger="fingerprint")
+            _scheduler_status["error"] = None
+        except Exception as e:
+            _scheduler_status["error"] = str(e)
+            print(f"❌ 调度刷新时出错: {str(e)}")
+
+def start_scheduler(schedule=REFRESH_SCHEDULE, poll_seconds=FINGERPRINT_POLL_SECONDS):
+    """启动调度线程（重复调用只启动一次，SCHEDULER_ENABLED为False或使用本地存储时不启动）"""
+    global _scheduler_thread
+    if not SCHEDULER_ENABLED or storage.is_local():
+        return None
+    cron = CronSchedule(schedule)
+    with _scheduler_lock:
+        if _scheduler_thread is None:
+            _scheduler_status["schedule"] = schedule
+            _scheduler_status["fingerprint_poll_seconds"] = poll_seconds
+            _scheduler_thread = threading.Thread(target=_scheduler_loop, args=(cron, poll_seconds),
+                                                 name="refresh-scheduler", daemon=True)
+            _scheduler_thread.start()
+    return _scheduler_thread
+
+def get_status():
+    """调度器状态和最近一次刷新记录"""
+    status = dict(_scheduler_status)
+    status["started"] = _scheduler_thread is not None
+    try:
+        status["last_run"] = get_last_run()
+    except Exception as e:
+        status["last_run"] = None
+        status["error"] = str(e)
+    return status
@@ -1,4 +1,4 @@
-from app import app
+from app import main
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True) 
\ No newline at end of file
+    main(host="0.0.0.0", port=5000, debug=True)
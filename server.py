@@ -0,0 +1,239 @@
+"""生产环境的多进程服务入口（prefork）
+
+父进程加载应用并同步完成预热（索引检查、映射快照文件），关闭数据库连接池后绑定监听端口，
+再派生多个工作进程。工作进程以写时复制方式共享父进程中已加载的股票目录，通过mmap共享快照文件，
+各自用多线程的WSGI服务器处理请求，数据库连接池在工作进程中按需重新建立。
+
+父进程只负责监督：工作进程异常退出时重新派生（连续快速退出时逐步延迟）；
+收到SIGTERM或SIGINT时通知所有工作进程停止接受新连接、结束打开的SSE推送流、处理完进行中的请求后退出，
+超过GRACEFUL_TIMEOUT仍未退出的工作进程被强制结束。
+实时写入的K线缓冲区只保留在第0号工作进程中：父进程另外在回环地址上创建一个写入监听socket，
+第0号工作进程在它上面也运行一个WSGI服务器，其他工作进程收到的/api/ingest转发到这里（见ingest.owner_address）。
+SSE推送经由数据库的事件表在进程之间共享：每个工作进程在第一个订阅者到来时启动监听线程，
+订阅者收到所有进程写入的信号，事件id在各工作进程中通用（见signal_feed）。
+刷新调度器只在第0号工作进程中运行，避免每个进程各自定时刷新。
+
+用法:
+    python server.py --workers 4 --port 5000
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+from werkzeug.serving import make_server
+
+import db_utils
+import ingest
+import refresh_scheduler
+import signal_feed
+import startup
+from app import app
+
+# 默认工作进程数
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+# 每个工作进程的请求处理线程以ThreadingMixIn按连接创建，监听队列长度
+LISTEN_BACKLOG = 2048
+
+# 停止时等待工作进程处理完进行中请求的最长时间（秒）
+GRACEFUL_TIMEOUT = 30
+
+# 工作进程运行不到这么久就退出视为启动失败，重新派生前逐步延迟（秒）
+MIN_WORKER_UPTIME = 5
+MAX_RESPAWN_DELAY = 30
+
+# 父进程检查工作进程状态的间隔（秒）
+SUPERVISE_INTERVAL = 0.5
+
+# 负责实时写入的工作进程编号，以及其他工作进程转发写入请求的回环地址
+INGEST_OWNER_SLOT = 0
+INGEST_HOST = "127.0.0.1"
+
+
+def create_listener(host, port, backlog=LISTEN_BACKLOG):
+    """创建所有工作进程共享的监听socket
+
+    socket设为非阻塞：多个进程等待同一个socket时只有一个能取到连接，
+    其余进程accept得到EAGAIN后回到事件循环，不会阻塞在accept上而无法响应停止信号。
+    """
+    listener = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((host, port))
+    listener.listen(backlog)
+    listener.setblocking(False)
+    listener.set_inheritable(True)
+    return listener
+
+
+def _make_server(host, port, listener):
+    server = make_server(host, port, app, threaded=True, fd=listener.fileno())
+    # 跟踪请求线程，server_close()时等待进行中的请求处理完
+    server.daemon_threads = False
+    server.block_on_close = True
+    return server
+
+
+def _worker_main(slot, listener, host, port, ingest_listener):
+    """工作进程：在继承的监听socket上运行多线程WSGI服务器，收到SIGTERM后平滑退出"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    servers = [_make_server(host, port, listener)]
+    ingest_port = ingest_listener.getsockname()[1]
+    if slot == INGEST_OWNER_SLOT:
+        servers.append(_make_server(INGEST_HOST, ingest_port, ingest_listener))
+    else:
+        ingest.owner_address = (INGEST_HOST, ingest_port)
+        ingest_listener.close()
+
+    def stop(signum, frame):
+        # 结束打开的SSE推送流，server_close()等待请求线程时不会被永不结束的流拖到超时
+        signal_feed.feed.close()
+        # shutdown()会等待serve_forever退出，不能在运行serve_forever的主线程中直接调用
+        for server in servers:
+            threading.Thread(target=server.shutdown, daemon=True).start()
+    signal.signal(signal.SIGTERM, stop)
+
+    if slot == 0:
+        refresh_scheduler.start_scheduler()
+    threads = [threading.Thread(target=server.serve_forever, daemon=True) for server in servers[1:]]
+    for thread in threads:
+        thread.start()
+    print(f"✓ 工作进程 {os.getpid()} (#{slot}) 开始处理请求")
+    try:
+        servers[0].serve_forever()
+    finally:
+        for thread in threads:
+            thread.join()
+        for server in servers:
+            server.server_close()
+    print(f"✓ 工作进程 {os.getpid()} (#{slot}) 已退出")
+
+
+class Supervisor:
+    """父进程：派生并监督工作进程"""
+
+    def __init__(self, listener, host, port, workers, ingest_listener):
+        self.listener = listener
+        self.ingest_listener = ingest_listener
+        self.host = host
+        self.port = port
+        self.workers = max(1, workers)
+        self.children = {}       # pid -> slot
+        self.started_at = {}     # slot -> 派生时间
+        self.failures = {}       # slot -> 连续快速退出次数
+        self.respawn_at = {}     # slot -> 计划重新派生的时间
+        self.stopping = False
+
+    def spawn(self, slot):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                _worker_main(slot, self.listener, self.host, self.port, self.ingest_listener)
+            except Exception as e:
+                print(f"❌ 工作进程 #{slot} 出错: {str(e)}")
+                code = 1
+            finally:
+                sys.stdout.flush()
+                os._exit(code)
+        self.children[pid] = slot
+        self.started_at[slot] = time.monotonic()
+        return pid
+
+    def _handle_stop(self, signum, frame):
+        self.stopping = True
+
+    def _reap(self):
+        """回收已退出的工作进程，非停止状态下安排重新派生"""
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            slot = self.children.pop(pid, None)
+            if slot is None or self.stopping:
+                continue
+            uptime = time.monotonic() - self.started_at.get(slot, 0.0)
+            self.failures[slot] = self.failures.get(slot, 0) + 1 if uptime < MIN_WORKER_UPTIME else 0
+            delay = min(MAX_RESPAWN_DELAY, 2 ** self.failures[slot] - 1) if self.failures[slot] else 0
+            print(f"⚠️ 工作进程 {pid} (#{slot}) 退出（状态 {status}，运行 {uptime:.1f}秒），{delay}秒后重新派生")
+            self.respawn_at[slot] = time.monotonic() + delay
+
+    def _respawn_due(self):
+        now = time.monotonic()
+        for slot, due in list(self.respawn_at.items()):
+            if due <= now:
+                del self.respawn_at[slot]
+                self.spawn(slot)
+
+    def _shutdown(self):
+        """通知所有工作进程平滑退出，超时后强制结束"""
+        print(f"\n===== 正在停止 {len(self.children)} 个工作进程 =====")
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT
+        while self.children and time.monotonic() < deadline:
+            self._reap()
+            time.sleep(0.1)
+        for pid in list(self.children):
+            print(f"⚠️ 工作进程 {pid} 未在{GRACEFUL_TIMEOUT}秒内退出，强制结束")
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+        self.children.clear()
+        self.listener.close()
+        self.ingest_listener.close()
+        print("✓ 服务已停止")
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        for slot in range(self.workers):
+            self.spawn(slot)
+        print(f"✓ 已启动 {self.workers} 个工作进程，监听 http://{self.host}:{self.port}/")
+        while not self.stopping:
+            self._reap()
+            self._respawn_due()
+            time.sleep(SUPERVISE_INTERVAL)
+        self._shutdown()
+
+
+def serve(host='0.0.0.0', port=5000, workers=DEFAULT_WORKERS):
+    """预热后派生工作进程并监督，直到收到停止信号"""
+    print("\n===== 父进程预热 =====")
+    if not startup.warmup():
+        print("⚠️ 预热未完成，工作进程启动后按需从数据库加载")
+    # 连接不能跨进程共享，工作进程各自建立连接池
+    db_utils.close_pools()
+    # 预热得到的对象移入永久代，垃圾回收不再改写它们所在的内存页，工作进程写时复制共享
+    gc.collect()
+    gc.freeze()
+
+    listener = create_listener(host, port)
+    # 实时写入的回环监听socket，端口由系统分配
+    ingest_listener = create_listener(INGEST_HOST, 0)
+    Supervisor(listener, host, port, workers, ingest_listener).run()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="多进程API服务")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="工作进程数，默认为CPU核数")
+    args = parser.parse_args(argv)
+    serve(args.host, args.port, args.workers)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,213 @@
+"""影子比对：用相同的股票窗口数据分别运行逐行计算和候选计算引擎，核对结果是否一致
+
+逐行计算（compute_stock_signals，即compute_all_stocks_data/compute_stocks_data_optimized
+循环中调用signal_calculator的那部分）作为基准，候选引擎的buy、sell、earnings_rate
+按all_stocks_days.id逐个比对（浮点容差比较），输出不一致报告和加速比。
+比对只读取数据库，不写入high_level_inflows等任何表，也不推送信号。
+
+用法:
+    python shadow_compare.py panel --limit 500
+    python shadow_compare.py ingest --ts-codes 000001.SZ 600000.SH
+"""
+import argparse
+import math
+import sys
+import time
+
+import data_processor
+import ingest
+import panel_engine
+import storage
+
+# 浮点比较的默认容差
+DEFAULT_REL_TOL = 1e-9
+DEFAULT_ABS_TOL = 1e-9
+
+# 报告中最多列出的不一致条数
+MAX_REPORTED_MISMATCHES = 100
+
+# 比较的信号字段（信号元组中的位置）
+SIGNAL_FIELDS = (("buy", 1), ("sell", 2), ("earnings_rate", 3))
+
+
+def legacy_signals(stocks_data, start_date):
+    """基准：逐只股票、逐行调用signal_calculator计算"""
+    signals = []
+    for stock_data in stocks_data.values():
+        signals.extend(data_processor.compute_stock_signals(stock_data))
+    return signals
+
+def panel_signals(stocks_data, start_date):
+    """候选：截面引擎整矩阵计算"""
+    signals, _ = panel_engine.compute_panel_signals(stocks_data)
+    return signals
+
+def ingest_signals(stocks_data, start_date):
+    """候选：按交易日顺序把窗口内的K线逐根回放给实时写入的增量状态"""
+    signals = []
+    for ts_code, stock_data in stocks_data.items():
+        state = ingest.TickerState(ts_code)
+        for row in stock_data:
+            state.apply_bar(ingest.Bar(row[1], row[5], row[8], row[-1]), start_date)
+        signals.extend(bar.signal() for bar in state.bars if bar.has_signal)
+    return signals
+
+# 可比对的候选引擎：名称 -> 函数(stocks_data, start_date) -> 信号列表
+CANDIDATE_ENGINES = {
+    "panel": panel_signals,
+    "ingest": ingest_signals
+}
+
+
+def load_window(ts_codes=None, limit=None, batch_size=500):
+    """从当前存储后端（PostgreSQL时为只读连接）读取刷新窗口内的原始数据
+
+    参数:
+    ts_codes: 指定的股票代码列表，默认为窗口内全部股票
+    limit: 最多比对的股票数
+    batch_size: 每次查询的股票数
+
+    返回:
+    tuple: (窗口起始交易日, {ts_code: rows})
+    """
+    repository = storage.get_repository()
+    latest_dates = repository.latest_trading_dates()
+    if not latest_dates:
+        raise RuntimeError("无法获取最近交易日期")
+    start_date = latest_dates[-1]
+
+    if ts_codes is None:
+        ts_codes = repository.window_ts_codes(start_date)
+    if limit is not None:
+        ts_codes = ts_codes[:limit]
+
+    stocks_data = {}
+    for batch_start in range(0, len(ts_codes), batch_size):
+        stocks_data.update(repository.fetch_window(ts_codes[batch_start:batch_start + batch_size], start_date))
+    return start_date, stocks_data
+
+def _timed(engine, stocks_data, start_date, repeat):
+    """运行repeat次，返回最后一次的结果和最短耗时"""
+    best = None
+    signals = []
+    for _ in range(max(1, repeat)):
+        started = time.perf_counter()
+        signals = engine(stocks_data, start_date)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return signals, best
+
+def diff_signals(expected, actual, row_keys, rel_tol=DEFAULT_REL_TOL, abs_tol=DEFAULT_ABS_TOL):
+    """比对两组信号
+
+    参数:
+    expected: 基准信号列表[(all_stocks_days_id, buy, sell, earnings_rate)]
+    actual: 候选信号列表
+    row_keys: {all_stocks_days_id: (ts_code, trade_date)}
+
+    返回:
+    list: 不一致项，每项包含ts_code、trade_date、all_stocks_days_id、field、legacy、candidate
+    """
+    expected_by_id = {signal[0]: signal for signal in expected}
+    actual_by_id = {signal[0]: signal for signal in actual}
+    mismatches = []
+
+    for row_id in sorted(expected_by_id.keys() | actual_by_id.keys()):
+        ts_code, trade_date = row_keys.get(row_id, (None, None))
+        legacy = expected_by_id.get(row_id)
+        candidate = actual_by_id.get(row_id)
+        if legacy is None or candidate is None:
+            mismatches.append({
+                "ts_code": ts_code,
+                "trade_date": trade_date,
+                "all_stocks_days_id": row_id,
+                "field": "missing_in_candidate" if candidate is None else "extra_in_candidate",
+                "legacy": list(legacy[1:]) if legacy else None,
+                "candidate": list(candidate[1:]) if candidate else None
+            })
+            continue
+        for field, position in SIGNAL_FIELDS:
+            if not math.isclose(legacy[position], candidate[position], rel_tol=rel_tol, abs_tol=abs_tol):
+                mismatches.append({
+                    "ts_code": ts_code,
+                    "trade_date": trade_date,
+                    "all_stocks_days_id": row_id,
+                    "field": field,
+                    "legacy": legacy[position],
+                    "candidate": candidate[position]
+                })
+    return mismatches
+
+def compare_engines(candidate="panel", ts_codes=None, limit=None, repeat=3,
+                    rel_tol=DEFAULT_REL_TOL, abs_tol=DEFAULT_ABS_TOL, stocks_data=None, start_date=None):
+    """用相同的输入分别运行逐行计算和候选引擎，返回比对报告
+
+    参数:
+    candidate: 候选引擎名称，见CANDIDATE_ENGINES
+    ts_codes, limit: 比对的股票范围，见load_window
+    repeat: 每个引擎的运行次数，耗时取最短一次
+    rel_tol, abs_tol: 浮点比较容差
+    stocks_data, start_date: 直接给定输入数据时不读取数据库
+
+    返回:
+    dict: 比对报告，equivalent为True表示结果一致
+    """
+    if candidate not in CANDIDATE_ENGINES:
+        raise ValueError(f"未知的候选引擎: {candidate}，可选: {', '.join(CANDIDATE_ENGINES)}")
+
+    if stocks_data is None:
+        started = time.perf_counter()
+        start_date, stocks_data = load_window(ts_codes, limit)
+        print(f"✓ 读取 {len(stocks_data)} 只股票的窗口数据，{time.perf_counter() - started:.3f}秒")
+
+    row_keys = {row[-1]: (row[0], row[1]) for stock_data in stocks_data.values() for row in stock_data}
+
+    expected, legacy_seconds = _timed(legacy_signals, stocks_data, start_date, repeat)
+    actual, candidate_seconds = _timed(CANDIDATE_ENGINES[candidate], stocks_data, start_date, repeat)
+    mismatches = diff_signals(expected, actual, row_keys, rel_tol, abs_tol)
+
+    report = {
+        "candidate": candidate,
+        "equivalent": not mismatches,
+        "stocks": len(stocks_data),
+        "rows": len(row_keys),
+        "window_start": start_date,
+        "legacy_signals": len(expected),
+        "candidate_signals": len(actual),
+        "mismatch_count": len(mismatches),
+        "mismatched_stocks": len({item["ts_code"] for item in mismatches}),
+        "mismatches": mismatches[:MAX_REPORTED_MISMATCHES],
+        "rel_tol": rel_tol,
+        "abs_tol": abs_tol,
+        "legacy_seconds": round(legacy_seconds, 4),
+        "candidate_seconds": round(candidate_seconds, 4),
+        "speedup": round(legacy_seconds / candidate_seconds, 2) if candidate_seconds > 0 else None
+    }
+    if mismatches:
+        print(f"❌ {candidate} 与逐行计算有 {len(mismatches)} 处不一致（{report['mismatched_stocks']} 只股票）")
+    else:
+        print(f"✓ {candidate} 与逐行计算结果一致：{len(expected)} 个信号，加速比 {report['speedup']}x")
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="比对候选计算引擎与逐行计算的买卖点信号")
+    parser.add_argument("candidate", choices=sorted(CANDIDATE_ENGINES), help="候选引擎")
+    parser.add_argument("--ts-codes", nargs="+", default=None, help="只比对指定股票")
+    parser.add_argument("--limit", type=int, default=None, help="最多比对的股票数")
+    parser.add_argument("--repeat", type=int, default=3, help="每个引擎的运行次数，耗时取最短一次")
+    parser.add_argument("--rel-tol", type=float, default=DEFAULT_REL_TOL, help="相对容差")
+    parser.add_argument("--abs-tol", type=float, default=DEFAULT_ABS_TOL, help="绝对容差")
+    args = parser.parse_args(argv)
+
+    report = compare_engines(args.candidate, ts_codes=args.ts_codes, limit=args.limit, repeat=args.repeat,
+                             rel_tol=args.rel_tol, abs_tol=args.abs_tol)
+    print(f"股票 {report['stocks']}，行 {report['rows']}，信号 {report['legacy_signals']}/{report['candidate_signals']}")
+    print(f"逐行计算 {report['legacy_seconds']}秒，{args.candidate} {report['candidate_seconds']}秒，加速比 {report['speedup']}x")
+    for item in report["mismatches"]:
+        print(f"  {item['ts_code']} {item['trade_date']} id={item['all_stocks_days_id']} "
+              f"{item['field']}: 逐行={item['legacy']} 候选={item['candidate']}")
+    return 0 if report["equivalent"] else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,3 @@
-from decimal import Decimal
-
 def calculate_high_fund_outflow(stock_data, i, window=5):
     """计算高位资金净流出信号
     
@@ -16,17 +14,13 @@ def calculate_high_fund_outflow(stock_data, i, window=5):
     
     current_row = stock_data[i]
     
-    # 确保有足够的数据计算均线
+    # 确保有足够的数据计算均线（数值列在驱动层已转换为float，NULL为None）
     prices = []
-    volumes = []
     for j in range(i-window+1, i+1):
         if j >= 0 and j < len(stock_data):
             # 收盘价
-            if isinstance(stock_data[j][5], Decimal):
-                prices.append(float(stock_data[j][5]))
-            # 成交量
-            if isinstance(stock_data[j][8], Decimal):
-                volumes.append(float(stock_data[j][8]))
+            if stock_data[j][5] is not None:
+                prices.append(stock_data[j][5])
     
     if len(prices) < window:
         return False
@@ -35,22 +29,22 @@ def calculate_high_fund_outflow(stock_data, i, window=5):
     ma = sum(prices) / len(prices)
     
     # 当前价格
-    current_price = float(current_row[5]) if isinstance(current_row[5], Decimal) else 0
+    current_price = current_row[5] if current_row[5] is not None else 0
     
     # 当前成交量
-    current_volume = float(current_row[8]) if isinstance(current_row[8], Decimal) else 0
+    current_volume = current_row[8] if current_row[8] is not None else 0
     
     # 前一日成交量
     prev_volume = 0
     if i > 0:
         prev_row = stock_data[i-1]
-        prev_volume = float(prev_row[8]) if isinstance(prev_row[8], Decimal) else 0
+        prev_volume = prev_row[8] if prev_row[8] is not None else 0
     
     # 前一日收盘价
     prev_price = 0
     if i > 0:
         prev_row = stock_data[i-1]
-        prev_price = float(prev_row[5]) if isinstance(prev_row[5], Decimal) else 0
+        prev_price = prev_row[5] if prev_row[5] is not None else 0
     
     # 高位资金净流出条件：
     # 1. 价格处于高位 (高于简单移动平均线)
@@ -77,17 +71,13 @@ def calculate_buy_signal(stock_data, i, window=5):
     
     current_row = stock_data[i]
     
-    # 确保有足够的数据计算均线
+    # 确保有足够的数据计算均线（数值列在驱动层已转换为float，NULL为None）
     prices = []
-    volumes = []
     for j in range(i-window+1, i+1):
         if j >= 0 and j < len(stock_data):
             # 收盘价
-            if isinstance(stock_data[j][5], Decimal):
-                prices.append(float(stock_data[j][5]))
-            # 成交量
-            if isinstance(stock_data[j][8], Decimal):
-                volumes.append(float(stock_data[j][8]))
+            if stock_data[j][5] is not None:
+                prices.append(stock_data[j][5])
     
     if len(prices) < window:
         return False
@@ -96,22 +86,22 @@ def calculate_buy_signal(stock_data, i, window=5):
     ma = sum(prices) / len(prices)
     
     # 当前价格
-    current_price = float(current_row[5]) if isinstance(current_row[5], Decimal) else 0
+    current_price = current_row[5] if current_row[5] is not None else 0
     
     # 当前成交量
-    current_volume = float(current_row[8]) if isinstance(current_row[8], Decimal) else 0
+    current_volume = current_row[8] if current_row[8] is not None else 0
     
     # 前一日成交量
     prev_volume = 0
     if i > 0:
         prev_row = stock_data[i-1]
-        prev_volume = float(prev_row[8]) if isinstance(prev_row[8], Decimal) else 0
+        prev_volume = prev_row[8] if prev_row[8] is not None else 0
     
     # 前一日收盘价
     prev_price = 0
     if i > 0:
         prev_row = stock_data[i-1]
-        prev_price = float(prev_row[5]) if isinstance(prev_row[5], Decimal) else 0
+        prev_price = prev_row[5] if prev_row[5] is not None else 0
     
     # 买入信号条件：
     # 1. 价格处于低位 (低于简单移动平均线)
@@ -0,0 +1,389 @@
+"""买卖点信号推送：刷新和实时写入产生新的或变化的信号时，通过SSE推送给订阅者
+
+每个事件带有递增的序号，事件id为"纪元-序号"，客户端断线重连时用Last-Event-ID续传。
+最近的事件保存在有界缓冲区中用于续传；每个订阅者有自己的有界队列，
+发布时不阻塞，队列满的订阅者会被标记为落后并断开，由客户端从上次的事件id重连补齐，
+一个慢客户端不会拖慢发布方和其他订阅者。
+
+PostgreSQL存储时事件跨进程共享：写入信号的事务持有信号写入锁，在同一事务中用record_signals()把事件写入
+signal_events表并发出NOTIFY，事件id按提交顺序递增。每个进程在第一个订阅者到来时启动一个监听线程，
+LISTEN收到通知（或每隔LISTEN_POLL_SECONDS）后读取新事件发布给本进程的订阅者，
+因此多进程服务（server.py）中任何工作进程的订阅者都收到所有进程（包括分布式刷新的工作进程）写入的信号。
+序号就是事件表的id、纪元取自事件表，续传token在所有工作进程中通用。事件表只保留最近EVENT_RETENTION个事件。
+本地SQLite存储只有一个进程，提交后用publish_signals()直接在进程内发布。
+"""
+import json
+import os
+import queue
+import select
+import threading
+import time
+from collections import deque
+
+from psycopg2 import extras
+
+import db_utils
+import storage
+
+# 保留用于断线续传的最近事件数
+FEED_BUFFER_SIZE = 10000
+
+# 每个订阅者的待发送队列长度
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+# 没有事件时发送心跳注释的间隔（秒）
+HEARTBEAT_INTERVAL = 15
+
+# 客户端断线后的建议重连间隔（毫秒）
+RETRY_MILLISECONDS = 3000
+
+# 跨进程推送的通知通道
+FEED_CHANNEL = "signal_events"
+
+# 事件表保留的事件数，更早的事件在写入时删除
+EVENT_RETENTION = 100000
+
+# 监听线程没有收到通知时检查事件表的间隔（秒），监听连接重连期间丢失的通知也能补齐
+LISTEN_POLL_SECONDS = 5
+
+# 监听连接出错后重连的间隔（秒）
+LISTEN_RETRY_SECONDS = 5
+
+# 每次从事件表读取的事件数
+EVENT_FETCH_SIZE = 1000
+
+EVENTS_SINCE_SQL = """
+    SELECT id, ts_code, trade_date, buy, sell, earnings_rate
+    FROM signal_events
+    WHERE id > %s
+    ORDER BY id
+    LIMIT %s
+"""
+
+
+def signal_event(ts_code, trade_date, buy, sell, earnings_rate):
+    """构建一个信号事件；buy和sell都为0表示该行的信号已被删除"""
+    return {
+        "ts_code": ts_code,
+        "trade_date": str(trade_date),
+        "buy": buy,
+        "sell": sell,
+        "earnings_rate": earnings_rate
+    }
+
+
+def ensure_events_table(cursor):
+    """创建跨进程推送的信号事件表（在事务中调用：各工作进程同时启动监听时持有信号写入锁依次创建）"""
+    cursor.execute("SELECT to_regclass('signal_events') IS NOT NULL")
+    if cursor.fetchone()[0]:
+        return
+    db_utils.lock_signal_writes(cursor)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS signal_events (
+            id BIGSERIAL PRIMARY KEY,
+            ts_code TEXT NOT NULL,
+            trade_date TEXT NOT NULL,
+            buy DOUBLE PRECISION,
+            sell DOUBLE PRECISION,
+            earnings_rate DOUBLE PRECISION,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
+
+
+def _events(signals, keys):
+    return [signal_event(*keys[signal[0]], *signal[1:]) for signal in signals if signal[0] in keys]
+
+
+def record_signals(cursor, signals, keys):
+    """在写入信号的事务中记录事件（不提交事务），提交后所有进程的订阅者都会收到
+
+    事件在信号写入锁内分配id，id的顺序就是写入提交的顺序，监听线程按id读取不会漏掉事件。
+
+    参数:
+    cursor: 写入信号的事务的游标
+    signals: [(all_stocks_days_id, buy, sell, earnings_rate), ...]，通常为upsert_signals()的changed
+    keys: {all_stocks_days_id: (ts_code, trade_date)}
+
+    返回:
+    int: 记录的事件数
+    """
+    events = _events(signals, keys)
+    if not events:
+        return 0
+    db_utils.lock_signal_writes(cursor)
+    ensure_events_table(cursor)
+    extras.execute_values(cursor, """
+        INSERT INTO signal_events (ts_code, trade_date, buy, sell, earnings_rate) VALUES %s
+    """, [(event["ts_code"], event["trade_date"], event["buy"], event["sell"], event["earnings_rate"])
+          for event in events])
+    cursor.execute("SELECT MAX(id) FROM signal_events")
+    last_id = cursor.fetchone()[0]
+    cursor.execute("DELETE FROM signal_events WHERE id <= %s", (last_id - EVENT_RETENTION,))
+    # 通知在事务提交时才送达，回滚时不发出
+    cursor.execute("SELECT pg_notify(%s, %s)", (FEED_CHANNEL, str(last_id)))
+    return len(events)
+
+
+def _format_sse(event, data, event_id=None):
+    """格式化为一条SSE消息"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+
+class Subscriber:
+    """一个SSE客户端的订阅"""
+
+    def __init__(self, ts_codes=None):
+        self.ts_codes = set(ts_codes) if ts_codes else None
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.lagged = False
+        self.last_seq = 0
+
+    def wants(self, event):
+        return self.ts_codes is None or event["ts_code"] in self.ts_codes
+
+
+class SignalFeed:
+    """信号事件广播：本地存储时在进程内发布，PostgreSQL存储时由监听线程从事件表读取"""
+
+    def __init__(self, buffer_size=FEED_BUFFER_SIZE):
+        self._buffer_size = buffer_size
+        self._reset()
+
+    def _reset(self):
+        """清空事件和订阅者，生成新的纪元（构造时和fork出的子进程中调用）"""
+        self._lock = threading.Lock()
+        self._events = deque(maxlen=self._buffer_size)
+        self._subscribers = set()
+        self._seq = 0
+        # 进程内发布时纪元包含进程号；共享事件表时改为事件表的oid，所有进程通用
+        self._epoch = f"{int(time.time())}.{os.getpid()}"
+        self._published = 0
+        self._dropped_subscribers = 0
+        self._closed = False
+        self._listener = None
+        self._listener_lock = threading.Lock()
+
+    def _event_id(self, seq):
+        return f"{self._epoch}-{seq}"
+
+    def _parse_event_id(self, event_id):
+        """解析续传token，返回序号；不是本进程发出的token返回None"""
+        epoch, _, seq = (event_id or "").partition("-")
+        if epoch != self._epoch or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def shared(self):
+        """事件是否经由数据库的事件表在进程之间共享"""
+        return not storage.is_local()
+
+    def publish(self, events):
+        """在进程内发布一批事件，不阻塞；队列已满的订阅者被标记为落后"""
+        if not events:
+            return 0
+        with self._lock:
+            self._deliver([(self._seq + k + 1, event) for k, event in enumerate(events)])
+        return len(events)
+
+    def _deliver(self, items):
+        """把(序号, 事件)按序号顺序放入缓冲区和订阅者队列，已发布过的序号跳过（调用方持有self._lock）"""
+        for item in items:
+            seq, event = item
+            if seq <= self._seq:
+                continue
+            self._seq = seq
+            self._events.append(item)
+            self._published += 1
+            for subscriber in self._subscribers:
+                if subscriber.lagged or not subscriber.wants(event):
+                    continue
+                try:
+                    subscriber.queue.put_nowait(item)
+                except queue.Full:
+                    subscriber.lagged = True
+                    self._dropped_subscribers += 1
+
+    def _start_listener(self):
+        """共享事件表时启动本进程的监听线程（只启动一次），先同步读取最近的事件用于续传"""
+        if self._listener is not None or not self.shared():
+            return
+        with self._listener_lock:
+            if self._listener is not None:
+                return
+            try:
+                with db_utils.get_float_connection() as conn:
+                    self._load(conn.cursor())
+                    conn.commit()
+            except Exception as e:
+                print(f"⚠️ 读取信号事件表失败，监听线程稍后重试: {str(e)}")
+            self._listener = threading.Thread(target=self._listen, name="signal-feed", daemon=True)
+            self._listener.start()
+
+    def _load(self, cursor):
+        """（重新）连接事件表：纪元变化（第一次连接或事件表重建）时从最近的事件开始，否则补齐断开期间的事件"""
+        ensure_events_table(cursor)
+        cursor.execute("SELECT 'signal_events'::regclass::oid, COALESCE(MAX(id), 0) FROM signal_events")
+        oid, last_id = cursor.fetchone()
+        epoch = f"db{oid}"
+        with self._lock:
+            if epoch != self._epoch:
+                self._epoch = epoch
+                self._events.clear()
+                self._seq = max(last_id - self._buffer_size, 0)
+        self._poll(cursor)
+
+    def _poll(self, cursor):
+        """读取并发布事件表中尚未发布的事件"""
+        while True:
+            cursor.execute(EVENTS_SINCE_SQL, (self._seq, EVENT_FETCH_SIZE))
+            rows = cursor.fetchall()
+            with self._lock:
+                self._deliver([(row[0], signal_event(*row[1:])) for row in rows])
+            if len(rows) < EVENT_FETCH_SIZE:
+                return
+
+    def _listen(self):
+        """监听线程：LISTEN通知通道，收到通知或超时后读取新事件；连接出错时重连并补齐"""
+        while not self._closed:
+            conn = None
+            try:
+                conn = db_utils.get_db_connection()
+                cursor = conn.cursor()
+                cursor.execute(f"LISTEN {FEED_CHANNEL}")
+                self._load(cursor)
+                # LISTEN在提交后生效，之后每次查询自动提交，补读提交前到达的事件
+                conn.commit()
+                conn.autocommit = True
+                self._poll(cursor)
+                while not self._closed:
+                    if select.select([conn], [], [], LISTEN_POLL_SECONDS) != ([], [], []):
+                        conn.poll()
+                        conn.notifies.clear()
+                    self._poll(cursor)
+            except Exception as e:
+                print(f"⚠️ 信号事件监听出错，{LISTEN_RETRY_SECONDS}秒后重连: {str(e)}")
+                time.sleep(LISTEN_RETRY_SECONDS)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def _catch_up(self):
+        """续传token来自已读到更新事件的其他进程时，不等通知立即读取事件表"""
+        try:
+            with db_utils.get_float_connection() as conn:
+                self._poll(conn.cursor())
+                conn.commit()
+        except Exception as e:
+            print(f"⚠️ 读取信号事件表失败: {str(e)}")
+
+    def subscribe(self, ts_codes=None, last_event_id=None):
+        """注册订阅者并补发last_event_id之后的事件
+
+        返回:
+        tuple: (Subscriber, 是否能从last_event_id完整续传)
+        """
+        self._start_listener()
+        if last_event_id and self.shared():
+            since = self._parse_event_id(last_event_id)
+            if since is not None and since > self._seq:
+                self._catch_up()
+        subscriber = Subscriber(ts_codes)
+        resumed = True
+        with self._lock:
+            if last_event_id:
+                since = self._parse_event_id(last_event_id)
+                oldest = self._events[0][0] if self._events else self._seq + 1
+                if since is None or since > self._seq or since < oldest - 1:
+                    resumed = False
+                else:
+                    backlog = [item for item in self._events if item[0] > since and subscriber.wants(item[1])]
+                    if len(backlog) >= SUBSCRIBER_QUEUE_SIZE:
+                        resumed = False
+                    else:
+                        for item in backlog:
+                            subscriber.queue.put_nowait(item)
+            subscriber.last_seq = self._seq
+            self._subscribers.add(subscriber)
+        return subscriber, resumed
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def close(self):
+        """停止服务时结束所有打开的推送流（否则心跳使流永不结束，平滑退出要等到超时）"""
+        with self._lock:
+            self._closed = True
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.queue.put_nowait(_CLOSED)
+            except queue.Full:
+                # 队列已满时按落后处理，流在下一次循环时结束
+                subscriber.lagged = True
+
+    def stream(self, subscriber, resumed=True):
+        """生成SSE消息，客户端断开时注销订阅"""
+        try:
+            yield f"retry: {RETRY_MILLISECONDS}\n\n"
+            if not resumed:
+                # 续传点已不在缓冲区中（或进程重启），客户端需要重新拉取全量数据
+                yield _format_sse("reset", {"reason": "resume token expired"}, self._event_id(subscriber.last_seq))
+            while True:
+                if self._closed:
+                    return
+                if subscriber.lagged:
+                    yield _format_sse("lagged", {"reason": "client too slow, reconnect to resume"})
+                    return
+                try:
+                    item = subscriber.queue.get(timeout=HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if item is _CLOSED:
+                    return
+                seq, event = item
+                subscriber.last_seq = seq
+                yield _format_sse("signal", event, self._event_id(seq))
+        finally:
+            self.unsubscribe(subscriber)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "shared": self.shared(),
+                "subscribers": len(self._subscribers),
+                "published": self._published,
+                "buffered": len(self._events),
+                "last_event_id": self._event_id(self._seq),
+                "dropped_subscribers": self._dropped_subscribers
+            }
+
+
+# 放入订阅者队列表示推送已关闭
+_CLOSED = object()
+
+# 进程内共享的信号推送
+feed = SignalFeed()
+
+# fork出的工作进程不能沿用父进程的事件序列、纪元、锁和监听线程
+os.register_at_fork(after_in_child=feed._reset)
+
+def publish_signals(signals, keys):
+    """本地存储时在提交后发布写入的信号行
+
+    PostgreSQL存储的事件已由record_signals()随写入事务记录，由各进程的监听线程发布，这里不再重复。
+
+    参数:
+    signals: [(all_stocks_days_id, buy, sell, earnings_rate), ...]
+    keys: {all_stocks_days_id: (ts_code, trade_date)}
+    """
+    if feed.shared():
+        return 0
+    return feed.publish(_events(signals, keys))
@@ -0,0 +1,553 @@
+"""信号股票快照文件：刷新时写入，服务进程通过mmap共享读取
+
+文件是不可变的，每次刷新写出一个新版本：先写临时文件，再用rename原子替换。
+已打开旧版本的进程继续读取旧文件（inode仍然有效），定期检查文件变化后切换到新版本。
+写出新版本的一方（刷新后的全量加载、实时写入后的合并更新）用write_lock()互斥，先读取数据再写出的过程不会交错。
+
+文件布局（各段按8字节对齐，数组使用本机字节序）:
+  header       magic, version, 股票数, 行数, 字符串数, meta长度, 两段JSON的长度
+  meta         JSON: column_names, total_stocks, date_range, created_at, change_log
+  numeric      11个float64数值列，每列连续存放所有行
+  string refs  3个uint32字符串列（ts_code, trade_date, name），值为字符串表下标
+  stocks       每只股票一条记录: ts_code下标, 起始行, 行数, 信号数, 收益率
+  returns      按收益率降序的股票下标
+  offsets      字符串表偏移（字符串数+1个uint32）
+  data json    data字段（每只股票的行列表）编码好的JSON文本
+  returns json stock_returns字段编码好的JSON文本
+  blob         UTF-8字符串数据
+
+服务进程不把快照物化为Python对象：/api/stocks的响应直接由两段JSON文本的切片拼接而成，
+单只股票和增量结果按需从数值列和字符串表解码，物理内存只有一份（页缓存）。
+"""
+import fcntl
+import io
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+
+# 快照文件位置
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshots')
+SNAPSHOT_PATH = os.path.join(SNAPSHOT_DIR, 'signals_snapshot.bin')
+
+# 服务进程检查快照文件是否被替换的最小间隔（秒）
+SNAPSHOT_CHECK_INTERVAL = 1.0
+
+# 快照文件中保留的变更记录版本数
+CHANGE_LOG_LIMIT = 20
+
+MAGIC = b'HLISNAP2'
+HEADER = struct.Struct('<8sQIIIIQQ')
+# 不带JSON段的旧版本文件，只用于延续版本号
+LEGACY_MAGIC = b'HLISNAP1'
+STOCK_RECORD = struct.Struct('<IIIId')
+
+# 行内数值列和字符串列的位置（对应db_utils.STOCK_COLUMN_NAMES）
+NUMERIC_COLUMNS = [2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 13]
+STRING_COLUMNS = [0, 1, 12]
+ROW_WIDTH = len(NUMERIC_COLUMNS) + len(STRING_COLUMNS)
+
+# NULL字符串的下标
+NULL_STRING = 0xFFFFFFFF
+
+# 流式输出JSON响应时每块的字节数
+JSON_CHUNK_SIZE = 256 * 1024
+
+_reader = None
+_reader_key = None
+_last_check = 0.0
+_reader_lock = threading.Lock()
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+def _layout(n_stocks, n_rows, n_strings, meta_len, data_json_len, returns_json_len):
+    """计算各段的起始偏移"""
+    layout = {}
+    offset = _align(HEADER.size)
+    layout["meta"] = offset
+    offset = _align(offset + meta_len)
+    layout["numeric"] = offset
+    offset += len(NUMERIC_COLUMNS) * n_rows * 8
+    layout["strings"] = offset
+    offset = _align(offset + len(STRING_COLUMNS) * n_rows * 4)
+    layout["stocks"] = offset
+    offset += n_stocks * STOCK_RECORD.size
+    layout["returns"] = offset
+    offset = _align(offset + n_stocks * 4)
+    layout["offsets"] = offset
+    offset += (n_strings + 1) * 4
+    layout["data_json"] = offset
+    offset += data_json_len
+    layout["returns_json"] = offset
+    offset += returns_json_len
+    layout["blob"] = offset
+    return layout
+
+def read_version(path=SNAPSHOT_PATH):
+    """读取快照文件版本号，文件不存在或无效时返回0"""
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(HEADER.size)
+        if len(header) < 16:
+            return 0
+        magic, version = struct.unpack_from('<8sQ', header)
+        return version if magic in (MAGIC, LEGACY_MAGIC) else 0
+    except FileNotFoundError:
+        return 0
+
+def _normalize_row(row):
+    """按快照文件的存储方式规范化一行，用于和旧版本比较"""
+    values = list(row)
+    for column in NUMERIC_COLUMNS:
+        values[column] = float(row[column]) if row[column] is not None else 0.0
+    for column in STRING_COLUMNS:
+        values[column] = str(row[column]) if row[column] is not None else None
+    return tuple(values)
+
+def _diff_snapshot(previous, result, returns_by_code, ts_codes=None):
+    """比较旧版本快照和新结果，返回新增、变化和移除的股票代码
+
+    ts_codes不为None时只有这些股票可能变化（其余股票原样取自旧版本），只比较这些股票。
+    """
+    added = []
+    changed = []
+    seen = set()
+    for stock_rows in result["data"]:
+        if not stock_rows:
+            continue
+        ts_code = stock_rows[0][0]
+        seen.add(ts_code)
+        if ts_codes is not None and ts_code not in ts_codes:
+            continue
+        old_rows = previous.get_stock_rows(ts_code)
+        if old_rows is None:
+            added.append(ts_code)
+            continue
+        info = returns_by_code.get(ts_code, {})
+        old_info = previous.get_return_info(ts_code)
+        if (old_rows != [_normalize_row(row) for row in stock_rows]
+                or old_info["signal_count"] != info.get("signal_count", 0)
+                or old_info["return_rate"] != info.get("return_rate", 0.0)):
+            changed.append(ts_code)
+    candidates = previous.ts_codes() if ts_codes is None else sorted(ts_code for ts_code in ts_codes if ts_code in previous)
+    removed = [ts_code for ts_code in candidates if ts_code not in seen]
+    return added, changed, removed
+
+def _write_snapshot_data(f, result, version, change_log):
+    """把信号股票数据按快照文件布局写入文件对象f（从f的起始位置开始）"""
+    # 字符串表
+    strings = []
+    string_ids = {}
+    def intern(value):
+        if value is None:
+            return NULL_STRING
+        value = str(value)
+        sid = string_ids.get(value)
+        if sid is None:
+            sid = len(strings)
+            string_ids[value] = sid
+            strings.append(value)
+        return sid
+
+    numeric = [array('d') for _ in NUMERIC_COLUMNS]
+    string_refs = [array('I') for _ in STRING_COLUMNS]
+    stocks = []
+    stock_positions = {}
+    stocks_json = []
+    n_rows = 0
+
+    returns_by_code = {info["ts_code"]: info for info in result.get("stock_returns", [])}
+
+    for stock_rows in result["data"]:
+        if not stock_rows:
+            continue
+        ts_code = stock_rows[0][0]
+        info = returns_by_code.get(ts_code, {})
+        stock_positions[ts_code] = len(stocks)
+        stocks.append((intern(ts_code), n_rows, len(stock_rows), info.get("signal_count", 0), info.get("return_rate", 0.0)))
+        for row in stock_rows:
+            for k, column in enumerate(NUMERIC_COLUMNS):
+                numeric[k].append(row[column] if row[column] is not None else 0.0)
+            for k, column in enumerate(STRING_COLUMNS):
+                string_refs[k].append(intern(row[column]))
+        # 按存储后的取值编码，与从文件解码出的行完全一致
+        stocks_json.append(json.dumps([_normalize_row(row) for row in stock_rows], ensure_ascii=False))
+        n_rows += len(stock_rows)
+
+    returns_order = array('I', [stock_positions[info["ts_code"]] for info in result.get("stock_returns", []) if info["ts_code"] in stock_positions])
+
+    encoded = [value.encode('utf-8') for value in strings]
+    offsets = array('I', [0])
+    for value in encoded:
+        offsets.append(offsets[-1] + len(value))
+
+    meta = json.dumps({
+        "column_names": result["column_names"],
+        "total_stocks": result.get("total_stocks", 0),
+        "date_range": result.get("date_range"),
+        "created_at": time.time(),
+        "change_log": change_log
+    }, ensure_ascii=False).encode('utf-8')
+
+    data_json = ("[" + ", ".join(stocks_json) + "]").encode('utf-8')
+    returns_json = json.dumps([_stock_return_info(stocks[k], string_refs[2], strings) for k in returns_order],
+                              ensure_ascii=False).encode('utf-8')
+
+    layout = _layout(len(stocks), n_rows, len(strings), len(meta), len(data_json), len(returns_json))
+
+    def seek(offset):
+        f.write(b'\0' * (offset - f.tell()))
+    f.write(HEADER.pack(MAGIC, version, len(stocks), n_rows, len(strings), len(meta), len(data_json), len(returns_json)))
+    seek(layout["meta"])
+    f.write(meta)
+    seek(layout["numeric"])
+    for column in numeric:
+        column.tofile(f)
+    for column in string_refs:
+        column.tofile(f)
+    seek(layout["stocks"])
+    for record in stocks:
+        f.write(STOCK_RECORD.pack(*record))
+    returns_order.tofile(f)
+    seek(layout["offsets"])
+    offsets.tofile(f)
+    f.write(data_json)
+    f.write(returns_json)
+    for value in encoded:
+        f.write(value)
+
+def _stock_return_info(record, name_refs, strings):
+    """股票记录对应的收益率信息，与SnapshotReader.get_return_info()相同"""
+    sid, row_start, _, signal_count, return_rate = record
+    name_sid = name_refs[row_start]
+    return {
+        "ts_code": strings[sid],
+        "name": strings[name_sid] if name_sid != NULL_STRING else None,
+        "signal_count": int(signal_count),
+        "return_rate": float(return_rate)
+    }
+
+def write_snapshot(result, path=SNAPSHOT_PATH, ts_codes=None):
+    """把get_stocks_with_signals_from_db的结果写成新版本快照文件
+
+    与上一版本比较，把新增、变化和移除的股票记录到change_log中，
+    服务进程据此只让变化股票的缓存失效。
+
+    参数:
+    result: 信号股票数据（column_names, data, stock_returns等）
+    path: 快照文件路径
+    ts_codes: 实时写入过的股票，None表示全量结果。给出时只比较这些股票，
+              并把它们记为touched：不在快照中的股票（无信号）的缓存同样需要失效
+
+    返回:
+    int: 新快照的版本号
+    """
+    try:
+        previous = SnapshotReader(path) if os.path.exists(path) else None
+    except Exception as e:
+        print(f"⚠️ 读取上一版本快照时出错，将不记录变更: {str(e)}")
+        previous = None
+    version = (previous.version if previous is not None else read_version(path)) + 1
+
+    change_log = []
+    if previous is not None:
+        returns_by_code = {info["ts_code"]: info for info in result.get("stock_returns", [])}
+        added, changed, removed = _diff_snapshot(previous, result, returns_by_code, ts_codes)
+        change_log = (previous.meta.get("change_log", []) + [{
+            "version": version,
+            "previous_version": previous.version,
+            "window_changed": previous.meta.get("date_range") != result.get("date_range"),
+            "added": added,
+            "changed": changed,
+            "removed": removed,
+            "touched": sorted(ts_codes) if ts_codes is not None else []
+        }])[-CHANGE_LOG_LIMIT:]
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        _write_snapshot_data(f, result, version, change_log)
+        f.flush()
+        os.fsync(f.fileno())
+
+    # 原子替换，已映射旧文件的进程不受影响
+    os.replace(tmp_path, path)
+    return version
+
+@contextmanager
+def write_lock(path=SNAPSHOT_PATH):
+    """写出新版本快照的进程间互斥锁（快照文件旁的.lock文件上的flock）
+
+    持有锁期间读取数据库并写出快照，另一方写出的版本不会被基于更早数据的结果覆盖。
+    快照目录不可写时不加锁（此时也写不出快照文件，只能使用本进程的内存快照）。
+    """
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        f = open(f"{path}.lock", "a")
+    except OSError as e:
+        print(f"⚠️ 无法创建快照写入锁文件，不加锁继续: {str(e)}")
+        yield
+        return
+    with f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def memory_snapshot(result, version):
+    """在内存中按快照文件布局编码结果，返回只属于本进程的读取器（写快照文件失败时使用）"""
+    buffer = io.BytesIO()
+    _write_snapshot_data(buffer, result, version, [])
+    return SnapshotReader(data=buffer.getvalue())
+
+
+class SnapshotReader:
+    """通过mmap只读访问一个快照文件版本，数值列零拷贝读取
+
+    data不为None时读取内存中按相同布局编码的快照（memory_snapshot()的结果）。
+    """
+
+    def __init__(self, path=SNAPSHOT_PATH, data=None):
+        if data is None:
+            with open(path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._mmap = data
+        view = memoryview(self._mmap)
+
+        if bytes(view[:8]) != MAGIC:
+            raise ValueError(f"无效的快照文件: {path}")
+        (_, self.version, self.stock_count, self.row_count, string_count, meta_len,
+         data_json_len, returns_json_len) = HEADER.unpack_from(self._mmap, 0)
+
+        layout = _layout(self.stock_count, self.row_count, string_count, meta_len, data_json_len, returns_json_len)
+        self.meta = json.loads(bytes(view[layout["meta"]:layout["meta"] + meta_len]).decode('utf-8'))
+
+        column_size = self.row_count * 8
+        self._numeric = [
+            view[layout["numeric"] + k * column_size:layout["numeric"] + (k + 1) * column_size].cast('d')
+            for k in range(len(NUMERIC_COLUMNS))
+        ]
+        ref_size = self.row_count * 4
+        self._string_refs = [
+            view[layout["strings"] + k * ref_size:layout["strings"] + (k + 1) * ref_size].cast('I')
+            for k in range(len(STRING_COLUMNS))
+        ]
+        self._returns_order = view[layout["returns"]:layout["returns"] + self.stock_count * 4].cast('I')
+        self._string_offsets = view[layout["offsets"]:layout["offsets"] + (string_count + 1) * 4].cast('I')
+        self._data_json = view[layout["data_json"]:layout["data_json"] + data_json_len]
+        self._returns_json = view[layout["returns_json"]:layout["returns_json"] + returns_json_len]
+        self._blob = view[layout["blob"]:]
+        self._strings = [None] * string_count
+
+        # 股票记录和ts_code索引
+        self._stocks = [STOCK_RECORD.unpack_from(self._mmap, layout["stocks"] + k * STOCK_RECORD.size) for k in range(self.stock_count)]
+        self._index = {self.string(record[0]): k for k, record in enumerate(self._stocks)}
+
+    def string(self, sid):
+        """按下标读取字符串表中的字符串"""
+        if sid == NULL_STRING:
+            return None
+        value = self._strings[sid]
+        if value is None:
+            value = str(self._blob[self._string_offsets[sid]:self._string_offsets[sid + 1]], 'utf-8')
+            self._strings[sid] = value
+        return value
+
+    def row(self, r):
+        """读取第r行，返回与db_utils.STOCK_COLUMN_NAMES对应的元组"""
+        values = [None] * ROW_WIDTH
+        for k, column in enumerate(NUMERIC_COLUMNS):
+            values[column] = self._numeric[k][r]
+        for k, column in enumerate(STRING_COLUMNS):
+            values[column] = self.string(self._string_refs[k][r])
+        return tuple(values)
+
+    def changes_since(self, since_version):
+        """合并since_version之后各版本的变更
+
+        参数:
+        since_version: 起始版本号
+
+        返回:
+        dict: {"added", "changed", "removed": 股票代码列表, "window_changed": bool,
+               "touched": 实时写入过的股票代码列表}，
+              相对since_version的净变化；变更记录不足以覆盖时返回None
+        """
+        if since_version == self.version:
+            return {"added": [], "changed": [], "removed": [], "window_changed": False, "touched": []}
+        entries = [entry for entry in self.meta.get("change_log", []) if entry["version"] > since_version]
+        if not entries or entries[0]["previous_version"] != since_version or entries[-1]["version"] != self.version:
+            return None
+
+        states = {}
+        window_changed = False
+        touched = set()
+        for entry in entries:
+            window_changed = window_changed or entry["window_changed"]
+            touched.update(entry.get("touched", []))
+            for ts_code in entry["added"]:
+                states[ts_code] = "changed" if states.get(ts_code) == "removed" else "added"
+            for ts_code in entry["changed"]:
+                if states.get(ts_code) != "added":
+                    states[ts_code] = "changed"
+            for ts_code in entry["removed"]:
+                if states.get(ts_code) == "added":
+                    del states[ts_code]
+                else:
+                    states[ts_code] = "removed"
+
+        changes = {"added": [], "changed": [], "removed": [], "window_changed": window_changed, "touched": sorted(touched)}
+        for ts_code, state in sorted(states.items()):
+            changes[state].append(ts_code)
+        return changes
+
+    def ts_codes(self):
+        """快照中的股票代码（按代码排序）"""
+        return list(self._index)
+
+    def __contains__(self, ts_code):
+        return ts_code in self._index
+
+    def get_stock_rows(self, ts_code):
+        """读取单只股票窗口内的所有行，不存在时返回None"""
+        k = self._index.get(ts_code)
+        if k is None:
+            return None
+        _, row_start, row_count, _, _ = self._stocks[k]
+        return [self.row(r) for r in range(row_start, row_start + row_count)]
+
+    def get_return_info(self, ts_code):
+        """读取单只股票的收益率信息，不存在时返回None"""
+        k = self._index.get(ts_code)
+        if k is None:
+            return None
+        return self._return_info(k)
+
+    def _return_info(self, k):
+        sid, row_start, _, signal_count, return_rate = self._stocks[k]
+        return {
+            "ts_code": self.string(sid),
+            "name": self.string(self._string_refs[2][row_start]),
+            "signal_count": signal_count,
+            "return_rate": return_rate
+        }
+
+    def stock_returns(self):
+        """按收益率降序的股票收益率列表"""
+        return [self._return_info(k) for k in self._returns_order]
+
+    def signal_dates(self, ts_code):
+        """单只股票窗口内有买点和有卖点的交易日列表，只读取买卖点两列，不解码整行
+
+        返回:
+        tuple: (买点交易日列表, 卖点交易日列表)，股票不在快照中时返回None
+        """
+        k = self._index.get(ts_code)
+        if k is None:
+            return None
+        _, row_start, row_count, _, _ = self._stocks[k]
+        buy = self._numeric[NUMERIC_COLUMNS.index(9)]
+        sell = self._numeric[NUMERIC_COLUMNS.index(13)]
+        dates = self._string_refs[STRING_COLUMNS.index(1)]
+        rows = range(row_start, row_start + row_count)
+        return ([self.string(dates[r]) for r in rows if buy[r] > 0],
+                [self.string(dates[r]) for r in rows if sell[r] > 0])
+
+    def iter_json(self, extra=None):
+        """逐块生成与json.dumps(self.to_result(), ensure_ascii=False)相同的UTF-8文本
+
+        data和stock_returns两个字段直接取文件中编码好的JSON切片，不解码行。
+
+        参数:
+        extra: 追加在结果末尾的字段
+        """
+        yield ('{"column_names": ' + json.dumps(self.meta["column_names"], ensure_ascii=False) + ', "data": ').encode('utf-8')
+        yield from _chunks(self._data_json)
+        yield (', "page": 1, "stock_count": ' + str(self.stock_count)
+               + ', "total_stocks": ' + json.dumps(self.meta["total_stocks"])
+               + ', "date_range": ' + json.dumps(self.meta["date_range"], ensure_ascii=False)
+               + ', "stock_returns": ').encode('utf-8')
+        yield from _chunks(self._returns_json)
+        tail = {"data_version": self.version}
+        tail.update(extra or {})
+        yield (', ' + json.dumps(tail, ensure_ascii=False)[1:]).encode('utf-8')
+
+    def iter_returns_json(self):
+        """逐块生成{"stock_returns": [...]}的UTF-8文本"""
+        yield b'{"stock_returns": '
+        yield from _chunks(self._returns_json)
+        yield b'}'
+
+    def to_result(self):
+        """物化为与get_stocks_with_signals_from_db相同格式的结果（服务进程中不使用，响应见iter_json）"""
+        data = [self.get_stock_rows(ts_code) for ts_code in self._index]
+        return {
+            "column_names": self.meta["column_names"],
+            "data": data,
+            "page": 1,
+            "stock_count": len(data),
+            "total_stocks": self.meta["total_stocks"],
+            "date_range": self.meta["date_range"],
+            "stock_returns": self.stock_returns(),
+            "data_version": self.version
+        }
+
+    def get_single_stock_result(self, ts_code):
+        """构建与get_single_stock_data相同格式的结果，不存在时返回None"""
+        stock_rows = self.get_stock_rows(ts_code)
+        if stock_rows is None:
+            return None
+        return {
+            "column_names": self.meta["column_names"],
+            "data": [stock_rows],
+            "page": 1,
+            "stock_count": 1,
+            "has_signal": any(row[9] > 0 or row[-1] > 0 for row in stock_rows),
+            "date_range": self.meta["date_range"],
+            "return_info": self.get_return_info(ts_code),
+            "data_version": self.version
+        }
+
+
+def _chunks(view, size=JSON_CHUNK_SIZE):
+    """把一段映射内存按块复制为bytes（WSGI响应体只接受bytes）"""
+    for start in range(0, len(view), size):
+        yield bytes(view[start:start + size])
+
+def get_reader(path=SNAPSHOT_PATH, force=False):
+    """返回当前快照文件的读取器，文件被替换后自动切换到新版本
+
+    参数:
+    path: 快照文件路径
+    force: 忽略检查间隔，立即检查文件是否被替换（本进程刚写出新版本时使用）
+
+    返回:
+    SnapshotReader: 快照读取器，文件不存在时返回None
+    """
+    global _reader, _reader_key, _last_check
+    now = time.monotonic()
+    if _reader is not None and not force and now - _last_check < SNAPSHOT_CHECK_INTERVAL:
+        return _reader
+
+    with _reader_lock:
+        _last_check = now
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return _reader
+
+        key = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if key != _reader_key:
+            try:
+                _reader = SnapshotReader(path)
+                _reader_key = key
+            except Exception as e:
+                print(f"❌ 打开快照文件时出错: {str(e)}")
+        return _reader
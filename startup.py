@@ -0,0 +1,111 @@
+"""服务启动与后台预热
+
+服务进程先绑定端口开始接受请求，索引检查和快照预热在后台线程中执行。
+/healthz 只反映进程存活，/readyz 在信号股票快照加载完成后才返回就绪。
+"""
+import threading
+import time
+
+import db_utils
+import data_processor
+import panel_engine
+import storage
+
+# 首次计算时使用的默认批处理大小
+WARMUP_BATCH_SIZE = 100
+
+_status = {
+    "state": "starting",     # starting -> warming -> ready | failed
+    "started_at": time.time(),
+    "ready_at": None,
+    "indexes": None,
+    "error": None
+}
+_warmup_thread = None
+_warmup_lock = threading.Lock()
+
+def _warmup():
+    """后台预热：检查索引，然后加载（必要时首次计算）信号股票快照"""
+    _status["state"] = "warming"
+    try:
+        if storage.is_local():
+            # 本地SQLite存储的索引随表结构创建，不使用PostgreSQL的股票目录
+            _status["indexes"] = "ok"
+        else:
+            # high_level_inflows按月分区（首次运行时迁移），之后的查询都按trade_date裁剪分区
+            try:
+                db_utils.maintain_signal_partitions()
+            except Exception as e:
+                print(f"⚠️ 维护信号分区时出错: {str(e)}")
+            
+            # 创建数据库索引，提升后续查询速度；失败不影响快照加载
+            print("\n===== 后台预热: 正在创建/检查数据库索引... =====")
+            index_result = db_utils.create_database_indexes()
+            _status["indexes"] = "error" if "error" in index_result else "ok"
+            
+            # 加载股票目录（首次运行时构建）
+            try:
+                db_utils.get_stock_catalog()
+            except Exception as e:
+                print(f"⚠️ 加载股票目录时出错: {str(e)}")
+        
+        # 优先映射已有的快照文件，没有时再从数据库加载
+        print("后台预热: 正在加载信号股票快照...")
+        reader = data_processor.get_snapshot()
+        if reader is not None:
+            result = {"stock_count": reader.stock_count, "data_version": reader.version}
+            print(f"✓ 已映射快照文件版本 {reader.version}")
+        else:
+            result = data_processor.load_snapshot()
+        if "error" in result:
+            # 如果没有数据，则使用优化方式重新计算
+            print("⚠️ 数据库中没有找到数据，开始首次计算...")
+            if storage.is_local():
+                # 本地存储只支持截面计算
+                result = panel_engine.compute_stocks_data_panel(force_recompute=True)
+            else:
+                print(f"使用优化计算函数，批处理大小: {WARMUP_BATCH_SIZE}")
+                result = data_processor.compute_stocks_data_optimized(force_recompute=True, batch_size=WARMUP_BATCH_SIZE)
+        
+        if "error" in result:
+            _status["state"] = "failed"
+            _status["error"] = result["error"]
+            print(f"❌ 后台预热失败: {result['error']}")
+            return
+        
+        _status["state"] = "ready"
+        _status["ready_at"] = time.time()
+        print(f"\n===== 后台预热完成，已加载 {result.get('stock_count', 0)} 只股票的数据，服务准备就绪 =====")
+    except Exception as e:
+        _status["state"] = "failed"
+        _status["error"] = str(e)
+        print(f"❌ 后台预热时出错: {str(e)}")
+
+def warmup():
+    """在当前线程中完成预热（prefork服务的父进程在派生工作进程前调用）
+
+    返回:
+    bool: 快照是否已加载
+    """
+    _warmup()
+    return _status["state"] == "ready"
+
+def start_background_warmup():
+    """启动后台预热线程（重复调用只启动一次）"""
+    global _warmup_thread
+    with _warmup_lock:
+        if _warmup_thread is None:
+            _warmup_thread = threading.Thread(target=_warmup, name="warmup", daemon=True)
+            _warmup_thread.start()
+    return _warmup_thread
+
+def is_ready():
+    """信号股票快照是否已加载"""
+    return data_processor.get_snapshot() is not None
+
+def get_status():
+    """返回启动状态信息"""
+    status = dict(_status)
+    status["ready"] = is_ready()
+    status["uptime_seconds"] = round(time.time() - _status["started_at"], 3)
+    return status
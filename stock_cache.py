@@ -0,0 +1,99 @@
+"""单只股票响应的LRU/TTL缓存
+
+缓存按(ts_code, 数据版本)命中。快照切换到新版本后，缓存项不会整体失效：
+通过快照文件中的change_log检查该股票在两个版本之间是否变化，未变化的缓存项
+直接升级到新版本继续命中，只有变化或实时写入过的股票（或交易日窗口移动时的全部股票）重新加载。
+不在快照中的股票（无信号）从数据库加载，另由TTL限制其最长缓存时间。
+"""
+import threading
+import time
+from collections import OrderedDict
+
+# 最多缓存的股票数
+STOCK_CACHE_SIZE = 1000
+
+# 缓存项最长有效期（秒）
+STOCK_CACHE_TTL = 600
+
+
+class StockCache:
+    """线程安全的有界LRU缓存，每只股票只保留一个版本"""
+
+    def __init__(self, max_entries=STOCK_CACHE_SIZE, ttl=STOCK_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # ts_code -> (version, expires_at, result)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+    def get(self, ts_code, version, reader=None):
+        """查找缓存
+
+        参数:
+        ts_code: 股票代码
+        version: 当前数据版本
+        reader: 当前快照读取器，用于判断旧版本的缓存项能否升级
+
+        返回:
+        dict: 缓存的结果，未命中时返回None
+        """
+        with self._lock:
+            entry = self._entries.get(ts_code)
+            if entry is not None:
+                cached_version, expires_at, result = entry
+                if time.monotonic() > expires_at:
+                    entry = None
+                elif cached_version != version:
+                    changes = reader.changes_since(cached_version) if reader is not None else None
+                    if (changes is None or changes["window_changed"] or ts_code in changes["touched"]
+                            or ts_code in changes["added"] or ts_code in changes["changed"] or ts_code in changes["removed"]):
+                        entry = None
+                    else:
+                        result = dict(result, data_version=version)
+                        self._entries[ts_code] = (version, expires_at, result)
+                        self.revalidations += 1
+            if entry is None:
+                self._entries.pop(ts_code, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(ts_code)
+            self.hits += 1
+            return result
+
+    def put(self, ts_code, version, result):
+        """写入缓存，超过容量时淘汰最久未使用的股票"""
+        with self._lock:
+            self._entries[ts_code] = (version, time.monotonic() + self.ttl, result)
+            self._entries.move_to_end(ts_code)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, ts_codes):
+        """使指定股票的缓存失效"""
+        with self._lock:
+            for ts_code in ts_codes:
+                self._entries.pop(ts_code, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """返回命中率等统计信息"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidations": self.revalidations,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+# 单只股票接口使用的缓存
+single_stock_cache = StockCache()
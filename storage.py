@@ -0,0 +1,754 @@
+"""可替换的存储后端：刷新和快照加载通过Repository读写窗口数据、信号、统计和交易日历
+
+PostgresRepository直接调用db_utils中现有的查询（DB_CONFIG指向的数据库，含只读副本路由）。
+SqliteRepository把同样的表放在一个本地SQLite文件中，用于没有数据库服务器的本地运行、CI中的基准测试，
+以及边缘部署的嵌入式只读缓存（用sync命令从PostgreSQL复制最近的窗口）：
+- WAL模式：读取不阻塞写入，多个请求线程可以并发读
+- 覆盖索引：窗口读取按(ts_code, trade_date)定位，所需的列都在索引中，不回表
+- 批量写入：信号、策略信号用executemany一次提交，统计用INSERT ... SELECT整批重算
+
+STORAGE_BACKEND选择后端（可用环境变量STORAGE_BACKEND覆盖）。SQLite后端覆盖快照加载、截面刷新、
+单只/批量股票、各回看窗口的信号股票和收益率、全部股票列表、市场统计和影子比对。
+只有以下接口需要PostgreSQL，本地模式下返回501：非默认窗口的/api/leaderboard、/api/strategies/<id>/signals、
+/api/ingest、/api/index和/api/partitions。
+
+用法:
+    python storage.py sync --days 120      # 从PostgreSQL复制最近120个交易日到SQLITE_PATH
+    STORAGE_BACKEND=sqlite python run.py  # 本地模式运行服务
+"""
+import abc
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import db_utils
+
+# 使用的存储后端："postgresql" 或 "sqlite"
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "postgresql")
+
+# SQLite后端的数据库文件
+SQLITE_PATH = os.environ.get("SQLITE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'stocks.sqlite3'))
+
+# SQLite连接参数：等待写锁的秒数、页缓存（KB）和内存映射大小（字节）
+SQLITE_BUSY_TIMEOUT = 30
+SQLITE_CACHE_KB = 65536
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+
+# 一条IN (...)语句最多绑定的参数个数
+SQLITE_MAX_PARAMS = 900
+
+# sync默认复制的交易日数（覆盖最长的标准窗口）
+SYNC_DAYS = max(db_utils.STANDARD_WINDOWS)
+
+# sync每次从PostgreSQL读取的股票数
+SYNC_BATCH_SIZE = 500
+
+SQLITE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS all_stocks_days (
+        id INTEGER PRIMARY KEY,
+        ts_code TEXT NOT NULL,
+        trade_date TEXT NOT NULL,
+        open REAL, high REAL, low REAL, close REAL, pre_close REAL, pct_chg REAL, vol REAL,
+        bay REAL, ma120 REAL, ma250 REAL, name TEXT
+    );
+    -- 窗口读取的覆盖索引（id即rowid，包含在每个索引项中）
+    CREATE INDEX IF NOT EXISTS idx_all_stocks_days_window ON all_stocks_days
+        (ts_code, trade_date, open, high, low, close, pre_close, pct_chg, vol, bay, ma120, ma250, name);
+    -- 交易日历、窗口内股票列表和按日统计
+    CREATE INDEX IF NOT EXISTS idx_all_stocks_days_trade_date ON all_stocks_days (trade_date, ts_code);
+
+    CREATE TABLE IF NOT EXISTS high_level_inflows (
+        id INTEGER PRIMARY KEY,
+        all_stocks_days_id INTEGER NOT NULL UNIQUE,
+        buy REAL, sell REAL, earnings_rate REAL,
+        trade_date TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS strategy_signals (
+        strategy_id TEXT NOT NULL,
+        all_stocks_days_id INTEGER NOT NULL,
+        value REAL NOT NULL,
+        updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (strategy_id, all_stocks_days_id)
+    ) WITHOUT ROWID;
+
+    CREATE TABLE IF NOT EXISTS stock_window_stats (
+        ts_code TEXT NOT NULL,
+        window_days INTEGER NOT NULL,
+        start_date TEXT, end_date TEXT,
+        buy_count INTEGER, sell_count INTEGER, signal_count INTEGER,
+        avg_earnings_rate REAL, max_earnings_rate REAL,
+        last_signal_date TEXT, last_buy_date TEXT, last_sell_date TEXT,
+        PRIMARY KEY (ts_code, window_days)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS idx_stock_window_stats_window ON stock_window_stats
+        (window_days, start_date, signal_count, avg_earnings_rate);
+
+    CREATE TABLE IF NOT EXISTS market_breadth (
+        trade_date TEXT PRIMARY KEY,
+        active_tickers INTEGER, buy_count INTEGER, sell_count INTEGER, signal_count INTEGER,
+        avg_earnings_rate REAL,
+        updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+    ) WITHOUT ROWID;
+"""
+
+SQLITE_LATEST_DATES_SQL = """
+    SELECT DISTINCT trade_date
+    FROM all_stocks_days
+    ORDER BY trade_date DESC
+    LIMIT ?
+"""
+
+SQLITE_FETCH_WINDOW_SQL = """
+    SELECT ts_code, trade_date, open, high, low, close, pre_close, pct_chg, vol, bay, ma120, ma250, name, id
+    FROM all_stocks_days
+    WHERE ts_code IN ({placeholders}) AND trade_date >= ?
+    ORDER BY ts_code, trade_date
+"""
+
+SQLITE_BATCH_STOCK_WINDOW_SQL = f"""
+    SELECT {db_utils.STOCK_WINDOW_COLUMNS}
+    FROM all_stocks_days a
+    LEFT JOIN high_level_inflows h ON a.id = h.all_stocks_days_id
+    WHERE a.ts_code IN ({{placeholders}}) AND a.trade_date >= ?
+    ORDER BY a.ts_code, a.trade_date
+"""
+
+SQLITE_BATCH_STOCK_RETURN_SQL = """
+    SELECT a.ts_code, AVG(h.earnings_rate), COUNT(h.id)
+    FROM high_level_inflows h
+    JOIN all_stocks_days a ON h.all_stocks_days_id = a.id
+    WHERE a.ts_code IN ({placeholders}) AND a.trade_date >= ? AND (h.buy > 0 OR h.sell > 0)
+    GROUP BY a.ts_code
+"""
+
+SQLITE_UPSERT_SIGNALS_SQL = """
+    INSERT INTO high_level_inflows (all_stocks_days_id, trade_date, buy, sell, earnings_rate)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (all_stocks_days_id) DO UPDATE SET
+        buy = excluded.buy, sell = excluded.sell, earnings_rate = excluded.earnings_rate
+"""
+
+SQLITE_UPSERT_STRATEGY_SIGNALS_SQL = """
+    INSERT INTO strategy_signals (strategy_id, all_stocks_days_id, value)
+    VALUES (?, ?, ?)
+    ON CONFLICT (strategy_id, all_stocks_days_id) DO UPDATE SET
+        value = excluded.value,
+        updated_at = CURRENT_TIMESTAMP
+    WHERE strategy_signals.value IS NOT excluded.value
+"""
+
+# INSERT ... SELECT ... ON CONFLICT中的SELECT必须带WHERE子句，否则ON会被解析为连接条件
+SQLITE_REFRESH_WINDOW_STATS_SQL = """
+    INSERT INTO stock_window_stats (ts_code, window_days, start_date, end_date, buy_count, sell_count,
+                                    signal_count, avg_earnings_rate, max_earnings_rate,
+                                    last_signal_date, last_buy_date, last_sell_date)
+    SELECT c.ts_code, ?, ?, ?,
+           COUNT(h.id) FILTER (WHERE h.buy > 0), COUNT(h.id) FILTER (WHERE h.sell > 0), COUNT(h.id),
+           COALESCE(AVG(h.earnings_rate), 0), COALESCE(MAX(h.earnings_rate), 0),
+           MAX(a.trade_date) FILTER (WHERE h.id IS NOT NULL),
+           MAX(a.trade_date) FILTER (WHERE h.buy > 0), MAX(a.trade_date) FILTER (WHERE h.sell > 0)
+    FROM temp.refresh_codes c
+    LEFT JOIN all_stocks_days a ON a.ts_code = c.ts_code AND a.trade_date >= ?
+    LEFT JOIN high_level_inflows h ON h.all_stocks_days_id = a.id AND (h.buy > 0 OR h.sell > 0)
+    WHERE TRUE
+    GROUP BY c.ts_code
+    ON CONFLICT (ts_code, window_days) DO UPDATE SET
+        start_date = excluded.start_date,
+        end_date = excluded.end_date,
+        buy_count = excluded.buy_count,
+        sell_count = excluded.sell_count,
+        signal_count = excluded.signal_count,
+        avg_earnings_rate = excluded.avg_earnings_rate,
+        max_earnings_rate = excluded.max_earnings_rate,
+        last_signal_date = excluded.last_signal_date,
+        last_buy_date = excluded.last_buy_date,
+        last_sell_date = excluded.last_sell_date
+"""
+
+SQLITE_REFRESH_MARKET_BREADTH_SQL = """
+    INSERT INTO market_breadth (trade_date, active_tickers, buy_count, sell_count, signal_count, avg_earnings_rate, updated_at)
+    SELECT a.trade_date, COUNT(DISTINCT a.ts_code),
+           COUNT(h.id) FILTER (WHERE h.buy > 0), COUNT(h.id) FILTER (WHERE h.sell > 0),
+           COUNT(h.id) FILTER (WHERE h.buy > 0 OR h.sell > 0),
+           COALESCE(AVG(h.earnings_rate) FILTER (WHERE h.buy > 0 OR h.sell > 0), 0), CURRENT_TIMESTAMP
+    FROM all_stocks_days a
+    LEFT JOIN high_level_inflows h ON h.all_stocks_days_id = a.id
+    WHERE a.trade_date >= ?
+    GROUP BY a.trade_date
+    ON CONFLICT (trade_date) DO UPDATE SET
+        active_tickers = excluded.active_tickers,
+        buy_count = excluded.buy_count,
+        sell_count = excluded.sell_count,
+        signal_count = excluded.signal_count,
+        avg_earnings_rate = excluded.avg_earnings_rate,
+        updated_at = excluded.updated_at
+"""
+
+# MAX()聚合时SQLite的裸列取自最大值所在的行，即每只股票最后一个交易日的名称
+SQLITE_WINDOW_STOCKS_SQL = """
+    SELECT ts_code, name, MAX(trade_date)
+    FROM all_stocks_days
+    WHERE trade_date >= ?
+    GROUP BY ts_code
+    ORDER BY ts_code
+"""
+
+SQLITE_PRECOMPUTED_WINDOW_STATS_SQL = db_utils.PRECOMPUTED_WINDOW_STATS_SQL.replace("%s", "?")
+SQLITE_WINDOW_SIGNAL_STATS_SQL = db_utils.WINDOW_SIGNAL_STATS_SQL.replace("%s", "?")
+SQLITE_MARKET_BREADTH_SQL = db_utils.MARKET_BREADTH_SQL.replace("%s", "?")
+
+
+def _chunks(items, size=SQLITE_MAX_PARAMS):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def _placeholders(count):
+    return ", ".join("?" * count)
+
+def _window_dates(dates):
+    """由降序的交易日列表得到各标准窗口的起止交易日，与prepare_window_stats的结果相同"""
+    if not dates:
+        return {}
+    return {days: (dates[min(days, len(dates)) - 1], dates[0]) for days in db_utils.STANDARD_WINDOWS}
+
+def _market_breadth_result(rows):
+    return {
+        "market_breadth": [
+            {
+                "trade_date": trade_date,
+                "active_tickers": active_tickers,
+                "buy_count": buy_count,
+                "sell_count": sell_count,
+                "signal_count": signal_count,
+                "avg_earnings_rate": avg_earnings_rate
+            }
+            for trade_date, active_tickers, buy_count, sell_count, signal_count, avg_earnings_rate in rows
+        ],
+        "days": len(rows)
+    }
+
+
+class Repository(abc.ABC):
+    """存储后端接口
+
+    读取方法各自使用独立的连接（或事务）；刷新的写入在transaction()返回的写入器上执行，
+    退出with块时一起提交，出错时回滚。
+    """
+
+    name = None
+
+    @abc.abstractmethod
+    def latest_trading_dates(self, limit=db_utils.TRADING_DAYS_LIMIT):
+        """交易日历：最近limit个交易日（降序），出错时返回空列表"""
+
+    @abc.abstractmethod
+    def prepare_refresh(self):
+        """刷新开始时调用：准备统计表，返回{window_days: (start_date, end_date)}"""
+
+    @abc.abstractmethod
+    def window_ts_codes(self, start_date):
+        """窗口内有交易数据的股票代码列表（按代码排序）"""
+
+    @abc.abstractmethod
+    def fetch_window(self, ts_codes, start_date):
+        """一批股票在窗口内的原始数据，格式同db_utils.fetch_stocks_window"""
+
+    @abc.abstractmethod
+    def transaction(self):
+        """返回上下文管理器，得到提供upsert_signals、upsert_strategy_signals、
+        refresh_window_stats、refresh_market_breadth的写入器"""
+
+    @abc.abstractmethod
+    def window_signal_stats(self, days, start_date):
+        """窗口内有信号的股票 {ts_code: (signal_count, avg_return_rate)}"""
+
+    @abc.abstractmethod
+    def stocks_with_signals(self, days=db_utils.TRADING_DAYS_LIMIT):
+        """有买卖点信号的股票数据（快照内容），格式同db_utils.get_stocks_with_signals_from_db"""
+
+    @abc.abstractmethod
+    def single_stock(self, ts_code, days=db_utils.TRADING_DAYS_LIMIT):
+        """单只股票在窗口内的数据和收益率，格式同db_utils.get_single_stock_data"""
+
+    @abc.abstractmethod
+    def multiple_stocks(self, ts_codes):
+        """多只股票在默认窗口内的数据 {ts_code: 单只股票结果}，格式同db_utils.get_multiple_stocks_data"""
+
+    @abc.abstractmethod
+    def window_returns(self, days):
+        """窗口内有信号股票的收益率统计，格式同db_utils.get_window_returns"""
+
+    @abc.abstractmethod
+    def all_stocks_info(self):
+        """默认窗口内有交易的全部股票，格式同db_utils.get_all_stocks_info"""
+
+    @abc.abstractmethod
+    def market_breadth(self, start_date=None, end_date=None):
+        """全市场每日信号统计，格式同db_utils.get_market_breadth"""
+
+
+class PostgresWriter:
+    """PostgreSQL事务中的写入操作（调用db_utils中的对应函数）"""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def upsert_signals(self, signals, changed=None):
+        return db_utils.upsert_signals(self.cursor, signals, changed)
+
+    def upsert_strategy_signals(self, signals):
+        return db_utils.upsert_strategy_signals(self.cursor, signals)
+
+    def refresh_window_stats(self, ts_codes, window_dates):
+        db_utils.refresh_window_stats(self.cursor, ts_codes, window_dates)
+
+    def refresh_market_breadth(self, start_date):
+        db_utils.refresh_market_breadth(self.cursor, start_date)
+
+
+class PostgresRepository(Repository):
+    """现有的PostgreSQL存储（DB_CONFIG和DB_REPLICAS）"""
+
+    name = "postgresql"
+
+    def latest_trading_dates(self, limit=db_utils.TRADING_DAYS_LIMIT):
+        return db_utils.get_latest_trading_dates(limit)
+
+    def prepare_refresh(self):
+        db_utils.sync_stock_catalog()
+        return db_utils.prepare_window_stats()
+
+    def window_ts_codes(self, start_date):
+        return db_utils.get_window_ts_codes(start_date)
+
+    def fetch_window(self, ts_codes, start_date):
+        with db_utils.get_read_connection() as conn:
+            cursor = conn.cursor()
+            stocks_data = db_utils.fetch_stocks_window(cursor, ts_codes, start_date)
+            cursor.close()
+        return stocks_data
+
+    @contextmanager
+    def transaction(self):
+        with db_utils.get_float_connection() as conn:
+            cursor = conn.cursor()
+            try:
+                yield PostgresWriter(cursor)
+                conn.commit()
+            finally:
+                cursor.close()
+
+    def window_signal_stats(self, days, start_date):
+        with db_utils.get_read_connection() as conn:
+            cursor = conn.cursor()
+            stats = db_utils.get_window_signal_stats(cursor, days, start_date)
+            cursor.close()
+        return stats
+
+    def stocks_with_signals(self, days=db_utils.TRADING_DAYS_LIMIT):
+        return db_utils.get_stocks_with_signals_from_db(days)
+
+    def single_stock(self, ts_code, days=db_utils.TRADING_DAYS_LIMIT):
+        return db_utils.get_single_stock_data(ts_code, days)
+
+    def multiple_stocks(self, ts_codes):
+        return db_utils.get_multiple_stocks_data(ts_codes)
+
+    def window_returns(self, days):
+        return db_utils.get_window_returns(days)
+
+    def all_stocks_info(self):
+        return db_utils.get_all_stocks_info()
+
+    def market_breadth(self, start_date=None, end_date=None):
+        return db_utils.get_market_breadth(start_date, end_date)
+
+
+class SqliteWriter:
+    """SQLite事务中的写入操作"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def upsert_signals(self, signals, changed=None):
+        """批量写入买卖点信号，只改写新增或取值变化的行，返回实际写入的行数
+
+        与PostgreSQL后端相同，all_stocks_days中找不到的id被跳过并报告，不写入trade_date为空的信号行。
+        """
+        if not signals:
+            return 0
+        signals = [tuple(signal) for signal in signals]
+        existing = {}
+        trade_dates = {}
+        for chunk in _chunks([signal[0] for signal in signals]):
+            rows = self.conn.execute(f"""
+                SELECT all_stocks_days_id, buy, sell, earnings_rate FROM high_level_inflows
+                WHERE all_stocks_days_id IN ({_placeholders(len(chunk))})
+            """, chunk)
+            existing.update((row[0], tuple(row[1:])) for row in rows)
+            rows = self.conn.execute(f"""
+                SELECT id, trade_date FROM all_stocks_days WHERE id IN ({_placeholders(len(chunk))})
+            """, chunk)
+            trade_dates.update(rows)
+        missing = [signal[0] for signal in signals if signal[0] not in trade_dates]
+        if missing:
+            print(f"⚠️ 跳过 {len(missing)} 条找不到对应行情的信号，例如id {missing[:5]}")
+        modified = [signal for signal in signals
+                    if signal[0] in trade_dates and existing.get(signal[0]) != signal[1:]]
+        if changed is not None:
+            changed.extend(modified)
+        self.conn.executemany(SQLITE_UPSERT_SIGNALS_SQL,
+                              [(signal[0], trade_dates[signal[0]]) + signal[1:] for signal in modified])
+        return len(modified)
+
+    def upsert_strategy_signals(self, signals):
+        if not signals:
+            return 0
+        before = self.conn.total_changes
+        self.conn.executemany(SQLITE_UPSERT_STRATEGY_SIGNALS_SQL, signals)
+        return self.conn.total_changes - before
+
+    def refresh_window_stats(self, ts_codes, window_dates):
+        if not ts_codes:
+            return
+        self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS refresh_codes (ts_code TEXT PRIMARY KEY)")
+        self.conn.execute("DELETE FROM temp.refresh_codes")
+        self.conn.executemany("INSERT OR IGNORE INTO temp.refresh_codes VALUES (?)", ((ts_code,) for ts_code in ts_codes))
+        for days, (start_date, end_date) in window_dates.items():
+            self.conn.execute(SQLITE_REFRESH_WINDOW_STATS_SQL, (days, start_date, end_date, start_date))
+
+    def refresh_market_breadth(self, start_date):
+        """重新统计start_date之后每个交易日的全市场信号数，表为空时统计全部历史交易日"""
+        if self.conn.execute("SELECT NOT EXISTS(SELECT 1 FROM market_breadth)").fetchone()[0]:
+            start_date = ""
+        self.conn.execute(SQLITE_REFRESH_MARKET_BREADTH_SQL, (start_date,))
+
+
+class SqliteRepository(Repository):
+    """本地SQLite文件存储，每个线程一个连接，写入由进程内的锁串行化"""
+
+    name = "sqlite"
+
+    def __init__(self, path=None):
+        self.path = path or SQLITE_PATH
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._pid = None
+
+    def _connection(self):
+        # fork出的子进程不能沿用父进程的连接
+        if self._pid != os.getpid():
+            self._local = threading.local()
+            self._pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute("PRAGMA temp_store = MEMORY")
+            conn.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_KB}")
+            conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+            conn.executescript(SQLITE_SCHEMA)
+            # 早期创建的文件中信号行没有trade_date列
+            if "trade_date" not in {row[1] for row in conn.execute("PRAGMA table_info(high_level_inflows)")}:
+                conn.execute("ALTER TABLE high_level_inflows ADD COLUMN trade_date TEXT")
+                conn.execute("""
+                    UPDATE high_level_inflows
+                    SET trade_date = (SELECT trade_date FROM all_stocks_days WHERE id = all_stocks_days_id)
+                """)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _read(self):
+        """只读事务：WAL模式下事务内的多条查询看到同一个数据版本"""
+        conn = self._connection()
+        conn.execute("BEGIN")
+        try:
+            yield conn
+        finally:
+            conn.execute("COMMIT")
+
+    @contextmanager
+    def transaction(self):
+        with self._write_lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield SqliteWriter(conn)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def close(self):
+        """关闭当前线程的连接"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._pid == os.getpid():
+            conn.close()
+        self._local.conn = None
+
+    def latest_trading_dates(self, limit=db_utils.TRADING_DAYS_LIMIT):
+        try:
+            return [row[0] for row in self._connection().execute(SQLITE_LATEST_DATES_SQL, (limit,))]
+        except sqlite3.Error as e:
+            print(f"获取交易日期时出错: {str(e)}")
+            return []
+
+    def prepare_refresh(self):
+        self._connection()
+        return _window_dates(self.latest_trading_dates(max(db_utils.STANDARD_WINDOWS)))
+
+    def window_ts_codes(self, start_date):
+        rows = self._connection().execute("""
+            SELECT DISTINCT ts_code FROM all_stocks_days WHERE trade_date >= ? ORDER BY ts_code
+        """, (start_date,))
+        return [row[0] for row in rows]
+
+    def fetch_window(self, ts_codes, start_date):
+        stocks_data = {}
+        with self._read() as conn:
+            for chunk in _chunks(ts_codes):
+                sql = SQLITE_FETCH_WINDOW_SQL.format(placeholders=_placeholders(len(chunk)))
+                for row in conn.execute(sql, chunk + [start_date]):
+                    stocks_data.setdefault(row[0], []).append(row)
+        return stocks_data
+
+    def _window_signal_stats(self, conn, days, start_date):
+        ready = days in db_utils.STANDARD_WINDOWS and conn.execute("""
+            SELECT EXISTS(SELECT 1 FROM stock_window_stats WHERE window_days = ? AND start_date = ?)
+        """, (days, start_date)).fetchone()[0]
+        if ready:
+            rows = conn.execute(SQLITE_PRECOMPUTED_WINDOW_STATS_SQL, (days, start_date))
+        else:
+            rows = conn.execute(SQLITE_WINDOW_SIGNAL_STATS_SQL, (start_date, start_date))
+        return {row[0]: (row[1] or 0, row[2] or 0.0) for row in rows}
+
+    def window_signal_stats(self, days, start_date):
+        with self._read() as conn:
+            return self._window_signal_stats(conn, days, start_date)
+
+    def stocks_with_signals(self, days=db_utils.TRADING_DAYS_LIMIT):
+        try:
+            print(f"正在从SQLite读取信号股票数据: {self.path}")
+            with self._read() as conn:
+                latest_dates = [row[0] for row in conn.execute(SQLITE_LATEST_DATES_SQL, (days,))]
+                if not latest_dates:
+                    print("❌ 错误: 无法获取最近交易日期")
+                    return {"error": "无法获取最近交易日期"}
+                total_stocks = conn.execute("SELECT COUNT(DISTINCT ts_code) FROM all_stocks_days").fetchone()[0]
+                signal_stats = self._window_signal_stats(conn, days, latest_dates[-1])
+                if not signal_stats:
+                    print("❌ 没有找到有信号的股票")
+                    return {"error": "没有找到有信号的股票"}
+                rows_by_code = {}
+                for chunk in _chunks(sorted(signal_stats)):
+                    sql = SQLITE_BATCH_STOCK_WINDOW_SQL.format(placeholders=_placeholders(len(chunk)))
+                    for row in conn.execute(sql, chunk + [latest_dates[-1]]):
+                        rows_by_code.setdefault(row[0], []).append(row)
+            result = db_utils.build_signal_stocks_result(latest_dates, total_stocks, signal_stats, rows_by_code)
+            print(f"✅ 数据加载完成！共加载了 {result['stock_count']} 只股票的数据")
+            return result
+        except sqlite3.Error as e:
+            print(f"❌ 从SQLite获取股票数据时出错: {str(e)}")
+            return {"error": str(e)}
+
+    def _stocks_data(self, ts_codes, days):
+        """多只股票的窗口行和收益率，没有数据的股票对应{"error": ...}"""
+        with self._read() as conn:
+            latest_dates = [row[0] for row in conn.execute(SQLITE_LATEST_DATES_SQL, (days,))]
+            if not latest_dates:
+                return {"error": "无法获取最近交易日期"}
+            rows_by_code = {}
+            returns_by_code = {}
+            for chunk in _chunks(ts_codes):
+                placeholders = _placeholders(len(chunk))
+                for row in conn.execute(SQLITE_BATCH_STOCK_WINDOW_SQL.format(placeholders=placeholders), chunk + [latest_dates[-1]]):
+                    rows_by_code.setdefault(row[0], []).append(row)
+                for row in conn.execute(SQLITE_BATCH_STOCK_RETURN_SQL.format(placeholders=placeholders), chunk + [latest_dates[-1]]):
+                    returns_by_code[row[0]] = row
+        return db_utils.build_stocks_results(ts_codes, rows_by_code, returns_by_code, latest_dates)
+
+    def single_stock(self, ts_code, days=db_utils.TRADING_DAYS_LIMIT):
+        try:
+            results = self._stocks_data([ts_code], days)
+        except sqlite3.Error as e:
+            return {"error": str(e)}
+        return results.get(ts_code, results)
+
+    def multiple_stocks(self, ts_codes):
+        try:
+            return self._stocks_data(list(ts_codes), db_utils.TRADING_DAYS_LIMIT)
+        except sqlite3.Error as e:
+            return {"error": str(e)}
+
+    def window_returns(self, days):
+        try:
+            with self._read() as conn:
+                latest_dates = [row[0] for row in conn.execute(SQLITE_LATEST_DATES_SQL, (days,))]
+                if not latest_dates:
+                    return {"error": "无法获取最近交易日期"}
+                signal_stats = self._window_signal_stats(conn, days, latest_dates[-1])
+                # 本地存储没有股票目录，名称取窗口内的行情
+                names = dict(conn.execute("""
+                    SELECT ts_code, MAX(name) FROM all_stocks_days WHERE trade_date >= ? GROUP BY ts_code
+                """, (latest_dates[-1],)))
+            return db_utils.build_window_returns_result(latest_dates, signal_stats, names)
+        except sqlite3.Error as e:
+            return {"error": str(e)}
+
+    def market_breadth(self, start_date=None, end_date=None):
+        try:
+            with self._read() as conn:
+                first_date, last_date = conn.execute("SELECT MIN(trade_date), MAX(trade_date) FROM market_breadth").fetchone()
+                if first_date is None:
+                    return {"error": "市场统计尚未生成，请先刷新数据"}
+                rows = conn.execute(SQLITE_MARKET_BREADTH_SQL, (start_date or first_date, end_date or last_date)).fetchall()
+            return _market_breadth_result(rows)
+        except sqlite3.Error as e:
+            return {"error": str(e)}
+
+    def all_stocks_info(self):
+        try:
+            with self._read() as conn:
+                latest_dates = [row[0] for row in conn.execute(SQLITE_LATEST_DATES_SQL, (db_utils.TRADING_DAYS_LIMIT,))]
+                if not latest_dates:
+                    return {"error": "无法获取最近交易日期"}
+                database_total = conn.execute("SELECT COUNT(DISTINCT ts_code) FROM all_stocks_days").fetchone()[0]
+                # 本地存储没有股票目录，名称取窗口内最后一个交易日的行情
+                rows = conn.execute(SQLITE_WINDOW_STOCKS_SQL, (latest_dates[-1],)).fetchall()
+        except sqlite3.Error as e:
+            return {"error": str(e)}
+        stocks = [{"ts_code": ts_code, "name": name} for ts_code, name, _ in rows]
+        return {
+            "stocks": stocks,
+            "total_count": len(stocks),
+            "database_total": database_total,
+            "date_range": {
+                "start": latest_dates[-1],
+                "end": latest_dates[0],
+                "days": len(latest_dates)
+            }
+        }
+
+
+# 可选的存储后端
+BACKENDS = {
+    "postgresql": PostgresRepository,
+    "sqlite": SqliteRepository
+}
+
+_repository = None
+_repository_lock = threading.Lock()
+
+def get_repository():
+    """按STORAGE_BACKEND返回进程内共享的存储后端"""
+    global _repository
+    if _repository is None:
+        with _repository_lock:
+            if _repository is None:
+                if STORAGE_BACKEND not in BACKENDS:
+                    raise ValueError(f"未知的存储后端: {STORAGE_BACKEND}，可选: {', '.join(BACKENDS)}")
+                _repository = BACKENDS[STORAGE_BACKEND]()
+    return _repository
+
+def is_local():
+    """当前是否使用本地SQLite存储（只支持截面刷新，不启动定时刷新）"""
+    return get_repository().name == "sqlite"
+
+
+def sync_from_postgres(days=SYNC_DAYS, path=None, batch_size=SYNC_BATCH_SIZE):
+    """把PostgreSQL中最近days个交易日的数据、信号和统计复制到SQLite文件（整体替换）
+
+    返回:
+    dict: 复制的行数，出错时包含error字段
+    """
+    source = PostgresRepository()
+    target = SqliteRepository(path)
+    latest_dates = source.latest_trading_dates(days)
+    if not latest_dates:
+        return {"error": "无法获取最近交易日期"}
+    start_date = latest_dates[-1]
+    print(f"正在复制 {start_date} 到 {latest_dates[0]} 的数据到 {target.path}")
+
+    started = time.perf_counter()
+    counts = {}
+    with target.transaction() as tx:
+        for table in ("all_stocks_days", "high_level_inflows", "strategy_signals", "stock_window_stats", "market_breadth"):
+            tx.conn.execute(f"DELETE FROM {table}")
+
+        ts_codes = source.window_ts_codes(start_date)
+        counts["all_stocks_days"] = 0
+        for batch_start in range(0, len(ts_codes), batch_size):
+            stocks_data = source.fetch_window(ts_codes[batch_start:batch_start + batch_size], start_date)
+            rows = [(row[-1],) + tuple(row[:-1]) for stock_data in stocks_data.values() for row in stock_data]
+            tx.conn.executemany("""
+                INSERT INTO all_stocks_days (id, ts_code, trade_date, open, high, low, close, pre_close, pct_chg, vol,
+                                             bay, ma120, ma250, name)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, rows)
+            counts["all_stocks_days"] += len(rows)
+
+        with db_utils.get_read_connection() as conn:
+            cursor = conn.cursor()
+            copies = (
+                ("high_level_inflows", """
+                    SELECT id, all_stocks_days_id, buy, sell, earnings_rate, trade_date
+                    FROM high_level_inflows
+                    WHERE trade_date >= %s
+                """, (start_date,)),
+                ("strategy_signals", """
+                    SELECT s.strategy_id, s.all_stocks_days_id, s.value
+                    FROM strategy_signals s JOIN all_stocks_days a ON a.id = s.all_stocks_days_id
+                    WHERE a.trade_date >= %s
+                """, (start_date,)),
+                ("stock_window_stats", """
+                    SELECT ts_code, window_days, start_date, end_date, buy_count, sell_count, signal_count,
+                           avg_earnings_rate, max_earnings_rate, last_signal_date, last_buy_date, last_sell_date
+                    FROM stock_window_stats
+                """, None),
+                ("market_breadth", """
+                    SELECT trade_date, active_tickers, buy_count, sell_count, signal_count, avg_earnings_rate
+                    FROM market_breadth
+                """, None)
+            )
+            for table, sql, params in copies:
+                cursor.execute(sql, params)
+                rows = cursor.fetchall()
+                columns = [column[0] for column in cursor.description]
+                tx.conn.executemany(
+                    f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({_placeholders(len(columns))})", rows)
+                counts[table] = len(rows)
+            cursor.close()
+
+    print(f"✓ 复制完成，{time.perf_counter() - started:.3f}秒: {counts}")
+    return {"path": target.path, "start_date": start_date, "end_date": latest_dates[0], "rows": counts}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="存储后端工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    sync_parser = subparsers.add_parser("sync", help="从PostgreSQL复制最近的窗口到SQLite文件")
+    sync_parser.add_argument("--days", type=int, default=SYNC_DAYS, help="复制的交易日数")
+    sync_parser.add_argument("--path", default=None, help=f"SQLite文件，默认为 {SQLITE_PATH}")
+    args = parser.parse_args(argv)
+
+    if args.command == "sync":
+        result = sync_from_postgres(args.days, args.path)
+        if "error" in result:
+            print(f"❌ 复制失败: {result['error']}")
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""插件策略注册表：在刷新读取的同一批窗口数据上计算额外的选股策略
+
+signal_calculator的买入、高位资金净流出信号写入high_level_inflows的固定列；
+其他策略在这里注册，每个策略声明需要的列（见db_utils.WINDOW_COLUMN_POSITIONS）和回看行数，
+并提供整矩阵评估函数。刷新时每批股票只读取一次窗口数据，按所有策略需要的列的并集构建一个面板，
+依次运行全部策略，结果按策略id写入strategy_signals表。增加策略只增加计算，不增加数据库读取。
+
+评估函数的参数是{列名: 压紧后的矩阵}（每行一只股票，第j列是该股票窗口内的第j行，缺失为NaN），
+返回同形状的矩阵，大于0的位置为信号，取值作为信号价格写入数据库。
+"""
+from itertools import repeat
+
+import numpy as np
+
+import db_utils
+import panel_engine
+
+
+class Strategy:
+    """一个插件策略"""
+
+    def __init__(self, strategy_id, name, columns, lookback, evaluate, description=""):
+        self.strategy_id = strategy_id
+        self.name = name
+        self.columns = tuple(columns)
+        self.lookback = lookback
+        self.evaluate = evaluate
+        self.description = description
+
+    def to_dict(self):
+        return {
+            "strategy_id": self.strategy_id,
+            "name": self.name,
+            "columns": list(self.columns),
+            "lookback": self.lookback,
+            "description": self.description
+        }
+
+
+# 已注册的策略 {strategy_id: Strategy}，按注册顺序执行
+STRATEGIES = {}
+
+
+def register(strategy_id, name, columns, lookback, description=""):
+    """注册策略的装饰器
+
+    参数:
+    strategy_id: 策略id，作为strategy_signals.strategy_id写入
+    name: 显示名称
+    columns: 需要的数值列
+    lookback: 计算第j行时需要的之前的行数，窗口内下标小于lookback的行不产生信号
+    description: 策略说明
+    """
+    unknown = [column for column in columns if column not in db_utils.WINDOW_COLUMN_POSITIONS]
+    if unknown:
+        raise ValueError(f"策略 {strategy_id} 需要的列不存在: {', '.join(unknown)}")
+    if not 0 <= lookback < db_utils.TRADING_DAYS_LIMIT:
+        raise ValueError(f"策略 {strategy_id} 的回看行数必须小于刷新窗口 {db_utils.TRADING_DAYS_LIMIT}")
+    if strategy_id in STRATEGIES:
+        raise ValueError(f"策略 {strategy_id} 已注册")
+
+    def decorator(evaluate):
+        STRATEGIES[strategy_id] = Strategy(strategy_id, name, columns, lookback, evaluate, description)
+        return evaluate
+    return decorator
+
+def required_columns(base=()):
+    """所有已注册策略需要的列与base的并集"""
+    columns = list(base)
+    for strategy in STRATEGIES.values():
+        columns.extend(column for column in strategy.columns if column not in columns)
+    return tuple(columns)
+
+def evaluate_panel_strategies(panel):
+    """在一个面板上运行所有已注册策略
+
+    参数:
+    panel: panel_engine.Panel，至少包含required_columns()中的列
+
+    返回:
+    list: [(strategy_id, all_stocks_days_id, value), ...]
+    """
+    if not STRATEGIES or len(panel.trade_dates) == 0:
+        return []
+    values, ids, _ = panel.compact()
+    results = []
+    for strategy in STRATEGIES.values():
+        matrix = np.asarray(strategy.evaluate({column: values[column] for column in strategy.columns}), dtype=float)
+        matrix[:, :strategy.lookback] = 0.0
+        with np.errstate(invalid="ignore"):
+            rows, positions = np.nonzero(matrix > 0)
+        results.extend(zip(repeat(strategy.strategy_id), ids[rows, positions].tolist(), matrix[rows, positions].tolist()))
+    return results
+
+def evaluate_strategies(stocks_data):
+    """对一批股票的窗口数据（fetch_stocks_window的结果）运行所有已注册策略"""
+    if not STRATEGIES or not stocks_data:
+        return []
+    return evaluate_panel_strategies(panel_engine.Panel.from_stocks_data(stocks_data, required_columns()))
+
+
+def _shift(matrix):
+    """前一行的取值（第0列为NaN）"""
+    return np.concatenate([np.full((matrix.shape[0], 1), np.nan), matrix[:, :-1]], axis=1)
+
+
+@register("ma120_breakout", "站上半年线", columns=("close", "ma120", "ma250"), lookback=1,
+          description="收盘价由下向上穿过ma120，且ma120位于ma250之上（多头排列）")
+def ma120_breakout(values):
+    close, ma120, ma250 = values["close"], values["ma120"], values["ma250"]
+    with np.errstate(invalid="ignore"):
+        crossed = (close > ma120) & (_shift(close) <= _shift(ma120)) & (ma120 > ma250) & (ma250 > 0)
+    return np.where(crossed, close, 0.0)
+
+@register("ma250_breakdown", "跌破年线", columns=("close", "ma250"), lookback=1,
+          description="收盘价由上向下跌破ma250")
+def ma250_breakdown(values):
+    close, ma250 = values["close"], values["ma250"]
+    with np.errstate(invalid="ignore"):
+        crossed = (close < ma250) & (_shift(close) >= _shift(ma250)) & (ma250 > 0)
+    return np.where(crossed, close, 0.0)
@@ -0,0 +1,204 @@
+"""分布式刷新工作队列的测试：分片领取、租约过期后重新领取、租约被接管后回滚结果
+
+领取和租约的测试在真实的PostgreSQL上执行CLAIM_SHARD_SQL（FOR UPDATE SKIP LOCKED和租约时间只能由数据库验证），
+需要环境变量TEST_DB_DSN（libpq连接串，例如"host=127.0.0.1 user=postgres dbname=test"），未设置时跳过；
+表建在临时schema中，测试结束后删除。其余测试用假的连接，不连接数据库。
+
+用法:
+    TEST_DB_DSN="host=127.0.0.1 user=postgres dbname=test" python -m pytest tests
+"""
+import os
+import sys
+import unittest
+import uuid
+from contextlib import contextmanager
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+
+import db_utils
+import distributed_refresh
+
+TEST_DB_DSN = os.environ.get("TEST_DB_DSN")
+
+WINDOW_DATES = {days: ("20240101", "20240131") for days in db_utils.STANDARD_WINDOWS}
+
+
+def patch_shard_computation(test):
+    """把_process_shard中的计算和写入换成固定结果，只保留完成标记的UPDATE"""
+    patches = [
+        mock.patch.object(db_utils, "fetch_stocks_window", return_value={"000001.SZ": [], "000002.SZ": []}),
+        mock.patch.object(distributed_refresh.data_processor, "compute_stock_signals", return_value=[(1, 1.0, 0.0, 0.0)]),
+        mock.patch.object(distributed_refresh.strategies, "evaluate_strategies", return_value=[]),
+        mock.patch.object(db_utils, "upsert_signals", return_value=2),
+        mock.patch.object(db_utils, "upsert_strategy_signals", return_value=0),
+        mock.patch.object(db_utils, "refresh_window_stats")
+    ]
+    for patch in patches:
+        patch.start()
+        test.addCleanup(patch.stop)
+
+
+class FakeCursor:
+    """按顺序返回CLAIM_SHARD_SQL的领取结果，其余查询返回空"""
+
+    def __init__(self, claims, rowcount=1):
+        self.claims = list(claims)
+        self.rowcount = rowcount
+        self.row = None
+
+    def execute(self, sql, params=None):
+        if sql == distributed_refresh.CLAIM_SHARD_SQL:
+            self.row = self.claims.pop(0) if self.claims else None
+        elif "COUNT(*)" in sql:
+            self.row = (0,)
+        else:
+            self.row = None
+
+    def fetchone(self):
+        return self.row
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.calls = []
+
+    def cursor(self):
+        return self._cursor
+
+    def commit(self):
+        self.calls.append("commit")
+
+    def rollback(self):
+        self.calls.append("rollback")
+
+
+class LostLeaseTest(unittest.TestCase):
+
+    def setUp(self):
+        patch_shard_computation(self)
+
+    def test_process_shard_reports_lost_lease(self):
+        cursor = FakeCursor([], rowcount=0)
+        self.assertIsNone(distributed_refresh._process_shard(cursor, 1, 0, ["000001.SZ"], WINDOW_DATES, "worker-a"))
+
+    def test_run_worker_rolls_back_lost_lease(self):
+        conn = FakeConnection(FakeCursor([(0, ["000001.SZ"])]))
+
+        @contextmanager
+        def connection():
+            yield conn
+
+        with mock.patch.object(db_utils, "get_float_connection", connection), \
+                mock.patch.object(distributed_refresh, "_run_windows", return_value=WINDOW_DATES), \
+                mock.patch.object(distributed_refresh, "_process_shard", return_value=None) as process_shard:
+            processed = distributed_refresh.run_worker(run_id=1, worker_id="worker-a", poll_interval=0)
+        process_shard.assert_called_once()
+        self.assertEqual(processed["lost_leases"], 1)
+        self.assertEqual(processed["shards"], 0)
+        # 领取提交之后，分片结果被回滚而不是提交
+        claim_commit = conn.calls.index("commit", 1)
+        self.assertEqual(conn.calls[claim_commit + 1], "rollback")
+
+
+@unittest.skipUnless(TEST_DB_DSN, "需要TEST_DB_DSN指向测试用的PostgreSQL")
+class WorkQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.schema = f"test_distributed_{uuid.uuid4().hex[:8]}"
+        self.admin = psycopg2.connect(TEST_DB_DSN)
+        self.admin.autocommit = True
+        cursor = self.admin.cursor()
+        cursor.execute(f"CREATE SCHEMA {self.schema}")
+        cursor.execute(f"SET search_path TO {self.schema}")
+        cursor.execute("CREATE TABLE all_stocks_days (id BIGINT PRIMARY KEY, ts_code TEXT, trade_date TEXT)")
+        distributed_refresh.ensure_work_queue_tables(cursor)
+        cursor.execute("INSERT INTO refresh_runs (batch_size, shard_count) VALUES (1, 2) RETURNING run_id")
+        self.run_id = cursor.fetchone()[0]
+        cursor.executemany("INSERT INTO refresh_shards (run_id, shard_no, ts_codes) VALUES (%s, %s, %s)",
+                           [(self.run_id, 0, ["000001.SZ"]), (self.run_id, 1, ["000002.SZ"])])
+        cursor.close()
+        self.workers = []
+
+    def tearDown(self):
+        for conn in self.workers:
+            conn.close()
+        cursor = self.admin.cursor()
+        cursor.execute(f"DROP SCHEMA {self.schema} CASCADE")
+        self.admin.close()
+
+    def worker(self):
+        conn = psycopg2.connect(TEST_DB_DSN)
+        cursor = conn.cursor()
+        cursor.execute(f"SET search_path TO {self.schema}")
+        conn.commit()
+        self.workers.append(conn)
+        return conn
+
+    def claim(self, conn, worker_id, lease_seconds=distributed_refresh.LEASE_SECONDS):
+        cursor = conn.cursor()
+        cursor.execute(distributed_refresh.CLAIM_SHARD_SQL, (worker_id, lease_seconds, self.run_id))
+        claimed = cursor.fetchone()
+        cursor.close()
+        return claimed
+
+    def shard(self, shard_no):
+        cursor = self.admin.cursor()
+        cursor.execute("""
+            SELECT status, worker_id, attempts FROM refresh_shards WHERE run_id = %s AND shard_no = %s
+        """, (self.run_id, shard_no))
+        row = cursor.fetchone()
+        cursor.close()
+        return row
+
+    def test_claim_skips_locked_and_leased_shards(self):
+        first, second = self.worker(), self.worker()
+        # 第一个工作进程尚未提交时，第二个跳过被锁定的分片
+        self.assertEqual(self.claim(first, "worker-a"), (0, ["000001.SZ"]))
+        self.assertEqual(self.claim(second, "worker-b"), (1, ["000002.SZ"]))
+        first.commit()
+        second.commit()
+        self.assertEqual(self.shard(0), ("running", "worker-a", 1))
+        self.assertEqual(self.shard(1), ("running", "worker-b", 1))
+        # 租约未过期的分片不会被再次领取
+        self.assertIsNone(self.claim(self.worker(), "worker-c"))
+
+    def test_expired_lease_is_reclaimed(self):
+        first, second = self.worker(), self.worker()
+        self.assertEqual(self.claim(first, "worker-a", lease_seconds=-1)[0], 0)
+        first.commit()
+        self.assertEqual(self.claim(second, "worker-b")[0], 0)
+        second.commit()
+        self.assertEqual(self.shard(0), ("running", "worker-b", 2))
+
+    def test_lost_lease_result_is_not_marked_done(self):
+        patch_shard_computation(self)
+        first, second = self.worker(), self.worker()
+        self.claim(first, "worker-a", lease_seconds=-1)
+        first.commit()
+        self.claim(second, "worker-b")
+        second.commit()
+
+        cursor = first.cursor()
+        self.assertIsNone(distributed_refresh._process_shard(cursor, self.run_id, 0, ["000001.SZ"], WINDOW_DATES, "worker-a"))
+        first.rollback()
+        self.assertEqual(self.shard(0), ("running", "worker-b", 2))
+
+        stats = distributed_refresh._process_shard(second.cursor(), self.run_id, 0, ["000001.SZ"], WINDOW_DATES, "worker-b")
+        second.commit()
+        self.assertEqual(stats["rows_written"], 2)
+        self.assertEqual(self.shard(0), ("done", "worker-b", 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,175 @@
+"""实时写入增量状态的测试
+
+随机生成包含盘中替换（同一交易日多次写入）、停牌和窗口移动的K线序列逐根写入TickerState，
+每写入一根都与compute_stock_signals在当前窗口上的批量计算比较，信号必须逐位一致；
+另外构造均线与收盘价几乎相等的数据，检查滑动和落在误差范围内时按批量顺序重新求和。
+不连接数据库。
+
+用法:
+    python -m pytest tests
+"""
+import os
+import random
+import sys
+import unittest
+from datetime import date, timedelta
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import data_processor
+import db_utils
+import ingest
+
+TS_CODE = "000001.SZ"
+
+
+def batch_signals(state, window_start):
+    """当前窗口内的K线按批量计算得到的信号 {id: signal}，以及批量计算会写入的行id"""
+    bars = [bar for bar in state.bars if bar.trade_date >= window_start]
+    rows = [(TS_CODE, bar.trade_date, bar.close, bar.close, bar.close, bar.close, 0.0, 0.0, bar.vol,
+             0.0, 0.0, 0.0, "S", bar.id) for bar in bars]
+    signals = {signal[0]: signal for signal in data_processor.compute_stock_signals(rows)}
+    return signals, [bar.id for bar in bars[ingest.SIGNAL_WINDOW:]]
+
+
+class Replay:
+    """按交易日推进全市场窗口，把K线逐根写入TickerState"""
+
+    def __init__(self, seed, prices=None):
+        self.rng = random.Random(seed)
+        self.state = ingest.TickerState(TS_CODE)
+        self.dates = []
+        self.next_id = 0
+        self.price = 20.0
+        self.prices = prices
+
+    def window_start(self):
+        return self.dates[-min(db_utils.TRADING_DAYS_LIMIT, len(self.dates))]
+
+    def random_bar(self, trade_date, bar_id):
+        if self.prices is not None:
+            close = self.rng.choice(self.prices)
+        else:
+            self.price = round(self.price * (1 + self.rng.gauss(0, 0.04)), 2)
+            close = self.price
+        vol = self.rng.uniform(1e4, 1e6) * (3 if self.rng.random() < 0.3 else 1)
+        return ingest.Bar(trade_date, close, vol, bar_id)
+
+    def step(self):
+        """写入一根K线：替换当日K线、停牌一天或新交易日，返回(被替换的K线, 写入的信号)"""
+        bars = self.state.bars
+        if bars and self.rng.random() < 0.3:
+            bar = self.random_bar(bars[-1].trade_date, bars[-1].id)
+        else:
+            if self.rng.random() < 0.1:
+                self.dates.append((date(2024, 1, 2) + timedelta(days=len(self.dates))).strftime("%Y%m%d"))
+            self.dates.append((date(2024, 1, 2) + timedelta(days=len(self.dates))).strftime("%Y%m%d"))
+            self.next_id += 1
+            bar = self.random_bar(self.dates[-1], self.next_id)
+        return self.state.apply_bar(bar, self.window_start())
+
+
+class TickerStateTest(unittest.TestCase):
+
+    def assert_matches_batch(self, replay, written):
+        signals, recomputed = batch_signals(replay.state, replay.window_start())
+        by_id = {bar.id: bar for bar in replay.state.bars}
+        for bar_id in recomputed:
+            bar = by_id[bar_id]
+            self.assertEqual(bar.signal() if bar.has_signal else None, signals.get(bar_id))
+        # 写入的信号行都是批量计算会写入的取值
+        for signal in written:
+            self.assertEqual(signals.get(signal[0]), signal)
+
+    def test_replacements_match_batch_recompute(self):
+        for seed in range(20):
+            with self.subTest(seed=seed):
+                replay = Replay(seed)
+                for _ in range(200):
+                    _, written = replay.step()
+                    self.assert_matches_batch(replay, written)
+
+    def test_near_tie_moving_average(self):
+        # 收盘价只取少数几个十进制小数，均线经常与收盘价（或其0.95倍）相等或只差舍入误差
+        prices = [0.1, 0.2, 0.3, 0.7, 1.1, 3.3, 9.5, 10.0]
+        with mock.patch.object(ingest.TickerState, "_resync_sum", autospec=True,
+                               side_effect=ingest.TickerState._resync_sum) as resync:
+            for seed in range(20):
+                replay = Replay(seed, prices=prices)
+                for _ in range(200):
+                    _, written = replay.step()
+                    self.assert_matches_batch(replay, written)
+        # 至少有一部分比较落在误差范围内，走了按批量顺序重新求和的路径
+        self.assertGreater(resync.call_count, 20)
+
+    def test_running_sum_error_bound(self):
+        state = ingest.TickerState(TS_CODE)
+        start = "20240101"
+        closes = [1e9, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7]
+        for k, close in enumerate(closes):
+            state.apply_bar(ingest.Bar(f"202401{k + 1:02d}", close, 1.0, k + 1), start)
+        # 1e9移出后累计误差远大于剩余收盘价的舍入误差，已按窗口重新求和
+        self.assertEqual(state.ma_sum, sum(closes[-ingest.SIGNAL_WINDOW:]))
+
+    def test_state_loaded_from_database(self):
+        """从数据库读取的缓冲区（带已有信号）继续写入，与一直在内存中的状态结果相同"""
+        replay = Replay(seed=7)
+        for _ in range(60):
+            replay.step()
+        copied = [ingest.Bar(bar.trade_date, bar.close, bar.vol, bar.id, bar.buy, bar.sell, bar.earnings_rate)
+                  for bar in replay.state.bars]
+        # 数据库中的收益率可能来自窗口移动之前，第一次写入时完整检查一遍
+        for bar in copied:
+            if bar.sell > 0:
+                bar.earnings_rate = -1.0
+        replay.state = ingest.TickerState(TS_CODE, copied)
+        for _ in range(60):
+            _, written = replay.step()
+            self.assert_matches_batch(replay, written)
+
+    def test_earlier_bar_is_rejected(self):
+        state = ingest.TickerState(TS_CODE)
+        state.apply_bar(ingest.Bar("20240105", 10.0, 1.0, 1), "20240101")
+        with self.assertRaises(ValueError):
+            state.apply_bar(ingest.Bar("20240104", 10.0, 1.0, 2), "20240101")
+
+
+class PrepareTest(unittest.TestCase):
+    """整批K线在写入数据库之前校验"""
+
+    def setUp(self):
+        self.ingestor = ingest.SignalIngestor()
+        self.ingestor._dates = ingest.deque(["20240102", "20240103"])
+
+    def test_invalid_bar_rejects_whole_batch(self):
+        bars = [
+            {"ts_code": TS_CODE, "trade_date": "2024-01-04", "close": 10.0, "vol": 100, "name": "平安银行"},
+            {"ts_code": TS_CODE, "trade_date": "2024-01-05", "close": "abc", "vol": 100, "name": "平安银行"}
+        ]
+        with mock.patch.object(self.ingestor, "_write") as write:
+            with self.assertRaises(ValueError):
+                self.ingestor.ingest(bars)
+        write.assert_not_called()
+
+    def test_out_of_order_bars_are_rejected(self):
+        bars = [
+            {"ts_code": TS_CODE, "trade_date": "20240105", "close": 10.0, "vol": 100, "name": "平安银行"},
+            {"ts_code": TS_CODE, "trade_date": "20240104", "close": 10.0, "vol": 100, "name": "平安银行"}
+        ]
+        with self.assertRaises(ValueError):
+            self.ingestor._prepare(bars)
+
+    def test_fields_are_normalized(self):
+        prepared, by_code = self.ingestor._prepare([
+            {"ts_code": TS_CODE, "trade_date": "2024-01-04", "close": "10.5", "vol": 100, "open": 10, "name": "平安银行"}
+        ])
+        self.assertEqual(prepared[0]["trade_date"], "20240104")
+        self.assertEqual(prepared[0]["close"], 10.5)
+        self.assertEqual(prepared[0]["open"], 10.0)
+        self.assertIsNone(prepared[0]["high"])
+        self.assertEqual(list(by_code), [TS_CODE])
+
+
+if __name__ == "__main__":
+    unittest.main()
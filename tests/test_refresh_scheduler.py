@@ -0,0 +1,101 @@
+"""实时写入推进刷新指纹的测试
+
+record_ingest()在真实的PostgreSQL上执行（行锁和咨询锁只能由数据库验证），
+需要环境变量TEST_DB_DSN（libpq连接串，例如"host=127.0.0.1 user=postgres dbname=test"），未设置时跳过；
+表建在临时schema中，测试结束后删除。
+
+用法:
+    TEST_DB_DSN="host=127.0.0.1 user=postgres dbname=test" python -m pytest tests
+"""
+import os
+import sys
+import unittest
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+
+import db_utils
+import refresh_scheduler
+
+TEST_DB_DSN = os.environ.get("TEST_DB_DSN")
+
+WINDOW_START = "20240102"
+
+
+@unittest.skipUnless(TEST_DB_DSN, "需要TEST_DB_DSN指向测试用的PostgreSQL")
+class RecordIngestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.schema = f"test_scheduler_{uuid.uuid4().hex[:8]}"
+        self.conn = psycopg2.connect(TEST_DB_DSN)
+        self.conn.set_client_encoding("UTF8")
+        cursor = self.conn.cursor()
+        cursor.execute(f"CREATE SCHEMA {self.schema}")
+        cursor.execute(f"SET search_path TO {self.schema}")
+        cursor.execute("CREATE TABLE all_stocks_days (id BIGINT PRIMARY KEY, ts_code TEXT, trade_date TEXT)")
+        cursor.executemany("INSERT INTO all_stocks_days VALUES (%s, %s, %s)",
+                           [(1, "000001.SZ", "20240102"), (2, "000001.SZ", "20240103"), (3, "000002.SZ", "20240103")])
+        refresh_scheduler.ensure_history_table(cursor)
+        cursor.execute("""
+            INSERT INTO refresh_history (trigger, method, status, fingerprint, stock_count, finished_at)
+            VALUES ('manual', 'optimized', 'done', %s, 2, now())
+        """, (db_utils.window_fingerprint(cursor, WINDOW_START),))
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.rollback()
+        cursor = self.conn.cursor()
+        cursor.execute(f"DROP SCHEMA {self.schema} CASCADE")
+        self.conn.commit()
+        self.conn.close()
+
+    def ingest(self, rows):
+        """模拟一次实时写入：插入rows后在同一事务中推进指纹"""
+        cursor = self.conn.cursor()
+        cursor.executemany("INSERT INTO all_stocks_days VALUES (%s, %s, %s)", rows)
+        recorded = refresh_scheduler.record_ingest(cursor, WINDOW_START, [row[0] for row in rows], len(rows))
+        self.conn.commit()
+        return recorded
+
+    def history(self):
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT trigger, status, fingerprint, stock_count FROM refresh_history ORDER BY id")
+        rows = cursor.fetchall()
+        self.conn.commit()
+        return rows
+
+    def current_fingerprint(self):
+        fingerprint = db_utils.window_fingerprint(self.conn.cursor(), WINDOW_START)
+        self.conn.commit()
+        return fingerprint
+
+    def test_consecutive_ingests_advance_one_record(self):
+        self.assertTrue(self.ingest([(4, "000002.SZ", "20240102")]))
+        self.assertTrue(self.ingest([(5, "000003.SZ", "20240103")]))
+        history = self.history()
+        self.assertEqual(len(history), 2)
+        self.assertEqual(history[-1], ("ingest", "done", self.current_fingerprint(), 2))
+
+    def test_other_changes_are_left_for_refresh(self):
+        # 外部加载的行没有经过实时写入，上次刷新的指纹不再对应写入前的数据
+        cursor = self.conn.cursor()
+        cursor.execute("INSERT INTO all_stocks_days VALUES (10, '000004.SZ', '20240103')")
+        self.conn.commit()
+        self.assertFalse(self.ingest([(11, "000005.SZ", "20240103")]))
+        self.assertEqual(len(self.history()), 1)
+
+    def test_not_recorded_while_refresh_runs(self):
+        refresh = psycopg2.connect(TEST_DB_DSN)
+        try:
+            cursor = refresh.cursor()
+            cursor.execute("SELECT pg_advisory_lock(%s)", (refresh_scheduler.REFRESH_LOCK_ID,))
+            self.assertFalse(self.ingest([(4, "000002.SZ", "20240102")]))
+        finally:
+            refresh.close()
+        self.assertEqual(len(self.history()), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,171 @@
+"""只读副本路由和写后读LSN固定的测试
+
+用假的连接池代替副本，检查get_read_connection的轮询、主库回退和回放位置判断，
+以及写入位置经由REQUIRED_LSN_PATH在进程间共享。不连接数据库。
+
+用法:
+    python -m pytest tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from contextlib import contextmanager
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psycopg2
+
+import db_utils
+
+PRIMARY = "primary"
+
+
+class FakeCursor:
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=None):
+        self.sql = sql
+
+    def fetchone(self):
+        if "pg_last_wal_replay_lsn" in self.sql:
+            return (self.conn.replayed,)
+        return (self.conn.current,)
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+
+    def __init__(self, name, replayed="0/0", current="0/0"):
+        self.name = name
+        self.replayed = replayed
+        self.current = current
+        self.closed = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        pass
+
+    def commit(self):
+        pass
+
+
+class FakePool:
+
+    def __init__(self, conn, error=None):
+        self.conn = conn
+        self.error = error
+        self.returned = []
+
+    def getconn(self):
+        if self.error is not None:
+            raise self.error
+        return self.conn
+
+    def putconn(self, conn, close=False):
+        self.returned.append((conn, close))
+
+
+@contextmanager
+def fake_primary():
+    yield PRIMARY
+
+
+class ReplicaRoutingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.replicas = [
+            db_utils._Replica({"host": "replica-a", "port": "5432"}),
+            db_utils._Replica({"host": "replica-b", "port": "5432"})
+        ]
+        for replica in self.replicas:
+            replica.pool = FakePool(FakeConnection(replica.name))
+        patches = [
+            mock.patch.object(db_utils, "DB_REPLICAS", [replica.config for replica in self.replicas]),
+            mock.patch.object(db_utils, "_replicas", self.replicas),
+            mock.patch.object(db_utils, "_required_lsn", 0),
+            mock.patch.object(db_utils, "_required_lsn_fd", None),
+            mock.patch.object(db_utils, "_required_lsn_pid", None),
+            mock.patch.object(db_utils, "REQUIRED_LSN_PATH", os.path.join(self.directory, "required_lsn")),
+            mock.patch.object(db_utils, "_prepare_connection", lambda conn: None),
+            mock.patch.object(db_utils, "get_float_connection", fake_primary)
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        if db_utils._required_lsn_fd is not None:
+            os.close(db_utils._required_lsn_fd)
+        shutil.rmtree(self.directory)
+
+    def read_target(self):
+        with db_utils.get_read_connection() as conn:
+            return PRIMARY if conn == PRIMARY else conn.name
+
+    def record_write(self, lsn):
+        db_utils.record_primary_write(FakeConnection(PRIMARY, current=lsn).cursor())
+
+    def test_round_robin_over_replicas(self):
+        targets = {self.read_target() for _ in range(4)}
+        self.assertEqual(targets, {"replica-a:5432", "replica-b:5432"})
+        self.assertEqual([replica.reads for replica in self.replicas], [2, 2])
+
+    def test_primary_reads_use_primary(self):
+        read = db_utils.primary_reads(self.read_target)
+        self.assertEqual(read(), PRIMARY)
+        self.assertEqual(sum(replica.reads for replica in self.replicas), 0)
+
+    def test_unreachable_replica_is_skipped(self):
+        self.replicas[0].pool = FakePool(None, psycopg2.OperationalError("connection refused"))
+        self.assertEqual({self.read_target() for _ in range(4)}, {"replica-b:5432"})
+        self.assertEqual(self.replicas[0].failures, 1)
+
+    def test_lagging_replica_waits_for_recorded_write(self):
+        self.replicas[0].pool.conn.replayed = "1/0"
+        self.record_write("1/0")
+        self.assertEqual({self.read_target() for _ in range(4)}, {"replica-a:5432"})
+        self.record_write("1/10")
+        self.assertEqual(self.read_target(), PRIMARY)
+        self.replicas[1].pool.conn.replayed = "1/10"
+        self.assertEqual(self.read_target(), "replica-b:5432")
+
+    def test_standalone_instance_is_not_caught_up(self):
+        for replica in self.replicas:
+            replica.pool.conn.replayed = None
+        self.record_write("0/10")
+        self.assertEqual(self.read_target(), PRIMARY)
+
+    def test_write_pinned_in_another_process(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                self.record_write("2/0")
+                code = 0
+            finally:
+                os._exit(code)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertEqual(db_utils._required_lsn, 0)
+        self.assertEqual(db_utils.get_required_lsn(), 2 << 32)
+        self.assertEqual(self.read_target(), PRIMARY)
+        self.assertEqual(db_utils.get_replica_status()["required_lsn"], 2 << 32)
+
+    def test_shared_lsn_never_decreases(self):
+        self.record_write("3/0")
+        self.record_write("1/0")
+        self.assertEqual(db_utils._shared_required_lsn(), 3 << 32)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+"""信号推送跨进程共享的测试
+
+用内存中的假事件表代替signal_events，两个SignalFeed实例代表两个工作进程：
+事件id取自事件表，一个进程发出的续传token在另一个进程中也能续传（必要时先补读事件表）。
+不连接数据库。
+
+用法:
+    python -m pytest tests
+"""
+import os
+import sys
+import unittest
+from contextlib import contextmanager
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_utils
+import signal_feed
+import storage
+
+
+class FakeCursor:
+    """只实现监听线程用到的事件表查询"""
+
+    def __init__(self, table):
+        self.table = table
+        self.rows = []
+
+    def execute(self, sql, params=None):
+        if sql == signal_feed.EVENTS_SINCE_SQL:
+            since, limit = params
+            self.rows = [row for row in self.table if row[0] > since][:limit]
+        elif "regclass" in sql:
+            self.rows = [(4242, max((row[0] for row in self.table), default=0))]
+        else:
+            self.rows = []
+
+    def fetchone(self):
+        return self.rows[0]
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConnection:
+
+    def __init__(self, table):
+        self.table = table
+
+    def cursor(self):
+        return FakeCursor(self.table)
+
+    def commit(self):
+        pass
+
+
+def event_row(event_id, ts_code="000001.SZ"):
+    return (event_id, ts_code, f"202401{event_id:02d}", 1.0, 0.0, 0.0)
+
+
+def drain(subscriber):
+    items = []
+    while not subscriber.queue.empty():
+        items.append(subscriber.queue.get_nowait())
+    return items
+
+
+class SharedFeedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.table = [event_row(1), event_row(2), event_row(3)]
+
+        @contextmanager
+        def connection():
+            yield FakeConnection(self.table)
+
+        patches = [
+            mock.patch.object(storage, "is_local", return_value=False),
+            mock.patch.object(db_utils, "get_float_connection", connection),
+            # 不启动真正的LISTEN线程，由测试调用_catch_up()代替通知
+            mock.patch.object(signal_feed.SignalFeed, "_listen", lambda feed: None)
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.first = signal_feed.SignalFeed()
+        self.second = signal_feed.SignalFeed()
+
+    def test_workers_share_event_ids(self):
+        subscriber, _ = self.first.subscribe()
+        self.second.subscribe()
+        self.table.extend([event_row(4), event_row(5, "600000.SH")])
+        self.first._catch_up()
+        received = drain(subscriber)
+        self.assertEqual([seq for seq, _ in received], [4, 5])
+        self.assertEqual(received[1][1]["ts_code"], "600000.SH")
+        self.assertEqual(self.first.stats()["last_event_id"], "db4242-5")
+
+    def test_token_resumes_on_another_worker(self):
+        self.first.subscribe()
+        self.table.extend([event_row(4), event_row(5)])
+        self.first._catch_up()
+        # 客户端在第一个进程收到事件4后断开，重连到还没读到新事件的第二个进程
+        subscriber, resumed = self.second.subscribe(last_event_id=self.first._event_id(4))
+        self.assertTrue(resumed)
+        self.assertEqual([seq for seq, _ in drain(subscriber)], [5])
+
+    def test_foreign_token_is_not_resumed(self):
+        _, resumed = self.second.subscribe(last_event_id="1700000000.123-2")
+        self.assertFalse(resumed)
+
+    def test_local_publish_is_skipped_when_shared(self):
+        self.assertEqual(signal_feed.publish_signals([(7, 1.0, 0.0, 0.0)], {7: ("000001.SZ", "20240107")}), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+"""快照文件的读写测试
+
+服务进程直接输出快照文件中编码好的JSON，输出必须与物化结果后json.dumps的文本逐字节一致。
+不连接数据库。
+
+用法:
+    python -m pytest tests
+"""
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_utils
+import snapshot_store
+
+
+def make_result(close=4, sell=float("nan")):
+    """两只股票的信号结果，包含整数、None和NaN取值"""
+    return {
+        "column_names": db_utils.STOCK_COLUMN_NAMES,
+        "data": [
+            [("000001.SZ", "20240102", 1, 2.5, 3, close, 5, 6, 7, 0, 0, 0, "平安银行", 1.5),
+             ("000001.SZ", "20240103", 1, 2.5, None, 4, 5, 6, 7, 3.25, 0, 0, "平安银行", 0)],
+            [("600000.SH", "20240103", 1, 2.5, 3, 4, 5, 6, 7, 0, 0, 0, None, sell)]
+        ],
+        "page": 1,
+        "stock_count": 2,
+        "total_stocks": 10,
+        "date_range": {"start": "20240102", "end": "20240103", "days": 2},
+        "stock_returns": [
+            {"ts_code": "600000.SH", "name": None, "signal_count": 1, "return_rate": 5},
+            {"ts_code": "000001.SZ", "name": "平安银行", "signal_count": 2, "return_rate": 1.5}
+        ]
+    }
+
+
+class SnapshotStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "snapshot.bin")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_iter_json_matches_materialized_result(self):
+        snapshot_store.write_snapshot(make_result(), self.path)
+        reader = snapshot_store.SnapshotReader(self.path)
+        expected = json.dumps(dict(reader.to_result(), delta=False), ensure_ascii=False).encode("utf-8")
+        self.assertEqual(b"".join(reader.iter_json({"delta": False})), expected)
+        expected = json.dumps({"stock_returns": reader.stock_returns()}, ensure_ascii=False).encode("utf-8")
+        self.assertEqual(b"".join(reader.iter_returns_json()), expected)
+
+    def test_signal_dates(self):
+        snapshot_store.write_snapshot(make_result(), self.path)
+        reader = snapshot_store.SnapshotReader(self.path)
+        self.assertEqual(reader.signal_dates("000001.SZ"), (["20240103"], ["20240102"]))
+        self.assertIsNone(reader.signal_dates("000002.SZ"))
+
+    def test_change_log_between_versions(self):
+        first = snapshot_store.write_snapshot(make_result(sell=2.0), self.path)
+        second = snapshot_store.write_snapshot(make_result(close=4.5, sell=2.0), self.path)
+        reader = snapshot_store.SnapshotReader(self.path)
+        self.assertEqual(second, first + 1)
+        self.assertEqual(reader.changes_since(first)["changed"], ["000001.SZ"])
+        self.assertIsNone(reader.changes_since(first - 1))
+
+    def test_touched_codes_in_change_log(self):
+        """实时写入后的合并更新只比较写入过的股票，不在快照中的股票也记为touched"""
+        first = snapshot_store.write_snapshot(make_result(sell=2.0), self.path)
+        snapshot_store.write_snapshot(make_result(close=4.5, sell=2.0), self.path, ts_codes={"600000.SH", "000002.SZ"})
+        changes = snapshot_store.SnapshotReader(self.path).changes_since(first)
+        self.assertEqual(changes["changed"], [])
+        self.assertEqual(changes["touched"], ["000002.SZ", "600000.SH"])
+
+    def test_memory_snapshot(self):
+        reader = snapshot_store.memory_snapshot(make_result(), 7)
+        self.assertEqual(reader.version, 7)
+        self.assertEqual(reader.ts_codes(), ["000001.SZ", "600000.SH"])
+        self.assertEqual(json.loads(b"".join(reader.iter_json()))["stock_count"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()